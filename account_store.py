@@ -0,0 +1,761 @@
+import os
+import sys
+import json
+import shutil
+import sqlite3
+import threading
+import logging
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+import tracing
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 存储后端:
+# - json: 兼容旧版，整个 accounts.json 读写 (默认)
+# - sqlite: 嵌入式 SQLite (WAL 模式)，单行 upsert，首次启动时自动从 accounts.json 迁移
+ACCOUNT_STORE = os.environ.get("ACCOUNT_STORE", "json").lower()
+ACCOUNTS_FILE = os.environ.get("ACCOUNTS_FILE", os.path.join(BASE_DIR, "accounts.json"))
+ACCOUNTS_DB = os.environ.get("ACCOUNTS_DB", os.path.join(BASE_DIR, "data", "accounts.db"))
+# accounts.json 超过该大小 (字节) 时，批量更新改为流式重写，不再把整个文件读入内存
+ACCOUNTS_STREAM_THRESHOLD = int(os.environ.get("ACCOUNTS_STREAM_THRESHOLD", str(32 * 1024 * 1024)))
+# 单写者服务的 Unix socket (见 account_writer.py)。设置后所有写入都提交给该服务串行执行
+ACCOUNT_WRITER_SOCKET = os.environ.get("ACCOUNT_WRITER_SOCKET")
+
+# 账户在新建时才初始化的字段，以及重新登录 (或导入新 Token) 后需要清除的失效标记
+NEW_ACCOUNT_DEFAULTS = {"tags": [], "status": "active"}
+STALE_STATUS_FIELDS = ("status_reason", "status_updated_at", "token_failures")
+
+# 失效 Token 隔离
+# refresh_token 遇到永久性错误 (Token 过期、授权被撤销、需要 Client Secret 等) 的账户标记为 quarantined，
+# 之后按指数间隔重新检查 (QUARANTINE_BASE_HOURS * 2^(连续失败次数-1)，最长 QUARANTINE_MAX_DAYS 天)，
+# 期间刷新时跳过，不再占用请求预算。通过 main.py 重新登录或导入新 Token 后恢复为 active。
+STATUS_ACTIVE = "active"
+STATUS_QUARANTINED = "quarantined"
+QUARANTINE_BASE_HOURS = float(os.environ.get("QUARANTINE_BASE_HOURS", "24"))
+QUARANTINE_MAX_DAYS = float(os.environ.get("QUARANTINE_MAX_DAYS", "30"))
+
+
+def login_fields(refresh_token, client_id):
+    """登录或导入新 Token 时写入的字段 (与 STALE_STATUS_FIELDS / NEW_ACCOUNT_DEFAULTS 搭配使用)"""
+    return {
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "last_modified_at": datetime.now(timezone.utc).isoformat(),
+        # 显式设置为 active
+        "status": "active",
+    }
+
+
+def quarantine_fields(failures, reason):
+    """第 failures 次永久性失败后写入的隔离字段 (failures 从 1 开始)"""
+    return {
+        "status": STATUS_QUARANTINED,
+        "status_reason": reason,
+        "status_updated_at": datetime.now(timezone.utc).isoformat(),
+        "token_failures": failures,
+    }
+
+
+def quarantine_interval(failures):
+    """连续失败 failures 次后的重新检查间隔 (秒)"""
+    hours = QUARANTINE_BASE_HOURS * (2 ** max(0, failures - 1))
+    return min(hours * 3600, QUARANTINE_MAX_DAYS * 86400)
+
+
+def quarantine_recheck_at(account):
+    """被隔离账户下一次允许刷新的时间戳；未被隔离的账户返回 0"""
+    if account.get("status") != STATUS_QUARANTINED:
+        return 0.0
+    failures = account.get("token_failures") or 1
+    return parse_timestamp(account.get("status_updated_at")) + quarantine_interval(int(failures))
+
+
+class AccountRecord:
+    """
+    流式读取时使用的紧凑账户记录。
+    常用字段放在 __slots__ 中，其余字段 (tags/status 等) 放在 extra 字典里；
+    client_id 做字符串驻留，大量账户共用同一个应用 ID 时只保留一份。
+    """
+
+    __slots__ = ("email", "refresh_token", "client_id", "last_refreshed_at", "last_modified_at", "extra")
+
+    SLOT_FIELDS = ("refresh_token", "client_id", "last_refreshed_at", "last_modified_at")
+
+    def __init__(self, email, data):
+        self.email = email
+        data = dict(data)
+        self.refresh_token = data.pop("refresh_token", None)
+        client_id = data.pop("client_id", None)
+        self.client_id = sys.intern(client_id) if isinstance(client_id, str) else client_id
+        self.last_refreshed_at = data.pop("last_refreshed_at", None)
+        self.last_modified_at = data.pop("last_modified_at", None)
+        self.extra = data or None
+
+    def get(self, name, default=None):
+        if name in self.SLOT_FIELDS:
+            value = getattr(self, name)
+            return default if value is None else value
+        if self.extra:
+            return self.extra.get(name, default)
+        return default
+
+    def to_dict(self):
+        """还原为普通字典 (字段顺序与原始数据可能不同)"""
+        data = {}
+        for name in self.SLOT_FIELDS:
+            value = getattr(self, name)
+            if value is not None:
+                data[name] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+
+def iter_json_accounts(path, chunk_size=1 << 16):
+    """
+    增量解析 accounts.json ({email: account, ...})，逐个返回 (email, account_dict)。
+    每次只在内存中保留一个账户及一小块读缓冲，不会构建完整的文档。
+    """
+    decoder = json.JSONDecoder()
+    whitespace = " \t\r\n"
+
+    with open(path, "r", encoding="utf-8") as f:
+        buf = ""
+        pos = 0
+        eof = False
+
+        def fill():
+            nonlocal buf, pos, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buf = buf[pos:] + chunk
+            pos = 0
+
+        def peek():
+            # 跳过空白并返回下一个字符 (文件结束返回空字符串)
+            nonlocal pos
+            while True:
+                while pos < len(buf) and buf[pos] in whitespace:
+                    pos += 1
+                if pos < len(buf) or eof:
+                    return buf[pos:pos + 1]
+                fill()
+
+        def expect(char):
+            nonlocal pos
+            found = peek()
+            if found != char:
+                raise ValueError(f"{path}: 期望 {char!r}，实际为 {found!r} (偏移 {f.tell()})")
+            pos += 1
+
+        def value():
+            nonlocal pos
+            peek()
+            while True:
+                try:
+                    obj, end = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    fill()
+                    continue
+                # 数字等标量可能恰好在缓冲区末尾被截断，读到更多数据后再确认
+                if end == len(buf) and not eof and not isinstance(obj, (dict, list, str)):
+                    fill()
+                    continue
+                pos = end
+                return obj
+
+        if peek() == "":
+            return
+        expect("{")
+        if peek() != "}":
+            while True:
+                email = value()
+                expect(":")
+                yield email, value()
+                if peek() != ",":
+                    break
+                pos += 1
+        expect("}")
+        # 与 json.load 一致: 结束的 } 之后不允许再有内容 (如写入中途损坏的文件)
+        if peek() != "":
+            raise ValueError(f"{path}: 文档结束后存在多余内容 (偏移 {f.tell()})")
+
+
+def write_json_accounts(f, items):
+    """以与 json.dump(data, indent=2, ensure_ascii=False) 相同的格式流式写出 (email, account)"""
+    first = True
+    for email, account in items:
+        f.write("{\n" if first else ",\n")
+        body = json.dumps(account, indent=2, ensure_ascii=False).replace("\n", "\n  ")
+        f.write(f"  {json.dumps(email, ensure_ascii=False)}: {body}")
+        first = False
+    f.write("{}" if first else "\n}")
+
+
+class AccountStore:
+    """
+    账户存储接口。所有邮箱查找均忽略大小写，返回值中的 key 为存储中实际使用的邮箱写法。
+    账户数据是一个普通字典 (refresh_token, client_id, last_modified_at, tags, status ...)。
+    """
+
+    location = ""
+    # 批量写回的建议批次大小；None 表示攒到最后一次写入 (整文件重写的后端)
+    write_batch_size = None
+
+    def exists(self):
+        """底层存储是否已存在 (JSON 文件或数据库)"""
+        raise NotImplementedError
+
+    def load_all(self):
+        """返回 {email: account} 字典，读取失败时抛出异常"""
+        raise NotImplementedError
+
+    def get(self, email):
+        """按邮箱 (忽略大小写) 查找，返回 (key, account)，不存在返回 (None, None)"""
+        raise NotImplementedError
+
+    def upsert(self, email, fields, remove=(), defaults=None):
+        """
+        新增或更新单个账户，返回 (key, created)。
+
+        Args:
+            email (str): 邮箱，已存在时沿用原有写法
+            fields (dict): 需要写入的字段
+            remove (iterable[str]): 需要删除的字段
+            defaults (dict | None): 仅在新建账户时写入的初始字段
+        """
+        raise NotImplementedError
+
+    def update_many(self, updates):
+        """
+        批量更新已存在的账户 {email: fields}，不存在的账户会被忽略。
+        返回实际更新的数量。
+        """
+        raise NotImplementedError
+
+    def apply_batch(self, mutations):
+        """
+        在一次提交中执行多个写操作 (单写者服务的 group commit)，按顺序返回每个操作的结果。
+
+        mutations 中的每一项:
+            {"op": "upsert", "email", "fields", "remove", "defaults"} -> {"key", "created"}
+            {"op": "update", "email", "fields", "remove"} -> {"key"} (账户不存在时 key 为 None，remove 可省略)
+        """
+        results = []
+        for m in mutations:
+            if m["op"] == "upsert":
+                key, created = self.upsert(m["email"], m["fields"], m.get("remove", ()), m.get("defaults"))
+                results.append({"key": key, "created": created})
+            else:
+                key, _ = self.get(m["email"])
+                if key is not None:
+                    if m.get("remove"):
+                        self.upsert(key, m["fields"], m["remove"])
+                    else:
+                        self.update_many({key: m["fields"]})
+                results.append({"key": key})
+        return results
+
+    def signature(self):
+        """返回可比较的版本标识，存储被任意进程修改后会发生变化"""
+        raise NotImplementedError
+
+    def iter_records(self):
+        """流式遍历所有账户，逐个返回 AccountRecord (读取失败时抛出异常)"""
+        for email, data in self.load_all().items():
+            yield AccountRecord(email, data)
+
+    def iter_records_for(self, emails):
+        """按邮箱 (忽略大小写) 返回指定账户的 AccountRecord，不存在的账户被忽略；用于只刷新一小批账户"""
+        for email in emails:
+            key, account = self.get(email)
+            if key is not None:
+                yield AccountRecord(key, account)
+
+    def count(self):
+        return len(self.load_all())
+
+
+def parse_timestamp(value):
+    """解析 ISO 时间字符串为 Unix 时间戳，无效值返回 0"""
+    if not value:
+        return 0.0
+    try:
+        dt = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return 0.0
+    if dt.tzinfo is None:
+        # 旧版 token_refresher 写入的是本地时间
+        dt = dt.astimezone()
+    return dt.timestamp()
+
+
+def last_touched(account):
+    """账户最近一次被刷新或重新登录的时间戳"""
+    return max(parse_timestamp(account.get("last_refreshed_at")),
+               parse_timestamp(account.get("last_modified_at")))
+
+
+def _merge(account, fields, remove=()):
+    account.update(fields)
+    for name in remove:
+        account.pop(name, None)
+    return account
+
+
+_copy_warned = False
+
+
+def _replace_file(tmp_path, path):
+    """
+    用临时文件原子替换目标文件。
+    旧版 docker-compose 单独挂载 accounts.json 时 rename 会失败，只能退化为流式拷回原文件 (非原子，
+    其它进程可能读到写了一半的文件)，因此会记录警告；应把文件放进目录挂载中 (如 data/accounts.json)。
+    """
+    try:
+        if os.path.exists(path):
+            shutil.copymode(path, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        global _copy_warned
+        if not _copy_warned:
+            logger.warning(f"⚠️ 无法原子替换 {path} ({e})，改为原地拷贝；请把账户文件放在目录挂载中 (如 data/accounts.json)")
+            _copy_warned = True
+        with open(tmp_path, "r", encoding="utf-8") as src, open(path, "w", encoding="utf-8") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(tmp_path)
+
+
+class JsonAccountStore(AccountStore):
+    """accounts.json 后端 (与旧版文件格式完全兼容)"""
+
+    def __init__(self, path=ACCOUNTS_FILE):
+        self.path = path
+        self.location = path
+        self._lock = threading.Lock()
+        # 读写共用的缓存: 文件签名未变化时无需重新解析整个文件
+        self._cache = None
+        self._cache_signature = None
+        # LOWER(email) -> 实际 key，随 _cache 一起失效，按邮箱查找为 O(1)
+        self._keys = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load_all(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load_for_write(self):
+        signature = self.signature()
+        if self._cache is None or signature is None or signature != self._cache_signature:
+            with tracing.span("accounts_json.parse", "store"):
+                self._cache = self.load_all()
+            self._cache_signature = signature
+            self._keys = None
+        return self._cache
+
+    def _key_map(self, data):
+        """data (即 _cache) 的 LOWER(email) -> 实际 key 映射，调用方需持有 self._lock 并在新增账户时同步更新"""
+        if self._keys is None:
+            self._keys = {key.lower(): key for key in data}
+        return self._keys
+
+    def _write_all(self, data):
+        # 先完整写出临时文件再替换，读者不会看到写了一半的文件
+        tmp_path = self.path + ".tmp"
+        try:
+            with tracing.span("accounts_json.rewrite", "store", accounts=len(data)):
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+                _replace_file(tmp_path, self.path)
+        except Exception:
+            self._cache = None
+            self._keys = None
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._cache = data
+        self._cache_signature = self.signature()
+
+    def _find_key(self, data, email):
+        if email in data:
+            return email
+        return self._key_map(data).get(email.lower())
+
+    def get(self, email):
+        # 文件未变化时直接查缓存；返回副本，调用方修改不会影响缓存
+        with self._lock:
+            data = self._load_for_write() if self.exists() else {}
+            key = self._find_key(data, email)
+            if key is None:
+                return None, None
+            return key, dict(data[key])
+
+    def upsert(self, email, fields, remove=(), defaults=None):
+        with self._lock:
+            data = self._load_for_write()
+            key = self._find_key(data, email)
+            created = key is None
+            if created:
+                key = email
+                data[key] = dict(defaults or {})
+                self._key_map(data)[key.lower()] = key
+            _merge(data[key], fields, remove)
+            self._write_all(data)
+        return key, created
+
+    def iter_records(self):
+        if not os.path.exists(self.path):
+            return
+        for email, data in iter_json_accounts(self.path):
+            yield AccountRecord(email, data)
+
+    def iter_records_for(self, emails):
+        wanted = {email.lower() for email in emails}
+        if self._is_large():
+            # 大文件不整体载入内存，流式筛选
+            for email, data in iter_json_accounts(self.path):
+                if email.lower() in wanted:
+                    yield AccountRecord(email, data)
+            return
+        # 文件未变化时复用写入路径的缓存，不重新解析
+        with self._lock:
+            data = self._load_for_write() if self.exists() else {}
+            records = [AccountRecord(key, account) for key, account in data.items() if key.lower() in wanted]
+        yield from records
+
+    def _update_streaming(self, updates, removes=None):
+        """
+        大文件: 边读边写到临时文件，内存中只保留待更新的字段。
+        removes: {email: 需要删除的字段}，可省略。
+        返回 {LOWER(email): 实际 key}，只包含找到并更新的账户。
+        """
+        by_key = {email.lower(): fields for email, fields in updates.items()}
+        remove_by_key = {email.lower(): names for email, names in (removes or {}).items()}
+        updated = {}
+
+        def merged():
+            for email, account in iter_json_accounts(self.path):
+                fields = by_key.get(email.lower())
+                if fields is not None:
+                    _merge(account, fields, remove_by_key.get(email.lower(), ()))
+                    updated[email.lower()] = email
+                yield email, account
+
+        tmp_path = self.path + ".tmp"
+        with tracing.span("accounts_json.stream_rewrite", "store", updates=len(updates)):
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                write_json_accounts(f, merged())
+            if updated:
+                _replace_file(tmp_path, self.path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        self._cache = None
+        self._keys = None
+        return updated
+
+    def update_many(self, updates):
+        if not updates:
+            return 0
+        with self._lock:
+            if self._is_large():
+                return len(self._update_streaming(updates))
+            data = self._load_for_write()
+            updated = 0
+            for email, fields in updates.items():
+                key = self._find_key(data, email)
+                if key is None:
+                    continue
+                _merge(data[key], fields)
+                updated += 1
+            if updated:
+                self._write_all(data)
+        return updated
+
+    def _is_large(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > ACCOUNTS_STREAM_THRESHOLD
+
+    def apply_batch(self, mutations):
+        # 整批只解析一次、写一次文件
+        with self._lock:
+            if self._is_large() and all(m["op"] == "update" for m in mutations):
+                # 大文件上的纯更新批次 (如刷新结果) 走流式重写
+                updates = {}
+                removes = {}
+                for m in mutations:
+                    updates.setdefault(m["email"], {}).update(m["fields"])
+                    if m.get("remove"):
+                        removes.setdefault(m["email"], []).extend(m["remove"])
+                matched = self._update_streaming(updates, removes)
+                return [{"key": matched.get(m["email"].lower())} for m in mutations]
+            data = self._load_for_write()
+            results = []
+            changed = False
+            for m in mutations:
+                email = m["email"]
+                key = self._find_key(data, email)
+                if m["op"] == "upsert":
+                    created = key is None
+                    if created:
+                        key = email
+                        data[key] = dict(m.get("defaults") or {})
+                        self._key_map(data)[key.lower()] = key
+                    _merge(data[key], m["fields"], m.get("remove", ()))
+                    results.append({"key": key, "created": created})
+                    changed = True
+                else:
+                    if key is not None:
+                        _merge(data[key], m["fields"], m.get("remove", ()))
+                        changed = True
+                    results.append({"key": key})
+            if changed:
+                self._write_all(data)
+        return results
+
+    def signature(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class SqliteAccountStore(AccountStore):
+    """
+    SQLite 后端 (WAL 模式)。
+    每个账户一行，以 LOWER(email) 为主键，单个账户的写入只影响一行。
+    """
+
+    write_batch_size = 500
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS accounts (
+            email_key TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS store_meta (
+            name TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    def __init__(self, path=ACCOUNTS_DB, json_path=ACCOUNTS_FILE, auto_migrate=True):
+        self.path = path
+        self.location = path
+        self._local = threading.local()
+        self._watch_lock = threading.Lock()
+        self._watch_conn = None
+
+        db_dir = os.path.dirname(path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        if auto_migrate:
+            self._migrate_once(json_path)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _conn(self):
+        # sqlite3 连接不能跨线程使用，每个线程 (Flask 请求线程、刷新线程) 各持有一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _migrate_once(self, json_path):
+        conn = self._conn()
+        done = conn.execute("SELECT value FROM store_meta WHERE name = 'migrated_from_json'").fetchone()
+        if done or not json_path or not os.path.exists(json_path):
+            return
+        imported = migrate_json_to_sqlite(json_path, self)
+        logger.info(f"📦 已从 {json_path} 迁移 {imported} 个账户到 {self.path}")
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load_all(self):
+        rows = self._conn().execute("SELECT email, data FROM accounts ORDER BY rowid").fetchall()
+        return {email: json.loads(data) for email, data in rows}
+
+    def iter_records(self):
+        # 使用独立连接遍历，避免与同一线程中的写事务互相影响
+        conn = self._connect()
+        try:
+            for email, data in conn.execute("SELECT email, data FROM accounts ORDER BY rowid"):
+                yield AccountRecord(email, json.loads(data))
+        finally:
+            conn.close()
+
+    def get(self, email):
+        row = self._conn().execute(
+            "SELECT email, data FROM accounts WHERE email_key = ?", (email.lower(),)
+        ).fetchone()
+        if row is None:
+            return None, None
+        return row[0], json.loads(row[1])
+
+    def _write_row(self, conn, key, account):
+        conn.execute(
+            """
+            INSERT INTO accounts (email_key, email, data) VALUES (?, ?, ?)
+            ON CONFLICT(email_key) DO UPDATE SET data = excluded.data
+            """,
+            (key.lower(), key, json.dumps(account, ensure_ascii=False)),
+        )
+
+    def upsert(self, email, fields, remove=(), defaults=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            key, account = self.get(email)
+            created = key is None
+            if created:
+                key, account = email, dict(defaults or {})
+            self._write_row(conn, key, _merge(account, fields, remove))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return key, created
+
+    def update_many(self, updates):
+        if not updates:
+            return 0
+        conn = self._conn()
+        updated = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for email, fields in updates.items():
+                key, account = self.get(email)
+                if key is None:
+                    continue
+                self._write_row(conn, key, _merge(account, fields))
+                updated += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return updated
+
+    def apply_batch(self, mutations):
+        # 整批在一个事务中提交
+        with tracing.span("accounts_sqlite.apply_batch", "store", mutations=len(mutations)):
+            return self._apply_batch(mutations)
+
+    def _apply_batch(self, mutations):
+        conn = self._conn()
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for m in mutations:
+                key, account = self.get(m["email"])
+                if m["op"] == "upsert":
+                    created = key is None
+                    if created:
+                        key, account = m["email"], dict(m.get("defaults") or {})
+                    self._write_row(conn, key, _merge(account, m["fields"], m.get("remove", ())))
+                    results.append({"key": key, "created": created})
+                else:
+                    if key is not None:
+                        self._write_row(conn, key, _merge(account, m["fields"], m.get("remove", ())))
+                    results.append({"key": key})
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return results
+
+    def import_accounts(self, data):
+        """批量写入 {email: account} (覆盖同名账户)，用于迁移"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for key, account in data.items():
+                self._write_row(conn, key, account)
+            conn.execute(
+                "INSERT OR REPLACE INTO store_meta (name, value) VALUES ('migrated_from_json', datetime('now'))"
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(data)
+
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def signature(self):
+        # PRAGMA data_version 在其它连接提交后会变化；专用的只读连接能看到所有写入 (包括本进程其它线程)
+        with self._watch_lock:
+            if self._watch_conn is None:
+                self._watch_conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            return self._watch_conn.execute("PRAGMA data_version").fetchone()[0]
+
+
+def migrate_json_to_sqlite(json_path=ACCOUNTS_FILE, store=None):
+    """把 accounts.json 一次性导入 SQLite，返回导入的账户数"""
+    if store is None:
+        store = SqliteAccountStore(auto_migrate=False)
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return store.import_accounts(data)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def open_store():
+    """按 ACCOUNT_STORE 环境变量创建直接读写底层文件/数据库的存储实例"""
+    if ACCOUNT_STORE == "sqlite":
+        return SqliteAccountStore()
+    if ACCOUNT_STORE == "json":
+        return JsonAccountStore()
+    raise ValueError(f"未知的 ACCOUNT_STORE: {ACCOUNT_STORE}")
+
+
+def get_store():
+    """
+    返回进程内共享的存储实例。
+    配置了 ACCOUNT_WRITER_SOCKET 时，读取仍直接访问底层存储，写入提交给单写者服务。
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if ACCOUNT_WRITER_SOCKET:
+                import account_writer
+                _store = account_writer.WriterAccountStore(open_store(), ACCOUNT_WRITER_SOCKET)
+            else:
+                _store = open_store()
+        return _store
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        store = SqliteAccountStore(auto_migrate=False)
+        count = migrate_json_to_sqlite(ACCOUNTS_FILE, store)
+        print(f"✅ 已迁移 {count} 个账户: {ACCOUNTS_FILE} -> {ACCOUNTS_DB}")
+    else:
+        print("用法: python account_store.py migrate")
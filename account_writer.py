@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import signal
+import threading
+import socketserver
+import logging
+from concurrent.futures import Future
+from dotenv import load_dotenv
+import account_store
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 单写者账户服务
+# 独占账户存储的写入: main.py (登录)、token_refresher (轮换 Token) 等进程通过 Unix socket 提交写操作，
+# 服务端把同一时间段内到达的写操作合并为一次提交 (group commit)，JSON 后端每批只重写一次文件 (临时文件 + 原子替换)。
+# ACCOUNT_WRITER_SOCKET: socket 路径，需放在各容器共享的目录中 (如 /app/data)
+# ACCOUNT_WRITER_MAX_BATCH: 每次提交最多合并的请求数
+# ACCOUNT_WRITER_LINGER_MS: 收到第一个请求后最多再等待多少毫秒以攒批
+# ACCOUNT_WRITER_TIMEOUT: 客户端等待服务端响应的超时时间 (秒)
+# ACCOUNT_WRITER_CONNECT_WAIT: 服务未运行 (如容器启动顺序) 时客户端按退避重试连接的最长时间 (秒)，之后写入失败
+ACCOUNT_WRITER_MAX_BATCH = max(1, int(os.environ.get("ACCOUNT_WRITER_MAX_BATCH", "256")))
+ACCOUNT_WRITER_LINGER_MS = float(os.environ.get("ACCOUNT_WRITER_LINGER_MS", "5"))
+ACCOUNT_WRITER_TIMEOUT = float(os.environ.get("ACCOUNT_WRITER_TIMEOUT", "60"))
+ACCOUNT_WRITER_CONNECT_WAIT = float(os.environ.get("ACCOUNT_WRITER_CONNECT_WAIT", "30"))
+
+
+class WriterUnavailable(Exception):
+    """无法连接单写者服务"""
+
+
+class AccountWriter:
+    """服务端: 从队列中取出写请求，按批次提交到底层存储"""
+
+    def __init__(self, store, max_batch=ACCOUNT_WRITER_MAX_BATCH, linger_ms=ACCOUNT_WRITER_LINGER_MS):
+        self.store = store
+        self.max_batch = max_batch
+        self.linger = linger_ms / 1000.0
+        self.commits = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="account-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, mutations):
+        """提交一组写操作 (来自同一个客户端请求，原子地出现在同一批中)，返回 Future"""
+        future = Future()
+        self._queue.put((mutations, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.linger
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        mutations = [m for request, _ in batch for m in request]
+        started = time.monotonic()
+        try:
+            results = self.store.apply_batch(mutations)
+        except Exception as e:
+            logger.error(f"❌ 批量写入失败 ({len(batch)} 个请求): {e}")
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        self.commits += 1
+        offset = 0
+        for request, future in batch:
+            future.set_result(results[offset:offset + len(request)])
+            offset += len(request)
+        logger.info(f"💾 group commit: {len(batch)} 个请求 / {len(mutations)} 个写操作，耗时 {(time.monotonic() - started) * 1000:.1f}ms")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # 协议: 每行一个 JSON 请求 {"mutations": [...]}，响应 {"results": [...]} 或 {"error": "..."}
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                results = self.server.writer.submit(request["mutations"]).result()
+                response = {"results": results}
+            except Exception as e:
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # 大量客户端同时连接时 (如一批登录回调) 不要让 listen 队列溢出
+    request_queue_size = 128
+
+
+def serve(socket_path=account_store.ACCOUNT_WRITER_SOCKET, store=None):
+    """启动单写者服务 (阻塞)，返回前清理 socket 文件"""
+    store = store or account_store.open_store()
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    socket_dir = os.path.dirname(socket_path)
+    if socket_dir and not os.path.exists(socket_dir):
+        os.makedirs(socket_dir)
+
+    server = _Server(socket_path, _Handler)
+    server.writer = AccountWriter(store).start()
+
+    def shutdown(signum, frame):
+        logger.info(f"🛑 接收到信号 {signal.Signals(signum).name}，正在停止...")
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    logger.info(f"🖊️ 单写者账户服务已启动: {socket_path} -> {store.location}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+    logger.info("👋 单写者账户服务已退出")
+
+
+class AccountWriterClient:
+    """
+    客户端: 每个线程保持一个到服务端的连接，断开后自动重连一次。
+    服务未运行时按退避重试最多 connect_wait 秒，仍无法连接则抛出 WriterUnavailable，
+    绝不绕过单写者直接写入存储 (否则会重新引入并发写入丢失更新的问题)。
+    """
+
+    def __init__(self, socket_path, timeout=ACCOUNT_WRITER_TIMEOUT, connect_wait=ACCOUNT_WRITER_CONNECT_WAIT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.connect_wait = connect_wait
+        self._local = threading.local()
+
+    def _connect(self):
+        started = time.monotonic()
+        delay = 0.01
+        warned = False
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.socket_path)
+                return sock, sock.makefile("rb")
+            except (FileNotFoundError, ConnectionRefusedError) as e:
+                # 服务没有运行 (socket 文件不存在或已失效)，可能正在启动或重启
+                sock.close()
+                if time.monotonic() - started >= self.connect_wait:
+                    raise WriterUnavailable(f"无法连接单写者服务 {self.socket_path}: {e}") from e
+                if not warned:
+                    logger.warning(f"⏳ 单写者服务未就绪 ({e})，{self.connect_wait:g}s 内重试连接...")
+                    warned = True
+            except BlockingIOError:
+                # 服务端 listen 队列已满，稍后重试
+                sock.close()
+                if time.monotonic() - started >= self.timeout:
+                    raise
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def _close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn[1].close()
+            conn[0].close()
+        self._local.conn = None
+
+    def submit(self, mutations):
+        payload = json.dumps({"mutations": mutations}, ensure_ascii=False).encode("utf-8") + b"\n"
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            fresh = conn is None
+            if fresh:
+                conn = self._local.conn = self._connect()
+            try:
+                conn[0].sendall(payload)
+                line = conn[1].readline()
+                if not line:
+                    raise ConnectionError("连接被服务端关闭")
+            except OSError:
+                self._close()
+                # 复用的连接可能已被服务端重启断开，用新连接重试一次；新连接上的失败不重试，避免重复写入
+                if fresh or attempt:
+                    raise
+                continue
+            response = json.loads(line)
+            if "error" in response:
+                raise RuntimeError(response["error"])
+            return response["results"]
+
+
+class WriterAccountStore(account_store.AccountStore):
+    """
+    读取直接访问底层存储，写入提交给单写者服务。
+    服务不可用时写入抛出 WriterUnavailable (由调用方按写入失败处理)，不会退化为直接写入。
+    """
+
+    def __init__(self, base, socket_path):
+        self.base = base
+        self.location = base.location
+        self.write_batch_size = base.write_batch_size
+        self.client = AccountWriterClient(socket_path)
+
+    def exists(self):
+        return self.base.exists()
+
+    def load_all(self):
+        return self.base.load_all()
+
+    def get(self, email):
+        return self.base.get(email)
+
+    def iter_records(self):
+        return self.base.iter_records()
+
+    def iter_records_for(self, emails):
+        return self.base.iter_records_for(emails)
+
+    def signature(self):
+        return self.base.signature()
+
+    def count(self):
+        return self.base.count()
+
+    def apply_batch(self, mutations):
+        return self.client.submit(mutations)
+
+    def upsert(self, email, fields, remove=(), defaults=None):
+        result = self.apply_batch([{
+            "op": "upsert", "email": email, "fields": fields,
+            "remove": list(remove), "defaults": defaults,
+        }])[0]
+        return result["key"], result["created"]
+
+    def update_many(self, updates):
+        if not updates:
+            return 0
+        results = self.apply_batch([{"op": "update", "email": email, "fields": fields} for email, fields in updates.items()])
+        return sum(1 for r in results if r["key"] is not None)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not account_store.ACCOUNT_WRITER_SOCKET:
+        logger.error("❌ 请设置 ACCOUNT_WRITER_SOCKET (如 /app/data/account_writer.sock)")
+        sys.exit(1)
+    if "--check" in sys.argv[1:]:
+        # 健康检查 (docker-compose healthcheck): 服务正在监听时退出码为 0
+        try:
+            AccountWriterClient(account_store.ACCOUNT_WRITER_SOCKET, timeout=5, connect_wait=0)._connect()[0].close()
+        except (WriterUnavailable, OSError) as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        sys.exit(0)
+    serve()
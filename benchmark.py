@@ -0,0 +1,532 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # Windows: 不统计峰值内存
+    resource = None
+
+# 刷新 / 同步性能基准
+# 不访问 login.microsoftonline.com，也不需要真实 Token:
+# - 本地 mock Token 端点，可配置延迟、错误率与 429 限流
+# - 生成 1k / 10k / 100k 个账户的合成 accounts.json
+# - sync_db 使用 BENCH_DB_URL 指定的 PostgreSQL；未设置时尝试用本机的 initdb / pg_ctl 启动临时实例，
+#   都不可用时使用替身 (只测量客户端部分，结果标记为 standin)
+# 每个阶段在独立的子进程中执行，分别统计耗时、吞吐量、峰值 RSS 与数据库往返次数；
+# 结果追加到 logs/benchmark_history.jsonl，并与参数相同的上一次运行对比。
+#
+# 用法:
+#   python benchmark.py generate 10000 -o bench_accounts.json
+#   python benchmark.py mock-server --profile throttled --port 8900
+#   python benchmark.py run --accounts 10000 --profile realistic
+HISTORY_FILE = os.path.join("logs", "benchmark_history.jsonl")
+
+# mock Token 端点的预设场景
+# latency/jitter: 每个请求的延迟 (秒)，均匀分布在 latency ± jitter
+# error_rate: 返回 invalid_grant (永久错误) 的比例
+# server_error_rate: 返回 503 (临时错误，会被重试) 的比例
+# throttle_rps: 超过该每秒请求数时返回 429 + Retry-After (0 表示不限流)
+PROFILES = {
+    "fast": {"latency": 0.0, "jitter": 0.0, "error_rate": 0.0, "server_error_rate": 0.0, "throttle_rps": 0},
+    "realistic": {"latency": 0.15, "jitter": 0.05, "error_rate": 0.01, "server_error_rate": 0.0, "throttle_rps": 0},
+    "flaky": {"latency": 0.05, "jitter": 0.02, "error_rate": 0.02, "server_error_rate": 0.05, "throttle_rps": 0},
+    "throttled": {"latency": 0.05, "jitter": 0.02, "error_rate": 0.0, "server_error_rate": 0.0, "throttle_rps": 20},
+}
+
+
+# --- 合成账户 ---
+
+def generate_accounts(path, count, client_ids=3, seed=42):
+    """流式写出 count 个合成账户 (格式与 accounts.json 相同)，同一 seed 生成的文件完全一致"""
+    import account_store
+
+    rng = random.Random(seed)
+    apps = [f"00000000-0000-0000-0000-{i:012d}" for i in range(client_ids)]
+    # 上次刷新时间分布在过去 14 天内，与长期运行后的真实分布接近
+    now = time.time()
+
+    def items():
+        for i in range(count):
+            refreshed = datetime.fromtimestamp(now - rng.uniform(0, 14 * 86400), timezone.utc).isoformat()
+            yield f"user{i:07d}@bench.example.com", {
+                "refresh_token": f"0.bench.{i}.{rng.getrandbits(64):016x}",
+                "client_id": apps[i % len(apps)],
+                "last_refreshed_at": refreshed,
+                "tags": [],
+                "status": "active",
+            }
+
+    with open(path, "w", encoding="utf-8") as f:
+        account_store.write_json_accounts(f, items())
+    return path
+
+
+# --- mock Token 端点 ---
+
+class MockIdentityServer(ThreadingHTTPServer):
+    """模拟 /oauth2/v2.0/token 的 refresh_token 授权，在后台线程中运行"""
+
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, server_error_rate=0.0, throttle_rps=0, seed=42):
+        super().__init__(("127.0.0.1", port), _MockHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self.throttle_rps = throttle_rps
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.counts = {}
+
+    @property
+    def token_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/common/oauth2/v2.0/token"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="mock-identity", daemon=True).start()
+        return self
+
+    def reset_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    def decide(self):
+        """返回本次请求的 (状态码, 延迟)"""
+        with self.lock:
+            now = time.monotonic()
+            if self.throttle_rps:
+                while self.recent and now - self.recent[0] > 1:
+                    self.recent.popleft()
+                if len(self.recent) >= self.throttle_rps:
+                    status = 429
+                else:
+                    self.recent.append(now)
+                    status = None
+            else:
+                status = None
+            if status is None:
+                roll = self.rng.random()
+                if roll < self.server_error_rate:
+                    status = 503
+                elif roll < self.server_error_rate + self.error_rate:
+                    status = 400
+                else:
+                    status = 200
+            delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+            self.counts[status] = self.counts.get(status, 0) + 1
+        return status, delay
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头与正文分两次发送，不关闭 Nagle 时 keep-alive 连接上每个请求会多出约 40ms 的延迟确认
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, delay = self.server.decide()
+        if delay:
+            time.sleep(delay)
+        headers = {}
+        if status == 200:
+            body = {
+                "token_type": "Bearer",
+                "expires_in": 3600,
+                "access_token": f"eyJ.bench.{random.getrandbits(64):016x}",
+                "refresh_token": f"0.bench.rotated.{random.getrandbits(64):016x}",
+            }
+        elif status == 400:
+            body = {"error": "invalid_grant",
+                    "error_description": "AADSTS70008: The provided authorization code or refresh token has expired."}
+        elif status == 429:
+            body = {"error": "temporarily_unavailable", "error_description": "Too many requests"}
+            headers["Retry-After"] = "1"
+        else:
+            body = {"error": "temporarily_unavailable", "error_description": "Service unavailable"}
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# --- sync_db 使用的数据库 ---
+
+class RoundTripCounter:
+    """统计数据库往返次数 (每次 execute 计一次，execute_values 的每一页各计一次)"""
+
+    count = 0
+
+
+def counting_cursor_factory():
+    import psycopg2.extensions
+
+    class CountingCursor(psycopg2.extensions.cursor):
+        def execute(self, query, vars=None):
+            RoundTripCounter.count += 1
+            return super().execute(query, vars)
+
+    return CountingCursor
+
+
+def use_postgres(db_url, reset):
+    """让 sync_db 使用 db_url 并统计往返次数，reset=True 时先清空 account_backups (请使用专门的测试库)"""
+    import psycopg2.pool
+    import sync_db
+
+    sync_db.DB_URL = db_url
+    sync_db._pool = psycopg2.pool.ThreadedConnectionPool(1, sync_db.SYNC_POOL_MAX, db_url,
+                                                         cursor_factory=counting_cursor_factory())
+    if reset:
+        conn = sync_db.get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute("CREATE TABLE IF NOT EXISTS account_backups (email TEXT PRIMARY KEY, data TEXT, last_modified_at TIMESTAMPTZ)")
+            cur.execute("TRUNCATE account_backups")
+            conn.commit()
+        finally:
+            sync_db.release_connection(conn)
+    RoundTripCounter.count = 0
+
+
+def start_throwaway_postgres(workdir):
+    """
+    本地装有 PostgreSQL 服务端 (initdb / pg_ctl) 时，在 workdir 中初始化一个只监听 Unix socket 的临时实例，
+    返回 (db_url, stop)；没有可用的服务端 (或以 root 运行导致 initdb 失败) 时返回 (None, None)。
+    """
+    bindir = ""
+    try:
+        bindir = subprocess.run(["pg_config", "--bindir"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    initdb = shutil.which("initdb", path=bindir or None) or shutil.which("initdb")
+    pg_ctl = shutil.which("pg_ctl", path=bindir or None) or shutil.which("pg_ctl")
+    if not initdb or not pg_ctl:
+        return None, None
+
+    data_dir = os.path.join(workdir, "pgdata")
+    # Unix socket 路径有长度限制，单独放在短路径的临时目录中
+    socket_dir = tempfile.mkdtemp(prefix="bench-pg-")
+    shutil.rmtree(data_dir, ignore_errors=True)
+    try:
+        subprocess.run([initdb, "-D", data_dir, "-U", "bench", "--auth=trust", "-E", "UTF8", "--no-sync"],
+                       capture_output=True, text=True, check=True)
+        subprocess.run([pg_ctl, "-D", data_dir, "-o", f"-k {socket_dir} -c listen_addresses='' -F", "-w",
+                        "-l", os.path.join(workdir, "postgres.log"), "start"],
+                       capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"⚠️ 无法启动临时 PostgreSQL: {(e.stderr or e.stdout or '').strip()[:200]}")
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.rmtree(socket_dir, ignore_errors=True)
+        return None, None
+
+    def stop():
+        subprocess.run([pg_ctl, "-D", data_dir, "-m", "immediate", "-w", "stop"], capture_output=True)
+        shutil.rmtree(data_dir, ignore_errors=True)
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+    return f"postgresql:///postgres?host={socket_dir}&user=bench", stop
+
+
+def use_standin():
+    """
+    没有 PostgreSQL 时的替身: 把 sync_db.push_rows 换成只消费待推送行的函数。
+    此时测得的只是客户端部分 (流式读取本地存储、比较哈希、生成行)，不包含数据库的暂存与合并，
+    结果标记为 db=standin，不统计数据库往返次数，推送的行数记为 pushed。
+    """
+    import sync_db
+
+    def push_rows(rows, mode="sync"):
+        # 视为全部写入成功，增量状态照常推进
+        synced = {}
+        count = 0
+        for row in rows:
+            synced[row[1].lower()] = None
+            count += 1
+        return {"inserted": 0, "updated": 0, "skipped": 0, "pushed": count}, synced
+
+    sync_db.push_rows = push_rows
+
+
+# --- 子进程中执行的阶段 ---
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _prepare_child(workdir, env):
+    os.chdir(workdir)
+    os.environ.update(env)
+    # 基准只测量本进程内的直接写入
+    os.environ.pop("ACCOUNT_WRITER_SOCKET", None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    logging.basicConfig(level=os.environ.get("BENCH_LOG_LEVEL", "WARNING"))
+    logging.getLogger().setLevel(os.environ.get("BENCH_LOG_LEVEL", "WARNING"))
+
+
+def phase_refresh(workdir, env):
+    _prepare_child(workdir, env)
+    import token_refresher
+
+    started = time.perf_counter()
+    report = token_refresher.refresh_all_tokens()
+    wall = time.perf_counter() - started
+    return {
+        "wall_seconds": round(wall, 3),
+        "accounts": report["total"],
+        "success": report["success"],
+        "failed": len(report["failed"]),
+        "accounts_per_second": round(report["total"] / wall, 1) if wall else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def phase_sync(workdir, env, full, db_url=None):
+    """
+    full=True: 清空数据库后全量同步 (全部为新增)；
+    full=False: 在全量同步之后再做一次增量同步 (没有变化的账户只比较哈希，不发送到数据库)
+    """
+    _prepare_child(workdir, env)
+    import sync_db
+
+    if db_url:
+        use_postgres(db_url, reset=full)
+    else:
+        use_standin()
+
+    started = time.perf_counter()
+    report = sync_db.sync_to_db(full=full)
+    wall = time.perf_counter() - started
+    stats = report["stats"]
+    total = stats["inserted"] + stats["updated"] + stats["skipped"] + stats.get("pushed", 0)
+    result = {
+        "wall_seconds": round(wall, 3),
+        "db": "postgres" if db_url else "standin",
+        "mode": report.get("mode"),
+        "error": report.get("error"),
+        "accounts": total,
+        "inserted": stats["inserted"],
+        "updated": stats["updated"],
+        "skipped": stats["skipped"],
+        "accounts_per_second": round(total / wall, 1) if wall else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if db_url:
+        result["db_round_trips"] = RoundTripCounter.count
+    else:
+        result["pushed"] = stats.get("pushed", 0)
+    return result
+
+
+def run_phase(func, *args):
+    """在全新的子进程中执行一个阶段，峰值 RSS 互不影响"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(func, *args).result()
+
+
+# --- 基准运行与对比 ---
+
+def load_previous(key):
+    if not os.path.exists(HISTORY_FILE):
+        return None
+    previous = None
+    with open(HISTORY_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("key") == key:
+                previous = entry
+    return previous
+
+
+def print_results(result, previous):
+    print(f"\n📊 基准结果 ({result['key']})")
+    for name, phase in result["phases"].items():
+        line = (f"   {name:<18} {phase['wall_seconds']:>9.3f}s  {phase['accounts_per_second'] or 0:>9.1f} 账户/s"
+                f"  峰值 RSS {phase['peak_rss_mb']} MB")
+        if "db_round_trips" in phase:
+            line += f"  DB 往返 {phase['db_round_trips']}"
+        if "http_requests" in phase:
+            line += f"  HTTP 请求 {phase['http_requests']}"
+        if phase.get("db") == "standin":
+            line += "  [替身: 不含数据库合并]"
+        old = (previous or {}).get("phases", {}).get(name)
+        if old and old.get("wall_seconds"):
+            change = (phase["wall_seconds"] - old["wall_seconds"]) / old["wall_seconds"] * 100
+            line += f"  (耗时 {change:+.1f}% vs {previous['timestamp'][:19]})"
+        print(line)
+
+
+def run_benchmark(args):
+    import account_store
+
+    profile = dict(PROFILES[args.profile])
+    for name in profile:
+        value = getattr(args, name, None)
+        if value is not None:
+            profile[name] = value
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="msgraph-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    source = os.path.join(workdir, f"accounts_{args.accounts}_{args.seed}.json")
+    if not os.path.exists(source):
+        print(f"🧪 生成 {args.accounts} 个合成账户: {source}")
+        generate_accounts(source, args.accounts, seed=args.seed)
+
+    server = MockIdentityServer(seed=args.seed, **profile).start()
+    env = {
+        "TOKEN_URL": server.token_url,
+        "ACCOUNT_STORE": args.store,
+        "ACCOUNTS_FILE": os.path.join(workdir, "accounts.json"),
+        "ACCOUNTS_DB": os.path.join(workdir, "accounts.db"),
+        "SYNC_STATE_FILE": os.path.join(workdir, "sync_state.json"),
+        "METRICS_ENABLED": "False",
+    }
+    db_url, stop_db = args.db_url, None
+    if "sync" in args.phases and not db_url:
+        db_url, stop_db = start_throwaway_postgres(workdir)
+    # 替身不会连接数据库，但 sync_to_db 要求 DB_URL 非空
+    env["DB_URL"] = db_url or "postgresql://standin.invalid/bench"
+    if args.concurrency:
+        env["REFRESH_CONCURRENCY"] = str(args.concurrency)
+    if args.rps is not None:
+        env["REFRESH_RPS"] = str(args.rps)
+    for path in (env["ACCOUNTS_DB"], env["SYNC_STATE_FILE"]):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.copyfile(source, env["ACCOUNTS_FILE"])
+
+    if args.store == "sqlite":
+        store = account_store.SqliteAccountStore(env["ACCOUNTS_DB"], env["ACCOUNTS_FILE"], auto_migrate=False)
+        account_store.migrate_json_to_sqlite(env["ACCOUNTS_FILE"], store)
+
+    phases = {}
+    if "refresh" in args.phases:
+        print(f"🚀 refresh_all_tokens: {args.accounts} 个账户，mock 场景 {args.profile} {profile}")
+        server.reset_counts()
+        phases["refresh"] = run_phase(phase_refresh, workdir, env)
+        counts = server.reset_counts()
+        phases["refresh"]["http_requests"] = sum(counts.values())
+        phases["refresh"]["http_status"] = {str(k): v for k, v in sorted(counts.items())}
+    if "sync" in args.phases:
+        if args.db_url:
+            target = "PostgreSQL"
+        elif db_url:
+            target = "临时 PostgreSQL 实例"
+        else:
+            target = "替身 (未找到 PostgreSQL，只测量客户端部分，不含数据库合并)"
+        print(f"🚀 sync_to_db (全量 + 增量): {target}")
+        try:
+            phases["sync_full"] = run_phase(phase_sync, workdir, env, True, db_url)
+            phases["sync_incremental"] = run_phase(phase_sync, workdir, env, False, db_url)
+        finally:
+            if stop_db:
+                stop_db()
+    server.shutdown()
+
+    key = f"{args.accounts}/{args.profile}/{args.store}/{'postgres' if db_url else 'standin'}"
+    result = {
+        "key": key,
+        "timestamp": datetime.now().isoformat(),
+        "accounts": args.accounts,
+        "profile": args.profile,
+        "mock": profile,
+        "store": args.store,
+        "concurrency": env.get("REFRESH_CONCURRENCY", os.environ.get("REFRESH_CONCURRENCY")),
+        "rps": env.get("REFRESH_RPS", os.environ.get("REFRESH_RPS")),
+        "phases": phases,
+    }
+    previous = load_previous(key)
+    print_results(result, previous)
+
+    history_dir = os.path.dirname(HISTORY_FILE)
+    if history_dir and not os.path.exists(history_dir):
+        os.makedirs(history_dir)
+    with open(HISTORY_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    print(f"📝 结果已追加到: {HISTORY_FILE}")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="刷新 / 同步性能基准 (本地 mock Token 端点)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_gen = sub.add_parser("generate", help="生成合成 accounts.json")
+    p_gen.add_argument("count", type=int, help="账户数 (如 1000 / 10000 / 100000)")
+    p_gen.add_argument("-o", "--output", default="bench_accounts.json")
+    p_gen.add_argument("--seed", type=int, default=42)
+
+    def add_profile_args(p):
+        p.add_argument("--profile", choices=sorted(PROFILES), default="fast", help="mock 场景 (默认 fast)")
+        p.add_argument("--latency", type=float, help="覆盖场景的平均延迟 (秒)")
+        p.add_argument("--jitter", type=float, help="覆盖场景的延迟抖动 (秒)")
+        p.add_argument("--error-rate", dest="error_rate", type=float, help="invalid_grant 比例")
+        p.add_argument("--server-error-rate", dest="server_error_rate", type=float, help="503 比例")
+        p.add_argument("--throttle-rps", dest="throttle_rps", type=int, help="超过该速率返回 429")
+        p.add_argument("--seed", type=int, default=42)
+
+    p_mock = sub.add_parser("mock-server", help="单独启动 mock Token 端点 (设置 TOKEN_URL 指向它)")
+    add_profile_args(p_mock)
+    p_mock.add_argument("--port", type=int, default=8900)
+
+    p_run = sub.add_parser("run", help="运行基准并记录结果")
+    add_profile_args(p_run)
+    p_run.add_argument("--accounts", type=int, default=1000, help="账户数 (默认 1000)")
+    p_run.add_argument("--store", choices=["json", "sqlite"], default="json", help="账户存储后端")
+    p_run.add_argument("--phases", nargs="+", choices=["refresh", "sync"], default=["refresh", "sync"])
+    p_run.add_argument("--concurrency", type=int, help="覆盖 REFRESH_CONCURRENCY")
+    p_run.add_argument("--rps", type=float, help="覆盖 REFRESH_RPS (0 表示不限速)")
+    p_run.add_argument("--db-url", default=os.environ.get("BENCH_DB_URL"),
+                       help="用于 sync_db 的 PostgreSQL (默认 BENCH_DB_URL，未设置时尝试启动临时实例，否则使用替身)")
+    p_run.add_argument("--workdir", help="保留生成的数据与报告的目录 (默认使用临时目录并在结束后删除)")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        generate_accounts(args.output, args.count, seed=args.seed)
+        print(f"✅ 已生成 {args.count} 个账户: {args.output}")
+    elif args.command == "mock-server":
+        profile = dict(PROFILES[args.profile])
+        for name in profile:
+            if getattr(args, name, None) is not None:
+                profile[name] = getattr(args, name)
+        server = MockIdentityServer(port=args.port, seed=args.seed, **profile)
+        print(f"🧪 mock Token 端点 ({args.profile}): TOKEN_URL={server.token_url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+    else:
+        run_benchmark(args)
@@ -0,0 +1,287 @@
+import os
+import io
+import sys
+import csv
+import json
+import time
+import uuid
+import tempfile
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+import account_store
+import token_refresher
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 批量导入: 每攒够多少个账户提交一次写入
+IMPORT_WRITE_BATCH = max(1, int(os.environ.get("IMPORT_WRITE_BATCH", "500")))
+# 后台导入任务 (POST /api/accounts/import): 保留最近多少个任务的状态与报告 (进程内，重启后丢失)
+IMPORT_JOBS_KEEP = max(1, int(os.environ.get("IMPORT_JOBS_KEEP", "100")))
+# POST /api/accounts/import 请求体的大小上限 (字节)，超过时返回 413
+IMPORT_MAX_BYTES = max(1, int(os.environ.get("IMPORT_MAX_BYTES", str(100 * 1024 * 1024))))
+
+
+class UploadTooLarge(Exception):
+    """上传的导入文件超过 IMPORT_MAX_BYTES"""
+
+
+def detect_format(name=None, content_type=None):
+    """按文件名或 Content-Type 判断格式，返回 "csv" 或 "ndjson" """
+    if content_type and "csv" in content_type.lower():
+        return "csv"
+    if name and name.lower().endswith(".csv"):
+        return "csv"
+    return "ndjson"
+
+
+def parse_records(stream, fmt):
+    """
+    从文本流中逐条读取 {email, refresh_token, client_id}。
+    CSV 需包含表头；NDJSON 每行一个 JSON 对象，空行会被忽略。
+    无法解析的行以 {"_error": ...} 返回，由调用方计入失败。
+    """
+    if fmt == "csv":
+        for row in csv.DictReader(stream):
+            yield {k.strip().lower(): (v or "").strip() for k, v in row.items() if k}
+        return
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield {"_error": f"第 {line_no} 行不是有效的 JSON: {e}"}
+            continue
+        yield record if isinstance(record, dict) else {"_error": f"第 {line_no} 行不是 JSON 对象"}
+
+
+def spool_upload(stream, fmt, max_bytes=IMPORT_MAX_BYTES, chunk_size=1 << 16):
+    """
+    把上传的请求体分块写入临时文件并返回路径 (由导入任务负责删除)。
+    写入的字节数超过 max_bytes 时删除临时文件并抛出 UploadTooLarge，不依赖客户端声明的 Content-Length。
+    """
+    with tempfile.NamedTemporaryFile(prefix="import-", suffix=f".{fmt}", delete=False) as f:
+        written = 0
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadTooLarge(f"导入文件超过 {max_bytes} 字节上限")
+                f.write(chunk)
+        except BaseException:
+            f.close()
+            os.remove(f.name)
+            raise
+    return f.name
+
+
+def new_report():
+    return {"total": 0, "created": 0, "updated": 0, "failed": []}
+
+
+def import_accounts(records, validate=True, store=None, concurrency=None, report=None):
+    """
+    批量导入账户，返回报告 {"total", "created", "updated", "failed": [{"email", "reason"}]}。
+
+    validate=True 时先用 refresh_token 向 Token 端点换取新 Token (并发数 REFRESH_CONCURRENCY，
+    使用进程内共享的自适应限速器)，验证失败的账户不会导入，验证成功时保存轮换后的新 refresh_token。
+    写入与 main.save_to_json 使用相同的合并规则: 邮箱忽略大小写匹配现有账户，清除失效标记，新账户写入默认字段。
+    传入 report (new_report()) 时在其中就地累计，导入过程中即可读取进度。
+    """
+    store = store or account_store.get_store()
+    concurrency = concurrency or token_refresher.REFRESH_CONCURRENCY
+    report = new_report() if report is None else report
+    pending = []
+
+    def flush():
+        if not pending:
+            return
+        try:
+            results = store.apply_batch(pending)
+        except Exception as e:
+            logger.error(f"❌ 写入 {len(pending)} 个账户失败: {e}")
+            report["failed"].extend({"email": m["email"], "reason": f"Save Error: {e}"} for m in pending)
+        else:
+            for result in results:
+                report["created" if result["created"] else "updated"] += 1
+        pending.clear()
+
+    def accept(email, refresh_token, client_id):
+        pending.append({
+            "op": "upsert",
+            "email": email,
+            "fields": account_store.login_fields(refresh_token, client_id),
+            "remove": list(account_store.STALE_STATUS_FIELDS),
+            "defaults": account_store.NEW_ACCOUNT_DEFAULTS,
+        })
+        if len(pending) >= IMPORT_WRITE_BATCH:
+            flush()
+
+    def handle(done):
+        for future in done:
+            result = future.result()
+            if result["ok"]:
+                accept(result["email"], result["refresh_token"], result["client_id"])
+            else:
+                report["failed"].append({"email": result["email"], "reason": result["reason"]})
+
+    limiter = token_refresher.shared_limiter()
+    max_in_flight = concurrency * 4
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        for record in records:
+            report["total"] += 1
+            if "_error" in record:
+                report["failed"].append({"email": None, "reason": record["_error"]})
+                continue
+            email = str(record.get("email") or "").strip()
+            refresh_token = record.get("refresh_token")
+            client_id = record.get("client_id")
+            if not email or not refresh_token or not client_id:
+                report["failed"].append({"email": email or None, "reason": "缺少 email / refresh_token / client_id"})
+                continue
+            if not validate:
+                accept(email, refresh_token, client_id)
+                continue
+            account = {"refresh_token": refresh_token, "client_id": client_id}
+            in_flight.add(executor.submit(token_refresher.refresh_account, email, account, limiter))
+            if len(in_flight) >= max_in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                handle(done)
+        done, _ = wait(in_flight)
+        handle(done)
+
+    flush()
+    logger.info(f"📥 导入完成: 共 {report['total']} 条，新增 {report['created']}，更新 {report['updated']}，失败 {len(report['failed'])}")
+    return report
+
+
+class ImportJobs:
+    """
+    后台导入任务: 请求体先写入临时文件，submit 立即返回任务 ID，验证与写入在后台线程中依次执行 (同一时间只运行一个任务)。
+    任务状态: pending -> running -> done / failed，运行中的报告实时更新。只保存在当前进程中。
+    """
+
+    def __init__(self, keep=IMPORT_JOBS_KEEP):
+        self.keep = keep
+        self._jobs = OrderedDict()  # job_id -> job，按提交顺序排列
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="import-job")
+
+    def submit(self, path, fmt, validate):
+        """导入 path 中的账户 (完成后删除该文件)，返回任务快照"""
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "pending",
+            "format": fmt,
+            "validate": validate,
+            "created_at": time.time(),
+            "finished_at": None,
+            "error": None,
+            "report": new_report(),
+        }
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._evict()
+            snapshot = self._snapshot(job)
+        self._executor.submit(self._run, job, path)
+        return snapshot
+
+    def get(self, job_id):
+        """返回任务快照，不存在 (或已被淘汰) 时返回 None"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def _run(self, job, path):
+        job["status"] = "running"
+        try:
+            with open(path, "r", encoding="utf-8-sig", newline="") as stream:
+                import_accounts(parse_records(stream, job["format"]), validate=job["validate"], report=job["report"])
+            job["status"] = "done"
+        except Exception as e:
+            logger.error(f"❌ 导入任务 {job['id']} 失败: {e}")
+            job["error"] = str(e)
+            job["status"] = "failed"
+        finally:
+            job["finished_at"] = time.time()
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self):
+        # 只淘汰已结束的任务，排队和运行中的任务始终可以查询
+        for job_id in [j for j, job in self._jobs.items() if job["finished_at"]]:
+            if len(self._jobs) <= self.keep:
+                break
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job):
+        report = job["report"]
+        return dict(job, report=dict(report, failed=list(report["failed"])))
+
+
+_import_jobs = None
+_import_jobs_lock = threading.Lock()
+
+
+def get_import_jobs():
+    """返回进程内共享的 ImportJobs (首次调用时创建)"""
+    global _import_jobs
+    with _import_jobs_lock:
+        if _import_jobs is None:
+            _import_jobs = ImportJobs()
+        return _import_jobs
+
+
+def export_lines(store=None):
+    """逐个账户生成 NDJSON 行 ({"email": ..., 其余字段})，不会把整个存储读入内存"""
+    store = store or account_store.get_store()
+    for record in store.iter_records():
+        yield json.dumps(dict({"email": record.email}, **record.to_dict()), ensure_ascii=False) + "\n"
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="批量导入 / 导出账户")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_import = sub.add_parser("import", help="从 CSV 或 NDJSON 导入账户 (- 表示标准输入)")
+    p_import.add_argument("file")
+    p_import.add_argument("--format", choices=["csv", "ndjson"], help="默认按扩展名判断")
+    p_import.add_argument("--no-validate", action="store_true", help="不向 Token 端点验证，直接写入")
+    p_export = sub.add_parser("export", help="以 NDJSON 流式导出所有账户")
+    p_export.add_argument("-o", "--output", help="输出文件，默认标准输出")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        fmt = args.format or detect_format(args.file)
+        if args.file == "-":
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="")
+        else:
+            stream = open(args.file, "r", encoding="utf-8-sig", newline="")
+        with stream:
+            result = import_accounts(parse_records(stream, fmt), validate=not args.no_validate)
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+        sys.exit(1 if result["failed"] else 0)
+    else:
+        out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+        try:
+            for line in export_lines():
+                out.write(line)
+        finally:
+            if args.output:
+                out.close()
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from dotenv import load_dotenv
+import account_store
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 登录流程 (MSAL auth_flow，含 code_verifier / state / nonce) 的服务端存储，按 state 查找
+# AUTH_FLOW_STORE:
+# - memory: 进程内字典 (默认，单实例部署)
+# - sqlite: 共享 SQLite 文件，同一主机上的多个 worker 共用
+# - postgres: 使用 DB_URL 中的 PostgreSQL，回调可以落在任意节点的任意 worker 上
+# AUTH_FLOW_TTL_SECONDS: 登录流程的有效期，超时未回调的流程会被清理
+# AUTH_FLOW_MAX: 最多保存的未完成流程数，超出后淘汰最早创建的流程
+AUTH_FLOW_STORE = os.environ.get("AUTH_FLOW_STORE", "memory").lower()
+AUTH_FLOW_TTL_SECONDS = int(os.environ.get("AUTH_FLOW_TTL_SECONDS", "600"))
+AUTH_FLOW_MAX = max(1, int(os.environ.get("AUTH_FLOW_MAX", "10000")))
+AUTH_FLOW_DB = os.environ.get("AUTH_FLOW_DB", os.path.join(account_store.BASE_DIR, "data", "auth_flows.db"))
+
+
+class FlowStore:
+    """
+    接口约定:
+    - put(state, flow): 保存登录流程
+    - pop(state): 取出并删除流程 (每个 state 只能使用一次)，不存在或已过期返回 None
+    """
+
+    def __init__(self, ttl=AUTH_FLOW_TTL_SECONDS, max_entries=AUTH_FLOW_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def put(self, state, flow):
+        raise NotImplementedError
+
+    def pop(self, state):
+        raise NotImplementedError
+
+
+class MemoryFlowStore(FlowStore):
+    """进程内存储，只适用于单个 worker"""
+
+    location = "memory"
+
+    def __init__(self, ttl=AUTH_FLOW_TTL_SECONDS, max_entries=AUTH_FLOW_MAX):
+        super().__init__(ttl, max_entries)
+        self._flows = OrderedDict()  # state -> (expires_at, flow)，按创建顺序排列
+        self._lock = threading.Lock()
+
+    def put(self, state, flow):
+        now = time.time()
+        with self._lock:
+            # 按创建顺序排列，过期的流程一定在最前面
+            while self._flows and next(iter(self._flows.values()))[0] <= now:
+                self._flows.popitem(last=False)
+            self._flows[state] = (now + self.ttl, flow)
+            while len(self._flows) > self.max_entries:
+                self._flows.popitem(last=False)
+
+    def pop(self, state):
+        with self._lock:
+            entry = self._flows.pop(state, None)
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+
+class SqliteFlowStore(FlowStore):
+    """共享 SQLite 文件 (WAL 模式)，同一主机上的多个 worker 进程可共用"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS auth_flows (
+            state TEXT PRIMARY KEY,
+            flow TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS auth_flows_expires_idx ON auth_flows (expires_at);
+    """
+
+    def __init__(self, path=AUTH_FLOW_DB, ttl=AUTH_FLOW_TTL_SECONDS, max_entries=AUTH_FLOW_MAX):
+        super().__init__(ttl, max_entries)
+        self.path = path
+        self.location = path
+        self._local = threading.local()
+
+        db_dir = os.path.dirname(path)
+        if db_dir and not os.path.exists(db_dir):
+            os.makedirs(db_dir)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self):
+        # sqlite3 连接不能跨线程使用，每个请求线程各持有一个
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def put(self, state, flow):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM auth_flows WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO auth_flows (state, flow, expires_at) VALUES (?, ?, ?)",
+                (state, json.dumps(flow), now + self.ttl),
+            )
+            conn.execute(
+                "DELETE FROM auth_flows WHERE state IN ("
+                " SELECT state FROM auth_flows ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def pop(self, state):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT flow, expires_at FROM auth_flows WHERE state = ?", (state,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM auth_flows WHERE state = ?", (state,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+
+class PostgresFlowStore(FlowStore):
+    """使用 DB_URL 指向的 PostgreSQL，多个节点上的 worker 共用"""
+
+    location = "postgres"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS auth_flows (
+            state TEXT PRIMARY KEY,
+            flow TEXT NOT NULL,
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS auth_flows_expires_idx ON auth_flows (expires_at)
+    """
+
+    def __init__(self, ttl=AUTH_FLOW_TTL_SECONDS, max_entries=AUTH_FLOW_MAX):
+        super().__init__(ttl, max_entries)
+        # 延迟导入: 只有使用该后端时才需要 psycopg2 和 DB_URL
+        import sync_db
+        self._db = sync_db
+        self._execute(lambda cur: cur.execute(self.SCHEMA))
+
+    def _execute(self, func):
+        conn = self._db.get_connection()
+        broken = False
+        try:
+            cur = conn.cursor()
+            result = func(cur)
+            conn.commit()
+            cur.close()
+            return result
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self._db.release_connection(conn, broken)
+
+    def put(self, state, flow):
+        def do_put(cur):
+            cur.execute("DELETE FROM auth_flows WHERE expires_at <= NOW()")
+            cur.execute(
+                "INSERT INTO auth_flows (state, flow, expires_at) VALUES (%s, %s, NOW() + make_interval(secs => %s))"
+                " ON CONFLICT (state) DO UPDATE SET flow = EXCLUDED.flow, expires_at = EXCLUDED.expires_at",
+                (state, json.dumps(flow), self.ttl),
+            )
+            cur.execute(
+                "DELETE FROM auth_flows WHERE state IN ("
+                " SELECT state FROM auth_flows ORDER BY expires_at DESC OFFSET %s)",
+                (self.max_entries,),
+            )
+        self._execute(do_put)
+
+    def pop(self, state):
+        def do_pop(cur):
+            cur.execute("DELETE FROM auth_flows WHERE state = %s RETURNING flow, expires_at > NOW()", (state,))
+            return cur.fetchone()
+        row = self._execute(do_pop)
+        if row is None or not row[1]:
+            return None
+        return json.loads(row[0])
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_flow_store():
+    """按 AUTH_FLOW_STORE 环境变量返回进程内共享的流程存储"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            if AUTH_FLOW_STORE == "sqlite":
+                _store = SqliteFlowStore()
+            elif AUTH_FLOW_STORE == "postgres":
+                _store = PostgresFlowStore()
+            else:
+                _store = MemoryFlowStore()
+            logger.info(f"🔐 登录流程存储: {_store.location}")
+        return _store
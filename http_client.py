@@ -0,0 +1,205 @@
+import os
+import socket
+import time
+import logging
+import threading
+import requests
+import requests.adapters
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+import urllib3.util.connection
+import urllib3.util.ssl_
+from dotenv import load_dotenv
+import metrics
+import tracing
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# 进程内共享的 HTTP 客户端 (token_refresher / verify_token / notify 共用)
+# 同一主机的 keep-alive 连接在所有线程与调度轮次之间复用，每个账户不再重新进行 TCP + TLS 握手。
+# HTTP_MAX_PER_HOST: 每个主机最多同时打开的连接数，用满后请求排队等待空闲连接 (应不小于 REFRESH_CONCURRENCY)
+# HTTP_POOL_HOSTS: 保留连接池的主机数 (登录端点、Notify Hub 等)
+# HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT: 调用方未指定 timeout 时使用的连接 / 读取超时 (秒)
+# HTTP_DNS_CACHE_SECONDS: DNS 解析结果的缓存时间，0 表示不缓存。只作用于本模块共享 Session 的连接池，
+#                         不影响进程内其它 requests / urllib3 的使用者 (如 msal)
+# HTTP2_ENABLED: 使用 HTTP/2 (单个连接上多路复用并发请求)，需要额外安装 httpx[http2]，未安装时退回 HTTP/1.1。
+#                httpx 客户端不使用 DNS 缓存，也不计入 HTTP_CONNECTIONS 指标 (HTTP/2 每个主机通常只有一个连接)
+HTTP_MAX_PER_HOST = int(os.environ.get("HTTP_MAX_PER_HOST", "16"))
+HTTP_POOL_HOSTS = int(os.environ.get("HTTP_POOL_HOSTS", "8"))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+HTTP_DNS_CACHE_SECONDS = float(os.environ.get("HTTP_DNS_CACHE_SECONDS", "300"))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "False").lower() == "true"
+
+try:
+    import httpx
+    # httpx 的 HTTP/2 支持依赖 h2
+    import h2  # noqa: F401
+except ImportError:
+    httpx = None
+
+# 调用方捕获网络异常时使用: except http_client.RequestError
+RequestError = (requests.exceptions.RequestException,) + ((httpx.HTTPError,) if httpx else ())
+
+
+class DnsCache:
+    """按 (主机, 端口) 缓存 getaddrinfo 结果，过期或连接全部失败后重新解析"""
+
+    def __init__(self, ttl=HTTP_DNS_CACHE_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host, port, family=socket.AF_UNSPEC):
+        key = (host, port, family)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        with tracing.span("dns.resolve", "http", host=host):
+            addresses = socket.getaddrinfo(host, port, family, socket.SOCK_STREAM)
+        if addresses:
+            with self._lock:
+                self._entries[key] = (now + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host, port, family=socket.AF_UNSPEC):
+        with self._lock:
+            self._entries.pop((host, port, family), None)
+
+
+_dns_cache = DnsCache()
+
+
+class _DnsCachedConnectionMixin:
+    """
+    新建连接时先查 DNS 缓存，再依次尝试解析出的地址。只替换建立 TCP 连接时使用的 _dns_host，
+    TLS 的 SNI 与证书校验仍使用原主机名。
+    """
+
+    def _new_conn(self):
+        host, port = self._dns_host, self.port
+        metrics.HTTP_CONNECTIONS.inc(host=host)
+        if HTTP_DNS_CACHE_SECONDS <= 0 or urllib3.util.ssl_.is_ipaddress(host):
+            return super()._new_conn()
+        family = urllib3.util.connection.allowed_gai_family()
+        try:
+            addresses = _dns_cache.resolve(host, port, family)
+        except OSError:
+            return super()._new_conn()
+        error = None
+        try:
+            for _, _, _, _, sockaddr in addresses:
+                self._dns_host = sockaddr[0]
+                try:
+                    return super()._new_conn()
+                except urllib3.exceptions.ConnectTimeoutError as e:
+                    # NewConnectionError 也是 ConnectTimeoutError 的子类
+                    error = e
+        finally:
+            self._dns_host = host
+        # 缓存的地址全部不可用 (如服务迁移)，下次重新解析
+        _dns_cache.invalidate(host, port, family)
+        if error is None:
+            return super()._new_conn()
+        raise error
+
+
+class _DnsCachedHTTPConnection(_DnsCachedConnectionMixin, urllib3.connection.HTTPConnection):
+    pass
+
+
+class _DnsCachedHTTPSConnection(_DnsCachedConnectionMixin, urllib3.connection.HTTPSConnection):
+    pass
+
+
+class _DnsCachedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+    ConnectionCls = _DnsCachedHTTPConnection
+
+
+class _DnsCachedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+    ConnectionCls = _DnsCachedHTTPSConnection
+
+
+class DnsCachingAdapter(requests.adapters.HTTPAdapter):
+    """只在挂载了该 adapter 的 Session 上使用 DNS 缓存 (不修改 urllib3 的全局函数)"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # 实例属性，不影响其它 PoolManager
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _DnsCachedHTTPConnectionPool,
+            "https": _DnsCachedHTTPSConnectionPool,
+        }
+
+
+class HttpClient:
+    """
+    共享的 HTTP 客户端。默认基于 requests.Session (HTTP/1.1 keep-alive 连接池)，
+    HTTP2_ENABLED=True 且已安装 httpx[http2] 时改用 httpx.Client(http2=True)。
+    两者返回的响应都提供 status_code / text / json() / headers，调用方无需区分。
+    """
+
+    def __init__(self, max_per_host=HTTP_MAX_PER_HOST, pool_hosts=HTTP_POOL_HOSTS, http2=HTTP2_ENABLED):
+        self.default_timeout = (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)
+        self.http2 = bool(http2 and httpx)
+        if http2 and not httpx:
+            logger.warning("⚠️ HTTP2_ENABLED=True 但未安装 httpx[http2]，使用 HTTP/1.1 连接池")
+        if self.http2:
+            self._client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=max_per_host * pool_hosts, max_keepalive_connections=max_per_host),
+            )
+            return
+        session = requests.Session()
+        # pool_block=True: 同一主机的连接数达到上限后等待空闲连接，而不是临时新建再丢弃
+        # 不在连接层重试，重试与退避由调用方 (如 token_refresher) 控制
+        adapter = DnsCachingAdapter(pool_connections=pool_hosts, pool_maxsize=max_per_host,
+                                    pool_block=True, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._client = session
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        if not self.http2:
+            return timeout
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        return self._client.request(method, url, timeout=self._timeout(timeout), **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def close(self):
+        self._client.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """返回进程内共享的 HttpClient (首次调用时创建)"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HttpClient()
+        return _client
+
+
+def post(url, **kwargs):
+    return get_client().post(url, **kwargs)
@@ -1,65 +1,56 @@
-from flask import Flask, request, redirect, url_for, session, render_template_string
+from flask import Flask, request, redirect, url_for, session, render_template_string, jsonify, Response
 import msal
 import os
+import hmac
 import uuid
-import json
-import datetime
+import logging
 from dotenv import load_dotenv
 
-ACCOUNTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "accounts.json")
+import account_store
+import token_cache
+import msal_cache
+import flow_store
+import bulk_io
+import metrics
+import tracing
+
+logger = logging.getLogger(__name__)
+
+def publish_change(email, refresh_token, client_id):
+    """把刚保存的账户实时同步到数据库 (后台线程合并写入，不阻塞回调)；未配置 DB_URL 时什么都不做"""
+    if not os.environ.get("DB_URL"):
+        return
+    # 延迟导入: 未配置数据库时不加载 sync_db / psycopg2
+    import sync_db
+    try:
+        if sync_db.publish_change(email, refresh_token, client_id):
+            logger.debug(f"已排入数据库实时同步: {email}")
+    except Exception as e:
+        # 同步失败不影响登录，下一次定时同步会补上
+        logger.warning(f"⚠️ 实时同步排队失败: {e}")
 
 def save_to_json(email, refresh_token, client_id):
-    """保存或更新账户信息到 JSON 文件"""
-    print(f"DEBUG: 尝试保存到 {ACCOUNTS_FILE}...")
+    """保存或更新账户信息到账户存储 (accounts.json 或 SQLite)"""
+    store = account_store.get_store()
+    print(f"DEBUG: 尝试保存到 {store.location}...")
     print(f"DEBUG: 目标邮箱: {email}")
-    
-    data = {}
-    if os.path.exists(ACCOUNTS_FILE):
-        try:
-            with open(ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-        except Exception as e:
-            print(f"⚠️ 读取 {ACCOUNTS_FILE} 失败: {e}")
 
     # 构造数据
-    now_str = datetime.datetime.now(datetime.timezone.utc).isoformat()
-    
-    # 查找是否存在对应的 Key (忽略大小写)
-    target_key = email
-    for key in data.keys():
-        if key.lower() == email.lower():
-            target_key = key
-            print(f"DEBUG: 找到现有账户: {key} (匹配 {email})")
-            break
-            
-    if target_key not in data:
-        print(f"DEBUG: 创建新账户记录: {target_key}")
-        data[target_key] = {}
-        # 只有新建时才初始化这些
-        data[target_key]["tags"] = []
-        data[target_key]["status"] = "active"
-
-    # 更新字段
-    data[target_key]["refresh_token"] = refresh_token
-    data[target_key]["client_id"] = client_id
-    data[target_key]["last_modified_at"] = now_str
-    
-    # 显式设置为 active
-    data[target_key]["status"] = "active"
-    if "status_reason" in data[target_key]:
-        del data[target_key]["status_reason"]
-    if "status_updated_at" in data[target_key]:
-        del data[target_key]["status_updated_at"]
-    if "token_failures" in data[target_key]:
-        del data[target_key]["token_failures"]
+    fields = account_store.login_fields(refresh_token, client_id)
 
     try:
-        with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        # 存储层按邮箱 (忽略大小写) 定位现有账户并沿用其原有写法
+        target_key, created = store.upsert(email, fields,
+                                           remove=account_store.STALE_STATUS_FIELDS, defaults=account_store.NEW_ACCOUNT_DEFAULTS)
+        if created:
+            print(f"DEBUG: 创建新账户记录: {target_key}")
+        else:
+            print(f"DEBUG: 找到现有账户: {target_key} (匹配 {email})")
         print("DEBUG: 写入成功！")
+        publish_change(target_key, refresh_token, client_id)
         return True, target_key
     except Exception as e:
-        print(f"❌ 写入 {ACCOUNTS_FILE} 失败: {e}")
+        print(f"❌ 写入 {store.location} 失败: {e}")
         return False, str(e)
 
 
@@ -81,7 +72,9 @@ RAW_SCOPES = os.environ.get("SCOPE", "offline_access Files.ReadWrite.All Sites.R
 RESERVED_SCOPES = {'offline_access', 'openid', 'profile'}
 SCOPE = [s for s in RAW_SCOPES if s.lower() not in RESERVED_SCOPES]
 
-AUTHORITY = "https://login.microsoftonline.com/common"
+AUTHORITY = os.environ.get("MSAL_AUTHORITY", "https://login.microsoftonline.com/common")
+# 使用非微软的授权服务器 (如本地测试用的 stub authority) 时需关闭实例发现
+MSAL_INSTANCE_DISCOVERY = os.environ.get("MSAL_INSTANCE_DISCOVERY", "True").lower() == "true"
 
 # 关键配置检查
 if not CLIENT_ID:
@@ -90,20 +83,29 @@ if not CLIENT_ID:
     exit(1)
 
 # --- 2. 初始化 MSAL 应用 ---
+# 设置 MSAL_CACHE_DIR 后预加载持久化的授权元数据，避免每次启动重新发现；Token 不在 MSAL 中缓存
+msal_http_cache = msal_cache.load_http_cache()
 # 根据是否有 CLIENT_SECRET 决定使用 Confidential 还是 Public Client
 if CLIENT_SECRET:
     print("🔒 模式: Confidential Client (Web App)")
     app_msal = msal.ConfidentialClientApplication(
         CLIENT_ID, authority=AUTHORITY,
         client_credential=CLIENT_SECRET,
+        token_cache=msal_cache.DiscardingTokenCache(), http_cache=msal_http_cache,
+        instance_discovery=MSAL_INSTANCE_DISCOVERY,
     )
 else:
     print("📱 模式: Public Client (Desktop/Mobile - No Secret)")
     # 使用 PublicClientApplication，MSAL 会自动处理 PKCE
     app_msal = msal.PublicClientApplication(
-        CLIENT_ID, authority=AUTHORITY
+        CLIENT_ID, authority=AUTHORITY,
+        token_cache=msal_cache.DiscardingTokenCache(), http_cache=msal_http_cache,
+        instance_discovery=MSAL_INSTANCE_DISCOVERY,
     )
 
+# 启动时获取的元数据立即落盘，后续启动的 worker 可直接使用
+msal_cache.save_http_cache(msal_http_cache)
+
 # --- 3. 创建Flask应用 ---
 app = Flask(__name__)
 
@@ -163,31 +165,41 @@ def login():
     if "error" in auth_flow:
         return f"MSAL 初始化失败: {auth_flow.get('error_description')}", 500
 
-    # 2. 将 flow 对象存入 session，回调时需要用到
-    # flow 中包含了 code_verifier，这是 PKCE 的关键
-    session["flow"] = auth_flow
+    # 2. 将 flow 对象按 state 存入服务端存储，回调时需要用到
+    # flow 中包含了 code_verifier，这是 PKCE 的关键；不放进 Cookie Session，回调可以落在任意 worker 上
+    flow_store.get_flow_store().put(auth_flow["state"], auth_flow)
     
     # 3. 重定向用户到微软登录页
     return redirect(auth_flow["auth_uri"])
 
 
 def handle_callback():
-    # 1. 从 session 取出之前存的 flow
-    flow = session.get("flow")
+    # 1. 按回调返回的 state 取出之前存的 flow (只能使用一次)
+    state = request.args.get("state")
+    flow = flow_store.get_flow_store().pop(state) if state else None
+    if not flow:
+        # 兼容升级前已发起、flow 仍保存在 Cookie Session 中的登录
+        flow = session.pop("flow", None)
     if not flow:
-        return "❌ 错误: Session 中没有找到 Auth Flow。可能是 Session 过期或 Cookies 问题，请返回重试。", 400
+        metrics.LOGINS.inc(outcome="no_flow")
+        return "❌ 错误: 没有找到 Auth Flow。可能是登录已超时或已被使用，请返回重试。", 400
 
     # 2. 验证 state 并处理回调参数
     try:
         # acquire_token_by_auth_code_flow 会自动处理 state 验证和 PKCE 交换
-        result = app_msal.acquire_token_by_auth_code_flow(
-            flow, request.args
-        )
+        with metrics.CALLBACK_SECONDS.time(stage="acquire_token"), tracing.span("msal.acquire_token_by_auth_code_flow", "login"):
+            result = app_msal.acquire_token_by_auth_code_flow(
+                flow, request.args
+            )
     except ValueError as e:
+        metrics.LOGINS.inc(outcome="invalid_state")
         return f"❌ Token 交换失败: {e}", 400
+    finally:
+        msal_cache.save_http_cache(msal_http_cache)
 
     # 3. 检查结果
     if "error" in result:
+        metrics.LOGINS.inc(outcome="token_error")
         return render_template_string("""
             <h1>🚫 认证失败</h1>
             <p><strong>错误:</strong> {{ error }}</p>
@@ -216,12 +228,14 @@ def handle_callback():
     save_msg = ""
     if refresh_token:
         # save_to_json 返回 (success, info)
-        success, info = save_to_json(email, refresh_token, CLIENT_ID)
+        with metrics.CALLBACK_SECONDS.time(stage="save_to_json"), tracing.span("save_to_json", "login"):
+            success, info = save_to_json(email, refresh_token, CLIENT_ID)
         if success:
             save_status = True
             save_msg = f"✅ 已自动更新账户: {info}"
         else:
             save_msg = f"❌ 自动保存失败: {info}"
+    metrics.LOGINS.inc(outcome="success" if save_status else ("save_error" if refresh_token else "no_refresh_token"))
 
     return render_template_string("""
         <!DOCTYPE html>
@@ -276,7 +290,100 @@ def handle_callback():
     """, refresh_token=refresh_token, client_id=CLIENT_ID, save_status=save_status, save_msg=save_msg)
 
 
-# --- 5. 启动应用 ---
+# --- 5. API 接口 (Access Token 签发、批量导入导出) ---
+# 必须设置 TOKEN_API_KEY 才会启用，请求需携带 Header: X-API-Key
+TOKEN_API_KEY = os.environ.get("TOKEN_API_KEY")
+
+def check_api_key():
+    """校验 X-API-Key，通过返回 None，否则返回错误响应"""
+    if not TOKEN_API_KEY:
+        return jsonify({"error": "API 未启用 (未设置 TOKEN_API_KEY)"}), 404
+    if not hmac.compare_digest(request.headers.get("X-API-Key", ""), TOKEN_API_KEY):
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+# 下游服务 (IMAP/SMTP 客户端等) 通过该接口获取 Access Token，而不是各自用 refresh_token 换取。
+# Token 按 expires_in 缓存在进程内，同一账户的并发请求只触发一次刷新，轮换后的 refresh_token 会写回存储。
+_token_issuer = None
+
+def get_token_issuer():
+    global _token_issuer
+    if _token_issuer is None:
+        _token_issuer = token_cache.TokenIssuer()
+    return _token_issuer
+
+
+@app.route("/api/token")
+def issue_token():
+    denied = check_api_key()
+    if denied:
+        return denied
+
+    email = request.args.get("email", "").strip()
+    if not email:
+        return jsonify({"error": "缺少参数 email"}), 400
+    # scope 为空时沿用账户授权时的权限范围
+    scope = request.args.get("scope") or None
+
+    try:
+        return jsonify(get_token_issuer().issue(email, scope))
+    except token_cache.TokenIssueError as e:
+        return jsonify({"error": str(e)}), e.status
+
+
+@app.route("/api/accounts/import", methods=["POST"])
+def import_accounts():
+    """
+    批量导入账户: 请求体为 CSV (Content-Type: text/csv，需表头 email,refresh_token,client_id) 或 NDJSON。
+    默认并发向 Token 端点验证每个账户，?validate=false 跳过验证。
+    请求体写入临时文件后立即返回 202 和任务 ID，验证与写入在后台进行，通过 GET /api/accounts/import/<job_id> 查询进度与报告。
+    """
+    denied = check_api_key()
+    if denied:
+        return denied
+    fmt = request.args.get("format") or bulk_io.detect_format(content_type=request.content_type)
+    validate = request.args.get("validate", "true").lower() != "false"
+    if request.content_length is not None and request.content_length > bulk_io.IMPORT_MAX_BYTES:
+        return jsonify({"error": f"导入文件超过 {bulk_io.IMPORT_MAX_BYTES} 字节上限"}), 413
+    try:
+        path = bulk_io.spool_upload(request.stream, fmt)
+    except bulk_io.UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    job = bulk_io.get_import_jobs().submit(path, fmt, validate)
+    status_url = url_for("import_status", job_id=job["id"])
+    return jsonify({"job_id": job["id"], "status": job["status"], "status_url": status_url}), 202, {"Location": status_url}
+
+
+@app.route("/api/accounts/import/<job_id>")
+def import_status(job_id):
+    """导入任务的状态 (pending / running / done / failed) 与报告 {"total", "created", "updated", "failed"}"""
+    denied = check_api_key()
+    if denied:
+        return denied
+    job = bulk_io.get_import_jobs().get(job_id)
+    if job is None:
+        return jsonify({"error": "任务不存在或已过期"}), 404
+    return jsonify(job)
+
+
+@app.route("/api/accounts/export")
+def export_accounts():
+    """以 NDJSON 流式导出所有账户 (逐个账户读取并发送)"""
+    denied = check_api_key()
+    if denied:
+        return denied
+    return Response(bulk_io.export_lines(), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=accounts.ndjson"})
+
+
+# --- 6. 监控指标 (Prometheus 文本格式，METRICS_ENABLED=False 时不注册) ---
+if metrics.METRICS_ENABLED:
+    @app.route("/metrics")
+    def metrics_endpoint():
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# --- 7. 启动应用 ---
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_DEBUG", "False").lower() == "true"
@@ -0,0 +1,234 @@
+import os
+import time
+import threading
+import logging
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Prometheus 文本格式 (text exposition format 0.0.4) 的进程内指标
+# 不依赖 prometheus_client: 只实现本项目用到的 Counter / Gauge / Histogram，线程安全。
+# main.py 通过 GET /metrics 暴露，scheduler.py 在 METRICS_PORT 上启动独立的 HTTP 服务。
+# METRICS_ENABLED: 设为 False 时 main.py 不注册 /metrics
+# METRICS_PORT: scheduler 暴露指标的端口，未设置时不启动
+# METRICS_HOST: scheduler 指标服务绑定的地址
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0") or 0)
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认的延迟分桶 (秒)，覆盖从本地数据库往返到 Token 端点慢请求的范围
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# 整轮刷新 / 同步这类长任务的分桶
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# 批次行数的分桶
+SIZE_BUCKETS = (1, 10, 50, 100, 500, 1000, 5000, 10000)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, pairs, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(pairs)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", list(zip(self.labelnames, key)), value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield "", list(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """记录代码块的耗时 (秒)，代码块抛出异常时同样记录"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self._values.items())
+        for key, (counts, total, count) in items:
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield "_bucket", pairs + [("le", _format_value(bound))], cumulative
+            yield "_sum", pairs, total
+            yield "_count", pairs, count
+
+
+def render():
+    """以 Prometheus 文本格式输出所有已注册的指标"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# --- 指标定义 (各模块直接引用，未被抓取时只是内存中的计数) ---
+
+# Token 刷新 (token_refresher / refresh_worker / verify_token / bulk_io 共用 refresh_account)
+REFRESH_REQUEST_SECONDS = Histogram(
+    "msgraph_refresh_request_seconds", "Latency of a single refresh_token request to the token endpoint",
+    ["outcome"])
+REFRESH_RESULTS = Counter(
+    "msgraph_refresh_results_total", "Refresh results per account after retries", ["result", "error_class"])
+REFRESH_RETRIES = Counter(
+    "msgraph_refresh_retries_total", "Refresh requests retried after a transient error")
+REFRESH_THROTTLED = Counter(
+    "msgraph_refresh_throttled_total", "Throttling responses (429/503) from the token endpoint")
+REFRESH_RATE = Gauge(
+    "msgraph_refresh_rate_limit", "Current adaptive refresh rate (requests per second)")
+SWEEP_SECONDS = Histogram(
+    "msgraph_refresh_sweep_seconds", "Duration of a refresh run (full sweep or due slice)", buckets=DURATION_BUCKETS)
+SWEEP_ACCOUNTS = Gauge(
+    "msgraph_refresh_sweep_accounts", "Accounts processed by the last refresh run")
+SWEEP_THROUGHPUT = Gauge(
+    "msgraph_refresh_sweep_accounts_per_second", "Throughput of the last refresh run")
+
+# 数据库同步
+SYNC_QUERY_SECONDS = Histogram(
+    "msgraph_sync_query_seconds", "Round-trip time of sync_db statements", ["stage"])
+SYNC_BATCH_SECONDS = Histogram(
+    "msgraph_sync_batch_seconds", "Duration of one sync_db transaction", ["mode"], buckets=DURATION_BUCKETS)
+SYNC_BATCH_ROWS = Histogram(
+    "msgraph_sync_batch_rows", "Accounts pushed per sync_db transaction", ["mode"], buckets=SIZE_BUCKETS)
+SYNC_ACCOUNTS = Counter(
+    "msgraph_sync_accounts_total", "Accounts merged into account_backups", ["result"])
+SYNC_ERRORS = Counter(
+    "msgraph_sync_errors_total", "Failed sync_db transactions", ["mode"])
+
+# 登录回调 (main.py)
+CALLBACK_SECONDS = Histogram(
+    "msgraph_login_callback_seconds", "Latency of login callback stages", ["stage"])
+LOGINS = Counter(
+    "msgraph_login_total", "Login callbacks by outcome", ["outcome"])
+
+# 共享 HTTP 客户端 (http_client.py)
+HTTP_CONNECTIONS = Counter(
+    "msgraph_http_connections_total", "New HTTP connections opened (far below request count when keep-alive works)",
+    ["host"])
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 抓取请求很频繁，不写入日志
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host=METRICS_HOST):
+    """在后台线程中启动只提供 /metrics 的 HTTP 服务，port 为 0 或启动失败时返回 None"""
+    if not port:
+        return None
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        logger.error(f"❌ 指标服务启动失败 ({host}:{port}): {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 指标服务已启动: http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,148 @@
+import os
+import json
+import atexit
+import threading
+import logging
+import msal
+from msal.throttled_http_client import NormalizedResponse
+
+logger = logging.getLogger(__name__)
+
+# MSAL 授权元数据缓存持久化 (可选)
+# MSAL_CACHE_DIR: 设置后在该目录以 JSON 保存 MSAL 的 HTTP 元数据缓存 (实例发现 / OpenID 配置)，
+#   进程重启时预加载，冷启动和首次 /login 无需再请求这些元数据。未设置时与原来一样只在内存中缓存。
+# Token 不会写入该目录: 账户数据只保存在 accounts.json，MSAL 的 Token 缓存也不在内存中保留。
+MSAL_CACHE_DIR = os.environ.get("MSAL_CACHE_DIR")
+HTTP_CACHE_FILENAME = "msal_http_cache.json"
+# 旧版本写入的文件 (Token 缓存含 refresh_token；元数据缓存为 pickle 格式)，启动时删除
+LEGACY_FILENAMES = ("msal_token_cache.json", "msal_http_cache.bin")
+
+# MSAL http_cache 中过期时间索引使用的保留键
+_INDEX_KEY = "_index_"
+# 只持久化元数据 GET 响应；POST 的错误响应 (限流记录) 与具体的授权请求相关，不写入磁盘
+_PERSIST_PREFIX = "GET "
+
+
+def _write_atomic(path, data, mode=0o600):
+    """先写临时文件再原子替换，多个 worker 同时写入时文件也不会损坏"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class DiscardingTokenCache(msal.TokenCache):
+    """
+    不保存任何 Token 的 MSAL Token 缓存。
+    登录回调只使用 acquire_token_by_auth_code_flow 的返回值并写入 accounts.json，
+    MSAL 默认的 TokenCache 会在内存中无限累积每个登录用户的 refresh_token。
+    """
+
+    def add(self, event, **kwargs):
+        pass
+
+
+class _StoredResponse:
+    """从 JSON 还原 NormalizedResponse 所需的最小响应对象"""
+
+    def __init__(self, status_code, text, headers):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+
+class PersistentHttpCache(dict):
+    """
+    MSAL http_cache 参数使用的字典，保存实例发现与 OpenID 配置等元数据响应 (不含 Token)。
+    MSAL 自行管理条目的过期时间 (元数据 24 小时)，过期条目会在下次使用时重新获取。
+    文件为 JSON: {"entries": {key: {status_code, text, headers}}, "index": [sequence, timestamps]}。
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self._save_lock = threading.Lock()
+        self._saved = None
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.update(self._decode(json.load(f)))
+                self._saved = self._encode()
+                logger.info(f"📦 已加载 MSAL 元数据缓存: {path}")
+            except Exception as e:
+                # 文件损坏或格式不符时从空缓存开始
+                logger.warning(f"⚠️ MSAL 元数据缓存无法读取，将重新获取: {e}")
+                self.clear()
+
+    @staticmethod
+    def _decode(payload):
+        entries = {
+            key: NormalizedResponse(_StoredResponse(**value))
+            for key, value in payload["entries"].items()
+        }
+        sequence, timestamps = payload["index"]
+        # 索引中只保留实际存在的条目
+        entries[_INDEX_KEY] = (
+            [entry for entry in sequence if entry[2] in entries],
+            {key: ts for key, ts in timestamps.items() if key in entries},
+        )
+        return entries
+
+    def _encode(self):
+        snapshot = dict(self)
+        sequence, timestamps = snapshot.pop(_INDEX_KEY, ([], {}))
+        entries = {
+            key: {"status_code": resp.status_code, "text": resp.text, "headers": dict(resp.headers)}
+            for key, resp in snapshot.items()
+            if isinstance(key, str) and key.startswith(_PERSIST_PREFIX)
+        }
+        return {
+            "entries": entries,
+            "index": [
+                [list(entry) for entry in sequence if entry[2] in entries],
+                {key: list(ts) for key, ts in timestamps.items() if key in entries},
+            ],
+        }
+
+    def save(self):
+        with self._save_lock:
+            payload = self._encode()
+            if payload == self._saved:
+                return
+            try:
+                _write_atomic(self.path, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+                self._saved = payload
+            except Exception as e:
+                logger.error(f"❌ 保存 MSAL 元数据缓存失败: {e}")
+
+
+def _remove_legacy_files(cache_dir):
+    for name in LEGACY_FILENAMES:
+        path = os.path.join(cache_dir, name)
+        try:
+            os.remove(path)
+            logger.info(f"🧹 已删除旧版 MSAL 缓存文件: {path}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"⚠️ 无法删除旧版 MSAL 缓存文件 {path}: {e}")
+
+
+def load_http_cache(cache_dir=MSAL_CACHE_DIR):
+    """
+    返回持久化的 http_cache，未配置缓存目录时返回 None，MSAL 使用默认的内存缓存。
+    进程退出时自动写回。
+    """
+    if not cache_dir:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    _remove_legacy_files(cache_dir)
+    http_cache = PersistentHttpCache(os.path.join(cache_dir, HTTP_CACHE_FILENAME))
+    atexit.register(save_http_cache, http_cache)
+    return http_cache
+
+
+def save_http_cache(http_cache):
+    if http_cache is not None:
+        http_cache.save()
@@ -1,7 +1,19 @@
 import os
-import requests
+import json
+import time
+import uuid
+import random
+import atexit
+import threading
 import logging
+from contextlib import contextmanager
 from dotenv import load_dotenv
+import http_client
+
+try:
+    import fcntl
+except ImportError:  # Windows: 没有 flock，只支持单进程使用同一个 outbox
+    fcntl = None
 
 # 加载环境变量 (确保本地测试也能读取到 .env)
 load_dotenv()
@@ -9,52 +21,325 @@ load_dotenv()
 # 配置日志
 logger = logging.getLogger(__name__)
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_NAME = "MS-Graph-Refresher"
+
+# 通知发件箱 (outbox)
+# send() 只把消息追加到本地 spool 文件后立即返回，由后台线程投递到 Notify Hub，Hub 故障时消息不会丢失。
+# NOTIFY_SPOOL_FILE: spool 文件路径 (JSON Lines)，多个进程可共用，同一时刻只有一个进程负责投递
+# NOTIFY_DIGEST_WINDOW_SECONDS: 最早一条待发消息等待多久后再投递，窗口内同级别的多条消息合并为一条汇总
+# NOTIFY_DIGEST_MAX_ITEMS: 汇总消息中最多展开的条数
+# NOTIFY_RETRY_MAX_SECONDS: 投递失败后指数退避的上限
+# NOTIFY_MAX_AGE_HOURS: 超过该时间仍未投递成功的消息会被丢弃
+# NOTIFY_POLL_SECONDS: 投递线程空闲时检查 spool 文件大小 / 修改时间的间隔，其它进程追加的消息最多延迟这么久被发现
+NOTIFY_SPOOL_FILE = os.environ.get("NOTIFY_SPOOL_FILE", os.path.join(BASE_DIR, "data", "notify_outbox.jsonl"))
+NOTIFY_DIGEST_WINDOW_SECONDS = float(os.environ.get("NOTIFY_DIGEST_WINDOW_SECONDS", "30"))
+NOTIFY_DIGEST_MAX_ITEMS = max(1, int(os.environ.get("NOTIFY_DIGEST_MAX_ITEMS", "20")))
+NOTIFY_RETRY_MAX_SECONDS = float(os.environ.get("NOTIFY_RETRY_MAX_SECONDS", "600"))
+NOTIFY_MAX_AGE_HOURS = float(os.environ.get("NOTIFY_MAX_AGE_HOURS", "72"))
+NOTIFY_POLL_SECONDS = max(0.05, float(os.environ.get("NOTIFY_POLL_SECONDS", "2")))
+
+LEVEL_LABELS = {"error": "错误", "warning": "警告", "success": "成功", "info": "信息"}
+
+
+def _config():
+    return os.environ.get("NOTIFY_API_URL"), os.environ.get("NOTIFY_KEY")
+
+
+class DeliveryError(Exception):
+    """投递失败，permanent=True 表示重试也不会成功 (如鉴权被拒绝)"""
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class Outbox:
+    """
+    基于本地 spool 文件的发件箱。
+    追加与重写都在 .lock 文件的 flock 保护下进行；投递线程通过 .sender.lock 保证同一时刻只有一个进程在投递。
+    本进程的 append() 通过事件唤醒投递线程；其它进程追加的消息由投递线程轮询 spool 文件的变化发现。
+    """
+
+    def __init__(self, path=NOTIFY_SPOOL_FILE, window=NOTIFY_DIGEST_WINDOW_SECONDS, poll_interval=NOTIFY_POLL_SECONDS):
+        self.path = path
+        self.window = window
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._sender_lock_file = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    # --- spool 文件 ---
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            spool_dir = os.path.dirname(self.path)
+            if spool_dir and not os.path.exists(spool_dir):
+                os.makedirs(spool_dir)
+            with open(self.path + ".lock", "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def append(self, message):
+        line = json.dumps(message, ensure_ascii=False) + "\n"
+        with self._locked():
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        self._wakeup.set()
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        messages = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    messages.append(json.loads(line))
+                except ValueError:
+                    # 进程在写入中途崩溃留下的半行
+                    continue
+        return messages
+
+    def _signature(self):
+        """spool 文件的 (inode, 大小, 修改时间)，用于发现其它进程的追加与重写"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def pending(self):
+        with self._locked():
+            return self._read()
+
+    def _remove(self, ids):
+        """删除已投递 (或已丢弃) 的消息，期间追加的新消息保留"""
+        with self._locked():
+            remaining = [m for m in self._read() if m.get("id") not in ids]
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for message in remaining:
+                    f.write(json.dumps(message, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+            return len(remaining)
+
+    # --- 投递 ---
+
+    def _post(self, title, content, level):
+        api_url, api_key = _config()
+        payload = {"project_name": PROJECT_NAME, "title": title, "content": content, "level": level}
+        headers = {"X-Project-Key": api_key, "Content-Type": "application/json"}
+        try:
+            response = http_client.post(api_url, json=payload, headers=headers, timeout=10)
+        except http_client.RequestError as e:
+            raise DeliveryError(f"通知网络请求异常: {e}")
+        if response.status_code == 200:
+            return
+        if response.status_code == 403:
+            raise DeliveryError("鉴权被拒绝 (请检查 NOTIFY_KEY)", permanent=True)
+        permanent = 400 <= response.status_code < 500 and response.status_code != 429
+        raise DeliveryError(f"HTTP {response.status_code}: {response.text[:200]}", permanent=permanent)
+
+    @staticmethod
+    def build_digests(messages):
+        """按级别合并消息，返回 [(title, content, level, ids)]，单条消息原样发送"""
+        groups = {}
+        for message in messages:
+            groups.setdefault(message.get("level", "info"), []).append(message)
+        digests = []
+        for level, items in groups.items():
+            ids = {m["id"] for m in items}
+            if len(items) == 1:
+                digests.append((items[0]["title"], items[0]["content"], level, ids))
+                continue
+            title = f"📦 {len(items)} 条{LEVEL_LABELS.get(level, level)}通知汇总"
+            parts = []
+            for m in items[:NOTIFY_DIGEST_MAX_ITEMS]:
+                stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(m["ts"]))
+                parts.append(f"[{stamp}] {m['title']}\n{m['content']}")
+            if len(items) > NOTIFY_DIGEST_MAX_ITEMS:
+                parts.append(f"... 另有 {len(items) - NOTIFY_DIGEST_MAX_ITEMS} 条未展开")
+            digests.append((title, "\n==================\n".join(parts), level, ids))
+        return digests
+
+    def deliver_once(self, force=False):
+        """
+        投递一轮，返回下次应当醒来的秒数 (None 表示没有待发消息)。
+        force=True 时忽略合并窗口与退避时间 (用于退出前的 flush)。
+        """
+        messages = self.pending()
+        if not messages:
+            return None
+
+        now = time.time()
+        expired = {m["id"] for m in messages if now - m["ts"] > NOTIFY_MAX_AGE_HOURS * 3600}
+        if expired:
+            logger.error(f"❌ 丢弃 {len(expired)} 条超过 {NOTIFY_MAX_AGE_HOURS} 小时仍未投递的通知")
+            self._remove(expired)
+            messages = [m for m in messages if m["id"] not in expired]
+            if not messages:
+                return None
+
+        if not force:
+            if now < self._retry_at:
+                return self._retry_at - now
+            oldest = min(m["ts"] for m in messages)
+            if now - oldest < self.window:
+                return self.window - (now - oldest)
+
+        delivered = set()
+        try:
+            for title, content, level, ids in self.build_digests(messages):
+                try:
+                    self._post(title, content, level)
+                except DeliveryError as e:
+                    if not e.permanent:
+                        raise
+                    logger.error(f"❌ 通知发送失败，已丢弃 {len(ids)} 条: {e}")
+                else:
+                    logger.info(f"📢 通知已发送 ({len(ids)} 条{'，已合并' if len(ids) > 1 else ''})")
+                delivered |= ids
+        except DeliveryError as e:
+            self._failures += 1
+            delay = random.uniform(0, min(NOTIFY_RETRY_MAX_SECONDS, 2 ** self._failures))
+            self._retry_at = time.time() + delay
+            logger.error(f"❌ 通知投递失败，{delay:.1f}s 后重试: {e}")
+        else:
+            self._failures = 0
+            self._retry_at = 0.0
+        finally:
+            if delivered:
+                self._remove(delivered)
+        return max(0.0, self._retry_at - time.time()) if self._failures else 0.0
+
+    def _become_sender(self):
+        """尝试成为本 spool 的唯一投递者 (持有 .sender.lock 直到进程退出)"""
+        if self._sender_lock_file is not None:
+            return True
+        if not fcntl:
+            self._sender_lock_file = True
+            return True
+        lock_file = open(self.path + ".sender.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._sender_lock_file = lock_file
+        return True
+
+    def _wait(self, timeout, signature):
+        """等待 timeout 秒；本进程 append() 或 spool 文件相对 signature 发生变化时提前返回"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if self._wakeup.wait(timeout=min(remaining, self.poll_interval)):
+                return
+            if self._signature() != signature:
+                return
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            # 投递前记录文件状态: 本轮 _remove() 的重写只会多触发一次空转，但不会漏掉期间其它进程的追加
+            signature = self._signature()
+            wait_seconds = self.window
+            try:
+                if self._become_sender():
+                    wait_seconds = self.deliver_once()
+                    if wait_seconds is None:
+                        wait_seconds = 3600
+            except Exception as e:
+                logger.error(f"❌ 通知发件箱异常: {e}")
+            self._wait(max(wait_seconds, 0.05), signature)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="notify-outbox", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout=10):
+        """立即投递所有待发消息 (忽略合并窗口)，最多等待 timeout 秒，返回是否已全部投递"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if not self._become_sender():
+                    return False
+                if self.deliver_once(force=True) is None:
+                    return True
+            except Exception as e:
+                logger.error(f"❌ 通知发件箱异常: {e}")
+            if self._failures:
+                time.sleep(min(1.0, max(0.0, deadline - time.time())))
+        return not self.pending()
+
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+
+def get_outbox():
+    global _outbox
+    with _outbox_lock:
+        if _outbox is None:
+            _outbox = Outbox()
+            atexit.register(_flush_at_exit)
+        return _outbox
+
+
+def _flush_at_exit():
+    if _outbox is not None and _outbox.pending():
+        # 未能投递的消息保留在 spool 中，下次启动时继续投递
+        _outbox.flush(timeout=5)
+
+
 def send(title, content, level="info"):
     """
-    发送通知到 Notify Hub。
-    
+    发送通知到 Notify Hub (异步)。
+    消息先写入本地 spool 再由后台线程投递，调用方不会因 Hub 缓慢或不可用而阻塞。
+
     Args:
         title (str): 消息标题
         content (str): 消息正文
         level (str): 消息级别 ('info', 'success', 'warning', 'error')
     """
-    api_url = os.environ.get("NOTIFY_API_URL")
-    api_key = os.environ.get("NOTIFY_KEY")
-    
+    api_url, api_key = _config()
+
     # 如果未配置，则静默跳过 (仅已配置时才发送)
     if not api_url or not api_key:
         logger.warning(f"🔕 通知服务未配置，跳过发送! (当前环境: NOTIFY_API_URL={api_url}, NOTIFY_KEY={'***' if api_key else 'None'})")
         return
 
-    payload = {
-        "project_name": "MS-Graph-Refresher",
-        "title": title,
-        "content": content,
-        "level": level
-    }
-    
-    headers = {
-        "X-Project-Key": api_key,
-        "Content-Type": "application/json"
-    }
-    
-    try:
-        if not api_url.startswith("http"):
-            logger.warning(f"⚠️ 通知 API URL 格式似乎不正确: {api_url}")
+    if not api_url.startswith("http"):
+        logger.warning(f"⚠️ 通知 API URL 格式似乎不正确: {api_url}")
 
-        response = requests.post(api_url, json=payload, headers=headers, timeout=10)
-        
-        if response.status_code == 200:
-            logger.info("📢 通知已发送")
-        elif response.status_code == 403:
-            logger.error("❌ 通知发送失败: 鉴权被拒绝 (请检查 NOTIFY_KEY)")
-        else:
-            logger.error(f"❌ 通知发送失败 (HTTP {response.status_code}): {response.text}")
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"❌ 通知网络请求异常: {e}")
+    outbox = get_outbox()
+    try:
+        outbox.append({"id": uuid.uuid4().hex, "ts": time.time(), "title": title, "content": content, "level": level})
     except Exception as e:
-        logger.error(f"❌ 通知发送未知错误: {e}")
+        logger.error(f"❌ 写入通知发件箱失败: {e}")
+        return
+    outbox.start()
+    logger.info("📥 通知已加入发件箱")
+
+
+def flush(timeout=10):
+    """退出前调用: 尽量投递发件箱中的所有消息"""
+    api_url, api_key = _config()
+    if not api_url or not api_key or _outbox is None:
+        return True
+    return _outbox.flush(timeout)
+
 
 if __name__ == "__main__":
     # 简单的本地测试逻辑
@@ -62,5 +347,6 @@ if __name__ == "__main__":
     print("Running notify.py self-test...")
     if os.environ.get("NOTIFY_API_URL"):
         send("Notification Test", "This is a test from notify.py", "info")
+        flush()
     else:
         print("Skipping test: Environment variables not set.")
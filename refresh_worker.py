@@ -0,0 +1,361 @@
+import os
+import sys
+import uuid
+import socket
+import time
+import signal
+import argparse
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import psycopg2.extras
+from dotenv import load_dotenv
+import token_refresher
+import sync_db
+import tracing
+
+# 加载环境变量
+load_dotenv()
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 多实例刷新 (租约模式)
+# 账户以 PostgreSQL 中的 account_backups 为准，各 worker 通过 refresh_leases 表按批次认领到期账户，
+# 只刷新并写回自己认领的账户。worker 崩溃后租约到期，其账户会被其它 worker 重新认领。
+# 限制: 租约模式不读写本地账户存储 (accounts.json / SQLite)，也不使用失效 Token 隔离 (status=quarantined)，
+# 永久性失败的账户按 FAILED_RETRY_SECONDS 重试，失败原因记录在 refresh_leases.last_error。
+# WORKER_ID: 实例标识 (默认 主机名-PID-随机后缀)
+# LEASE_BATCH_SIZE: 每次认领的账户数
+# LEASE_TTL_SECONDS: 租约有效期，需大于刷新一个批次所需的时间
+# WORKER_IDLE_SECONDS: 没有到期账户时的最长休眠时间
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+LEASE_BATCH_SIZE = max(1, int(os.environ.get("LEASE_BATCH_SIZE", "50")))
+LEASE_TTL_SECONDS = max(1, int(os.environ.get("LEASE_TTL_SECONDS", "900")))
+WORKER_IDLE_SECONDS = max(1, int(os.environ.get("WORKER_IDLE_SECONDS", "60")))
+REFRESH_WINDOW_SECONDS = float(os.environ.get("REFRESH_WINDOW_DAYS", "7")) * 86400
+FAILED_RETRY_SECONDS = int(os.environ.get("FAILED_RETRY_SECONDS", "21600"))
+
+# lease_until 同时表示 "租约到期时间" 和 "下次可认领时间":
+# 认领时设为 NOW() + TTL，刷新完成后设为下次到期时间并清空 worker_id。
+# account_backups.next_due_at 是同一时间的物化副本 (带索引)，认领时按它走索引取最早到期的账户，
+# 不需要对两张表做 LEFT JOIN 后按 COALESCE 排序 (无法使用索引，每次认领都要扫描全表)
+CREATE_LEASES_SQL = """
+    CREATE TABLE IF NOT EXISTS refresh_leases (
+        email TEXT PRIMARY KEY,
+        worker_id TEXT,
+        lease_until TIMESTAMPTZ NOT NULL,
+        claimed_at TIMESTAMPTZ,
+        last_refreshed_at TIMESTAMPTZ,
+        last_error TEXT
+    );
+    CREATE INDEX IF NOT EXISTS refresh_leases_lease_until_idx ON refresh_leases (lease_until)
+"""
+
+# 迁移 (python refresh_worker.py --migrate，部署租约模式前显式执行一次，worker 启动时不会修改 account_backups):
+# 给 account_backups 加上 next_due_at 列，已有账户按原规则回填 (有租约记录取 lease_until，
+# 否则 last_modified_at + 刷新周期)，之后新插入的账户 (sync_db 合并等) 由列默认值给出到期时间。
+# 在 advisory lock 下执行，可重复运行；回填与建索引只在加列时执行一次。
+NEXT_DUE_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('refresh_worker.next_due_at'))"
+
+NEXT_DUE_COLUMN_SQL = """
+    SELECT col_description(a.attrelid, a.attnum)
+    FROM pg_attribute a
+    WHERE a.attrelid = 'account_backups'::regclass AND a.attname = 'next_due_at' AND NOT a.attisdropped
+"""
+
+ADD_NEXT_DUE_SQL = """
+    ALTER TABLE account_backups ADD COLUMN IF NOT EXISTS next_due_at TIMESTAMPTZ;
+    UPDATE account_backups b
+    SET next_due_at = COALESCE(
+        (SELECT l.lease_until FROM refresh_leases l WHERE l.email = b.email),
+        b.last_modified_at + make_interval(secs => %(window)s),
+        '-infinity')
+    WHERE b.next_due_at IS NULL;
+    CREATE INDEX IF NOT EXISTS account_backups_next_due_at_idx ON account_backups (next_due_at)
+"""
+
+# 默认值中的刷新周期写在列注释里，REFRESH_WINDOW_DAYS 变化后重新运行 --migrate 更新
+NEXT_DUE_DEFAULT_SQL = """
+    ALTER TABLE account_backups ALTER COLUMN next_due_at SET DEFAULT NOW() + make_interval(secs => %(window)s);
+    COMMENT ON COLUMN account_backups.next_due_at IS %(comment)s
+"""
+
+# FOR UPDATE SKIP LOCKED 让并发认领的 worker 互相跳过对方正在认领的行；
+# ON CONFLICT ... WHERE 保证即使两个 worker 读到同一快照，也只有一个能拿到未过期的租约。
+# 认领成功的账户把 next_due_at 设为租约到期时间；没拿到租约的 (next_due_at 与未过期的租约不一致) 顺带修正为该租约的到期时间。
+CLAIM_SQL = r"""
+    WITH candidates AS (
+        SELECT b.email, b.data
+        FROM account_backups b
+        WHERE b.next_due_at <= NOW()
+        ORDER BY b.next_due_at
+        LIMIT %(limit)s
+        FOR UPDATE OF b SKIP LOCKED
+    ),
+    claimed AS (
+        INSERT INTO refresh_leases (email, worker_id, lease_until, claimed_at)
+        SELECT email, %(worker_id)s, NOW() + make_interval(secs => %(ttl)s), NOW() FROM candidates
+        ON CONFLICT (email) DO UPDATE
+        SET worker_id = EXCLUDED.worker_id,
+            lease_until = EXCLUDED.lease_until,
+            claimed_at = EXCLUDED.claimed_at
+        WHERE refresh_leases.lease_until <= NOW()
+        RETURNING email, lease_until
+    ),
+    due AS (
+        UPDATE account_backups b
+        SET next_due_at = COALESCE(claimed.lease_until, l.lease_until, NOW() + make_interval(secs => %(ttl)s))
+        FROM candidates c
+        LEFT JOIN claimed USING (email)
+        LEFT JOIN refresh_leases l USING (email)
+        WHERE b.email = c.email
+    )
+    SELECT c.email, c.data FROM candidates c JOIN claimed USING (email)
+"""
+
+# 写回新 Token 时校验租约仍属于本 worker (fencing)，租约已被他人接管的结果直接丢弃
+# data 用 sync_db 的 pg_temp.safe_jsonb 解析 (格式错误的行按空对象处理)，{data_type} 为 data 列的实际类型
+WRITE_BACK_SQL = r"""
+    UPDATE account_backups b
+    SET data = (pg_temp.safe_jsonb(b.data::text)
+                || jsonb_build_object('refresh_token', v.refresh_token, 'last_refreshed_at', v.refreshed_at))::{data_type},
+        last_modified_at = NOW()
+    FROM (VALUES %s) AS v(email, worker_id, refresh_token, refreshed_at), refresh_leases l
+    WHERE b.email = v.email AND l.email = v.email AND l.worker_id = v.worker_id
+    RETURNING b.email
+"""
+
+RELEASE_SQL = """
+    WITH released AS (
+        UPDATE refresh_leases l
+        SET worker_id = NULL,
+            lease_until = NOW() + make_interval(secs => v.delay::float8),
+            last_refreshed_at = CASE WHEN v.ok THEN NOW() ELSE l.last_refreshed_at END,
+            last_error = v.error
+        FROM (VALUES %s) AS v(email, worker_id, ok, delay, error)
+        WHERE l.email = v.email AND l.worker_id = v.worker_id
+        RETURNING l.email, l.lease_until
+    )
+    UPDATE account_backups b SET next_due_at = released.lease_until FROM released WHERE b.email = released.email
+"""
+
+class MigrationRequired(RuntimeError):
+    """account_backups 还没有 next_due_at 列，需要先运行 python refresh_worker.py --migrate"""
+
+
+def next_due_comment():
+    return f"refresh_window_seconds={REFRESH_WINDOW_SECONDS:g}"
+
+
+def migrate(cur):
+    """在当前事务中创建 refresh_leases 并给 account_backups 添加 / 更新 next_due_at 列 (可重复执行)"""
+    params = {"window": REFRESH_WINDOW_SECONDS, "comment": next_due_comment()}
+    cur.execute(CREATE_LEASES_SQL)
+    cur.execute(NEXT_DUE_LOCK_SQL)
+    cur.execute(NEXT_DUE_COLUMN_SQL)
+    row = cur.fetchone()
+    if row is None:
+        logger.info("🛠️ 为 account_backups 添加 next_due_at 列、回填到期时间并建立索引...")
+        cur.execute(ADD_NEXT_DUE_SQL, params)
+    if row is None or row[0] != params["comment"]:
+        logger.info(f"🛠️ next_due_at 默认值: NOW() + {REFRESH_WINDOW_SECONDS:g}s")
+        cur.execute(NEXT_DUE_DEFAULT_SQL, params)
+
+
+RELEASE_ALL_SQL = """
+    WITH released AS (
+        UPDATE refresh_leases SET worker_id = NULL, lease_until = NOW() WHERE worker_id = %s
+        RETURNING email, lease_until
+    )
+    UPDATE account_backups b SET next_due_at = released.lease_until FROM released WHERE b.email = released.email
+"""
+
+
+class LeaseWorker:
+    """
+    一个刷新实例。claim() 认领一批到期账户，run_batch() 刷新并写回，
+    可在多个容器/节点上同时运行而不会重复刷新同一账户。
+    """
+
+    def __init__(self, worker_id=WORKER_ID, batch_size=LEASE_BATCH_SIZE, lease_ttl=LEASE_TTL_SECONDS):
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.lease_ttl = lease_ttl
+        self.limiter = token_refresher.AdaptiveRateLimiter(
+            token_refresher.REFRESH_RPS, token_refresher.REFRESH_MIN_RPS, token_refresher.REFRESH_MAX_RPS,
+            burst=token_refresher.REFRESH_CONCURRENCY,
+        )
+        self._ready = False
+
+    def _execute(self, func):
+        """在一个事务中执行 func(cur)，返回其结果"""
+        conn = sync_db.get_connection()
+        broken = False
+        try:
+            cur = conn.cursor()
+            result = func(cur)
+            conn.commit()
+            cur.close()
+            return result
+        except Exception:
+            broken = True
+            raise
+        finally:
+            sync_db.release_connection(conn, broken)
+
+    def ensure_schema(self):
+        """
+        创建本模块自己的 refresh_leases 表，并检查 account_backups 是否已迁移 (只读检查，不修改该表)。
+        未迁移时抛出 MigrationRequired。
+        """
+        if self._ready:
+            return
+
+        def check(cur):
+            cur.execute(CREATE_LEASES_SQL)
+            cur.execute(NEXT_DUE_COLUMN_SQL)
+            return cur.fetchone()
+
+        row = self._execute(check)
+        if row is None:
+            raise MigrationRequired("account_backups 缺少 next_due_at 列，请先运行 python refresh_worker.py --migrate")
+        if row[0] != next_due_comment():
+            logger.warning(f"⚠️ next_due_at 的默认刷新周期 ({row[0]}) 与 REFRESH_WINDOW_DAYS 不一致，"
+                           "新账户的首次到期时间会按旧周期计算；可重新运行 python refresh_worker.py --migrate")
+        self._ready = True
+
+    def claim(self):
+        """认领一批到期账户，返回 [(email, data_dict)]"""
+        self.ensure_schema()
+        params = {"limit": self.batch_size, "worker_id": self.worker_id, "ttl": self.lease_ttl}
+
+        def do_claim(cur):
+            cur.execute(CLAIM_SQL, params)
+            return cur.fetchall()
+
+        claimed = []
+        with tracing.span("lease.claim", "db", batch=self.batch_size):
+            rows = self._execute(do_claim)
+        for email, raw in rows:
+            # text 列为 JSON 字符串，json / jsonb 列已是 dict
+            claimed.append((email, sync_db.parse_account_data(raw) or {}))
+        return claimed
+
+    def complete(self, results):
+        """写回刷新成功的 Token 并释放租约，返回实际写回的账户数 (租约已被接管的不计入)"""
+        refreshed_at = datetime.now(timezone.utc).isoformat()
+        updates = [(r["email"], self.worker_id, r["refresh_token"], refreshed_at) for r in results if r["ok"]]
+        releases = []
+        for r in results:
+            if r["ok"]:
+                releases.append((r["email"], self.worker_id, True, REFRESH_WINDOW_SECONDS, None))
+            else:
+                releases.append((r["email"], self.worker_id, False, FAILED_RETRY_SECONDS, r["reason"][:500]))
+
+        def do_complete(cur):
+            written = []
+            if updates:
+                cur.execute(sync_db.SAFE_JSONB_SQL)
+                sql = WRITE_BACK_SQL.format(data_type=sync_db.data_column_type(cur))
+                written = psycopg2.extras.execute_values(cur, sql, updates, fetch=True)
+            if releases:
+                psycopg2.extras.execute_values(cur, RELEASE_SQL, releases)
+            return len(written)
+
+        with tracing.span("lease.complete", "db", updates=len(updates), releases=len(releases)):
+            return self._execute(do_complete)
+
+    def release_all(self):
+        """退出前释放本实例持有的租约，让其它 worker 立即接手"""
+        if self._ready:
+            self._execute(lambda cur: cur.execute(RELEASE_ALL_SQL, (self.worker_id,)))
+
+    def run_batch(self):
+        """
+        认领并刷新一个批次，返回与 logs/refresh_report.json 结构相同的报告；
+        没有到期账户时 total 为 0。
+        """
+        claimed = self.claim()
+        if not claimed:
+            return {"total": 0, "success": 0, "failed": []}
+
+        logger.info(f"📥 [{self.worker_id}] 认领 {len(claimed)} 个到期账户")
+        started = time.time()
+        results = []
+        refreshable = []
+        for email, data in claimed:
+            if not data.get("refresh_token") or not data.get("client_id"):
+                logger.warning(f"   ⚠️ 跳过 {email}: 缺少 refresh_token 或 client_id")
+                results.append({"email": email, "ok": False, "reason": "Missing refresh_token/client_id",
+                                "error_class": token_refresher.ERROR_PERMANENT})
+                continue
+            refreshable.append((email, data))
+
+        with ThreadPoolExecutor(max_workers=token_refresher.REFRESH_CONCURRENCY) as executor:
+            futures = [executor.submit(token_refresher.refresh_account, email, data, self.limiter) for email, data in refreshable]
+            results.extend(f.result() for f in futures)
+
+        token_refresher.record_sweep(len(claimed), time.time() - started)
+        written = self.complete(results)
+        success = sum(1 for r in results if r["ok"])
+        if written < success:
+            logger.warning(f"⚠️ {success - written} 个账户的租约已被其它 worker 接管，结果已丢弃")
+        failed = [{"email": r["email"], "reason": r["reason"], "error_class": r["error_class"]} for r in results if not r["ok"]]
+        logger.info(f"💾 [{self.worker_id}] 已写回 {written}/{len(claimed)} 个账户")
+        return {"timestamp": datetime.now().isoformat(), "total": len(claimed), "success": written, "failed": failed}
+
+
+def run_worker(stop_event, once=False):
+    """持续认领并刷新到期账户，直到 stop_event 被设置 (once=True 时处理完当前到期账户即退出)"""
+    worker = LeaseWorker()
+    try:
+        worker.ensure_schema()
+    except MigrationRequired as e:
+        logger.error(f"❌ {e}")
+        return
+    logger.info(f"🤖 刷新 worker 已启动: {worker.worker_id} (批次 {worker.batch_size}, 租约 {worker.lease_ttl}s)")
+    try:
+        while not stop_event.is_set():
+            try:
+                report = worker.run_batch()
+            except Exception as e:
+                logger.error(f"❌ 认领/写回失败: {e}")
+                report = None
+            if report and report["total"]:
+                continue
+            if once:
+                break
+            stop_event.wait(WORKER_IDLE_SECONDS)
+    finally:
+        try:
+            worker.release_all()
+        except Exception as e:
+            logger.error(f"❌ 释放租约失败: {e}")
+    logger.info(f"👋 worker {worker.worker_id} 已退出")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="多实例刷新 worker (从 account_backups 按租约认领账户)。"
+                    "不读写本地账户存储，也不使用失效 Token 隔离: 永久性失败按 FAILED_RETRY_SECONDS 重试")
+    parser.add_argument("--once", action="store_true", help="处理完当前所有到期账户后退出")
+    parser.add_argument("--migrate", action="store_true",
+                        help="给 account_backups 添加带索引的 next_due_at 列并回填 (部署租约模式前执行一次)，然后退出")
+    args = parser.parse_args()
+
+    if not sync_db.DB_URL:
+        logger.error("❌ 租约模式需要配置 DB_URL")
+        sys.exit(1)
+
+    if args.migrate:
+        LeaseWorker()._execute(migrate)
+        logger.info("✅ 迁移完成")
+        sys.exit(0)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    run_worker(stop, once=args.once)
@@ -6,9 +6,13 @@ import subprocess
 import threading
 import os
 import json
+import heapq
 from datetime import datetime # 添加 datetime
 from dotenv import load_dotenv
 import notify
+import account_store
+import metrics
+import tracing
 
 # 加载环境变量
 load_dotenv()
@@ -26,6 +30,44 @@ shutdown_event = threading.Event()
 REFRESH_REPORT = os.path.join("logs", "refresh_report.json")
 SYNC_REPORT = os.path.join("logs", "sync_report.json")
 
+# 任务执行方式:
+# - inprocess: 在调度器进程内直接调用刷新/同步函数 (默认)，跨轮次复用 HTTP 会话与数据库连接池
+# - subprocess: 旧版行为，每个任务启动一个新的 Python 子进程
+SCHEDULER_RUNNER = os.environ.get("SCHEDULER_RUNNER", "inprocess").lower()
+
+# 流水线模式: 刷新成功的 Token 经有界队列实时写入数据库 (仅 inprocess 执行方式可用)
+PIPELINE_SYNC = os.environ.get("PIPELINE_SYNC", "False").lower() == "true"
+
+# 调度模式:
+# - queue: 按每个账户的到期时间持续刷新小批次 (默认)
+# - sweep: 旧版行为，全量刷新后休眠 7 天
+# - lease: 多实例模式，从 account_backups 按租约认领账户刷新 (见 refresh_worker.py，需 DB_URL)。
+#          刷新结果只写回数据库，不更新本地账户存储；不使用失效 Token 隔离，永久性失败按 FAILED_RETRY_SECONDS 重试
+SCHEDULER_MODE = os.environ.get("SCHEDULER_MODE", "queue").lower()
+
+# 启动时本地账户存储为空 (新节点 / 数据卷丢失) 且配置了 DB_URL 时，先从 account_backups 拉取账户
+HYDRATE_ON_START = os.environ.get("HYDRATE_ON_START", "True").lower() == "true"
+SWEEP_SLEEP_SECONDS = 604800
+
+# 到期队列配置
+# REFRESH_WINDOW_DAYS: 距上次刷新/登录多久后需要再次刷新
+# REFRESH_SLICE_SIZE: 每次唤醒最多刷新的账户数
+# SLICE_GRACE_SECONDS: 唤醒时顺带处理即将在该时间内到期的账户，避免频繁唤醒
+# FAILED_RETRY_SECONDS: 刷新失败的账户多久后再试
+# QUEUE_POLL_SECONDS: 最长休眠时间，到点后检查 accounts.json 是否被外部修改
+# QUEUE_RELOAD_SECONDS: 本进程刷新后直接把新的到期时间放回堆中、不重建；每隔该时间强制完整重建一次，
+#                       补上刷新期间其它进程的修改 (如新登录的账户)
+# CYCLE_SYNC_SECONDS: 到期账户积压较多时，最长每隔多少秒同步一次数据库 (否则在本轮到期账户处理完后同步一次)
+# NOTIFY_INTERVAL_SECONDS: 汇总通知的发送间隔
+REFRESH_WINDOW_SECONDS = float(os.environ.get("REFRESH_WINDOW_DAYS", "7")) * 86400
+REFRESH_SLICE_SIZE = max(1, int(os.environ.get("REFRESH_SLICE_SIZE", "50")))
+SLICE_GRACE_SECONDS = int(os.environ.get("SLICE_GRACE_SECONDS", "300"))
+FAILED_RETRY_SECONDS = int(os.environ.get("FAILED_RETRY_SECONDS", "21600"))
+QUEUE_POLL_SECONDS = int(os.environ.get("QUEUE_POLL_SECONDS", "300"))
+QUEUE_RELOAD_SECONDS = int(os.environ.get("QUEUE_RELOAD_SECONDS", "3600"))
+CYCLE_SYNC_SECONDS = int(os.environ.get("CYCLE_SYNC_SECONDS", "900"))
+NOTIFY_INTERVAL_SECONDS = int(os.environ.get("NOTIFY_INTERVAL_SECONDS", "86400"))
+
 def signal_handler(signum, frame):
     """
     捕获 SIGINT (Ctrl+C) 和 SIGTERM (Docker stop) 信号
@@ -34,7 +76,7 @@ def signal_handler(signum, frame):
     logging.info(f"🛑 接收到信号 {signame} ({signum})，正在准备停止...")
     shutdown_event.set()
 
-def run_script(script_name):
+def run_script(script_name, args=None):
     """
     每次调用子进程运行脚本，确保环境隔离，避免 sys.exit() 影响主进程
     """
@@ -52,11 +94,13 @@ def run_script(script_name):
         # flush=True 确保日志没被缓冲
         start_time = time.time()
         
-        # 使用当前 python 解释器调用子脚本
-        result = subprocess.run(
-            [sys.executable, "-u", script_path], 
-            check=False
-        )
+        # 使用当前 python 解释器调用子脚本 (span 包含解释器启动时间，子进程开启追踪时写出自己的 trace 文件)
+        with tracing.span(f"subprocess {script_name}", "scheduler") as span:
+            result = subprocess.run(
+                [sys.executable, "-u", script_path] + list(args or []), 
+                check=False
+            )
+            span.set(returncode=result.returncode)
         
         duration = time.time() - start_time
         
@@ -71,34 +115,125 @@ def run_script(script_name):
         logging.error(f"❌ 无法执行 {script_name}: {e}")
         return False
 
-def collect_and_notify():
+def run_job(name, func, *args, **kwargs):
     """
-    读取 token_refresher 和 sync_db 的运行报告，发送汇总通知
+    在调度器进程内执行任务函数，隔离其异常 (包括 sys.exit 引发的 SystemExit)。
+    返回 (是否成功, 函数返回值)。
+    """
+    if shutdown_event.is_set():
+        return False, None
+
+    logging.info(f"🚀 启动任务: {name}")
+    start_time = time.time()
+    try:
+        with tracing.span(name, "scheduler"):
+            result = func(*args, **kwargs)
+    except SystemExit as e:
+        logging.error(f"❌ 任务失败: {name} (退出码 {e.code}, 耗时 {time.time() - start_time:.2f}s)")
+        return False, None
+    except Exception as e:
+        logging.exception(f"❌ 任务失败: {name} ({e}, 耗时 {time.time() - start_time:.2f}s)")
+        return False, None
+
+    logging.info(f"✅ 任务成功: {name} (耗时 {time.time() - start_time:.2f}s)")
+    return True, result
+
+def run_refresh(only=None):
+    """执行 Token 刷新，返回刷新报告 (任务失败时返回带 error 的报告)"""
+    if SCHEDULER_RUNNER == "subprocess":
+        args = ["--only"] + list(only) if only is not None else []
+        if not run_script("token_refresher.py", args):
+            return {"error": "token_refresher.py 执行失败"}
+        return load_report(REFRESH_REPORT, "Refresh")
+
+    # 延迟导入: 子进程模式下无需加载 requests 等依赖，也避免覆盖调度器的日志配置
+    import token_refresher
+    ok, report = run_job("token_refresher", token_refresher.refresh_all_tokens, only=only)
+    if not ok:
+        return {"error": "token_refresher 执行失败"}
+    return report
+
+def run_sync():
+    """执行数据库同步，返回同步报告"""
+    if SCHEDULER_RUNNER == "subprocess":
+        if not run_script("sync_db.py"):
+            return {"error": "sync_db.py 执行失败"}
+        return load_report(SYNC_REPORT, "Sync")
+
+    import sync_db
+    ok, report = run_job("sync_db", sync_db.sync_to_db)
+    if not ok:
+        return {"error": "sync_db 执行失败"}
+    return report
+
+def hydrate_if_empty():
+    """本地账户存储不存在或为空时，从 account_backups 拉取账户 (sync_db.py --pull)"""
+    if not HYDRATE_ON_START or not os.environ.get("DB_URL"):
+        return
+    store = account_store.get_store()
+    try:
+        if store.exists() and next(iter(store.iter_records()), None) is not None:
+            return
+    except Exception as e:
+        # 文件损坏等情况不自动覆盖，交给人工处理
+        logging.error(f"❌ 读取 {store.location} 失败，跳过自动拉取: {e}")
+        return
+
+    logging.info(f"📥 本地账户存储为空，从数据库拉取账户: {store.location}")
+    if SCHEDULER_RUNNER == "subprocess":
+        run_script("sync_db.py", ["--pull"])
+        return
+    import sync_db
+    run_job("sync_db (pull)", sync_db.hydrate)
+
+def pipeline_enabled():
+    return PIPELINE_SYNC and SCHEDULER_RUNNER != "subprocess"
+
+def run_pipeline(only=None):
+    """
+    流水线模式: 刷新与数据库同步同时进行，返回 (refresh_data, sync_data)。
+    刷新成功的账户立即进入 SyncWriter 队列，按微批次写入数据库。
+    """
+    import token_refresher
+    import sync_db
+
+    writer = sync_db.SyncWriter().start()
+    try:
+        ok, refresh_data = run_job("token_refresher (pipeline)", token_refresher.refresh_all_tokens,
+                                   only=only, on_success=writer.submit)
+    finally:
+        # 即使刷新失败也要等待已提交的账户写完
+        _, sync_data = run_job("sync_db (pipeline)", writer.close)
+
+    if not ok:
+        refresh_data = {"error": "token_refresher 执行失败"}
+    if sync_data is None:
+        sync_data = {"error": "sync_db 执行失败"}
+    return refresh_data, sync_data
+
+def load_report(path, label):
+    """读取子任务写出的 JSON 报告，失败时返回带 error 的字典"""
+    if not os.path.exists(path):
+        return {"error": "Report file not found"}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.error(f"读取 {label} 报告失败: {e}")
+        return {"error": str(e)}
+
+def collect_and_notify(refresh_data=None, sync_data=None):
+    """
+    读取 token_refresher 和 sync_db 的运行报告，发送汇总通知。
+    队列模式下由调用方传入多个小批次累计后的报告。
     """
-    refresh_data = {}
-    sync_data = {}
-    
     # 1. 读取 Refresh 报告
-    if os.path.exists(REFRESH_REPORT):
-        try:
-            with open(REFRESH_REPORT, "r", encoding="utf-8") as f:
-                refresh_data = json.load(f)
-        except Exception as e:
-            logging.error(f"读取 Refresh 报告失败: {e}")
-            refresh_data = {"error": str(e)}
-    else:
-        refresh_data = {"error": "Report file not found"}
+    if refresh_data is None:
+        refresh_data = load_report(REFRESH_REPORT, "Refresh")
 
     # 2. 读取 Sync 报告
-    if os.path.exists(SYNC_REPORT):
-        try:
-            with open(SYNC_REPORT, "r", encoding="utf-8") as f:
-                sync_data = json.load(f)
-        except Exception as e:
-            logging.error(f"读取 Sync 报告失败: {e}")
-            sync_data = {"error": str(e)}
-    else:
-        sync_data = {"error": "Report file not found"}
+    if sync_data is None:
+        sync_data = load_report(SYNC_REPORT, "Sync")
 
     # 3. 综合判断状态
     level = "info"
@@ -107,6 +242,8 @@ def collect_and_notify():
     r_failed_list = refresh_data.get("failed", [])
     r_total = refresh_data.get("total", 0)
     r_success = refresh_data.get("success", 0)
+    r_quarantined = refresh_data.get("quarantined", 0)
+    quarantine_note = f"🚫 跳过隔离中的失效 Token: {r_quarantined}\n" if r_quarantined else ""
     
     s_stats = sync_data.get("stats", {})
     s_error = sync_data.get("error")
@@ -136,6 +273,7 @@ def collect_and_notify():
             f"执行时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
             f"------------------\n"
             f"🔄 Token刷新: {r_success}/{r_total} 成功\n"
+            f"{quarantine_note}"
             f"💾 DB同步: 新增 {s_stats.get('inserted',0)}, 更新 {s_stats.get('updated',0)}\n"
             f"状态: 所有服务运行正常。"
         )
@@ -149,6 +287,7 @@ def collect_and_notify():
              content += f"异常: {refresh_data.get('error')}\n"
         else:
              content += f"成功: {r_success}/{r_total}\n"
+             content += quarantine_note
              if r_failed_list:
                  content += f"失败详情 ({len(r_failed_list)}):\n"
                  for item in r_failed_list[:5]: # 最多显示5条
@@ -164,43 +303,312 @@ def collect_and_notify():
             content += f"新增: {s_stats.get('inserted',0)}, 更新: {s_stats.get('updated',0)}, 跳过: {s_stats.get('skipped',0)}\n"
 
     logging.info(f"📡 发送综合通知 ({level})...")
-    notify.send(title, content, level)
+    with tracing.span("notify.send", "scheduler", level=level):
+        notify.send(title, content, level)
 
 
-def main():
-    # 注册信号处理
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
+class DueQueue:
+    """
+    按到期时间排序的账户最小堆。
+    到期时间 = max(last_refreshed_at, last_modified_at) + 刷新窗口，
+    因此刚通过 main.py 登录保存的账户不会被立即重复刷新。
+    """
 
-    logging.info("🤖 自动刷新调度器已启动 (PID: {})".format(os.getpid()))
+    def __init__(self, window_seconds):
+        self.window_seconds = window_seconds
+        self._heap = []
+        self._signature = None
+        self._retry_at = {}  # email.lower() -> 失败后允许重试的时间
+        self._reload_at = 0.0  # 下一次强制重建的时间
+
+    def reload_if_changed(self):
+        """
+        账户存储被其它进程修改 (包括其它容器通过共享卷写入)，或距上次重建超过 QUEUE_RELOAD_SECONDS 时重建堆，
+        返回是否重建。本进程自己刷新产生的写入通过 reschedule + adopt_signature 增量更新，不触发重建。
+        """
+        store = account_store.get_store()
+        signature = store.signature()
+        if signature is not None and signature == self._signature and time.time() < self._reload_at:
+            return False
+
+        # 流式读取，堆中只保留 (到期时间, 邮箱)
+        heap = []
+        try:
+            for record in store.iter_records():
+                if not record.refresh_token or not record.client_id:
+                    continue
+                last = account_store.last_touched(record)
+                # 被隔离的失效 Token 排到下一次重新检查的时间
+                due = max(last + self.window_seconds, self._retry_at.get(record.email.lower(), 0),
+                          account_store.quarantine_recheck_at(record))
+                heap.append((due, record.email))
+        except Exception as e:
+            logging.error(f"❌ 读取 {store.location} 失败: {e}")
+            return False
+        heapq.heapify(heap)
 
+        self._heap = heap
+        self._signature = signature
+        self._reload_at = time.time() + QUEUE_RELOAD_SECONDS
+        logging.info(f"📋 到期队列已重建: {len(heap)} 个账户")
+        return True
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now, limit, grace=0):
+        """弹出已到期 (或将在 grace 秒内到期) 的账户，最多 limit 个"""
+        batch = []
+        while self._heap and len(batch) < limit and self._heap[0][0] <= now + grace:
+            batch.append(heapq.heappop(self._heap)[1])
+        return batch
+
+    def defer(self, emails, delay):
+        """刷新失败的账户推迟 delay 秒后重试，避免对同一个坏 Token 反复请求"""
+        retry_at = time.time() + delay
+        for email in emails:
+            self.defer_until(email, retry_at)
+
+    def defer_until(self, email, retry_at):
+        self._retry_at[email.lower()] = retry_at
+        heapq.heappush(self._heap, (retry_at, email))
+
+    def reschedule(self, emails, due):
+        """本进程刷新成功的账户直接按新的到期时间放回堆中 (O(k log n))，不必重新读取整个存储"""
+        for email in emails:
+            heapq.heappush(self._heap, (due, email))
+
+    def adopt_signature(self):
+        """本进程写入存储后调用: 接受新的存储签名而不重建堆 (期间其它进程的修改由定期重建补上)"""
+        self._signature = account_store.get_store().signature()
+
+    def __len__(self):
+        return len(self._heap)
+
+def merge_reports(total, refresh_data, sync_data):
+    """把单个小批次的报告累加到汇总报告中"""
+    r_total = total["refresh"]
+    if refresh_data.get("error"):
+        r_total["error"] = refresh_data["error"]
+    r_total["total"] += refresh_data.get("total", 0)
+    r_total["success"] += refresh_data.get("success", 0)
+    r_total["quarantined"] = r_total.get("quarantined", 0) + refresh_data.get("quarantined", 0)
+    r_total["failed"].extend(refresh_data.get("failed", []))
+
+    if sync_data is None:
+        return
+    s_total = total["sync"]
+    if sync_data.get("error"):
+        s_total["error"] = sync_data["error"]
+    for key, value in sync_data.get("stats", {}).items():
+        s_total["stats"][key] = s_total["stats"].get(key, 0) + value
+
+def new_summary():
+    return {
+        "refresh": {"total": 0, "success": 0, "quarantined": 0, "failed": []},
+        "sync": {"stats": {"inserted": 0, "updated": 0, "skipped": 0}},
+    }
+
+def run_sweep_loop():
+    """旧版调度: 全量刷新 -> 同步 -> 通知 -> 休眠 7 天"""
     while not shutdown_event.is_set():
         logging.info("⏰ 开始执行本轮任务...")
         
-        # 1. 刷新 Token
-        run_script("token_refresher.py")
-        
-        # 2. 同步数据库
-        run_script("sync_db.py")
-        
-        # 3. 收集报告并发送汇总通知
-        if not shutdown_event.is_set():
-            collect_and_notify()
+        with tracing.span("scheduler.cycle", "scheduler", mode="sweep"):
+            if pipeline_enabled():
+                # 1+2. 刷新与同步流水线并行
+                refresh_data, sync_data = run_pipeline()
+            else:
+                # 1. 刷新 Token
+                refresh_data = run_refresh()
+                
+                # 2. 同步数据库
+                sync_data = run_sync()
+            
+            # 3. 收集报告并发送汇总通知
+            if not shutdown_event.is_set():
+                collect_and_notify(refresh_data, sync_data)
+        tracing.flush()
         
         if shutdown_event.is_set():
             break
 
         # 休眠 7 天 (604800 秒)
-        SLEEP_SECONDS = 604800
-        logging.info(f"😴 本轮任务结束，进入休眠 {SLEEP_SECONDS} 秒 (7天)...")
+        logging.info(f"😴 本轮任务结束，进入休眠 {SWEEP_SLEEP_SECONDS} 秒 (7天)...")
         
         # 使用 wait 进行休眠，支持信号唤醒退出
-        is_stopped = shutdown_event.wait(timeout=SLEEP_SECONDS)
+        is_stopped = shutdown_event.wait(timeout=SWEEP_SLEEP_SECONDS)
         
         if is_stopped:
             logging.info("⚡ 休眠被中断，准备退出。")
             break
 
+def run_slice(emails, writer=None):
+    """
+    刷新一个小批次，返回刷新报告 (数据库同步由 run_queue_loop 按周期统一执行)。
+    writer 不为 None 时 (流水线模式) 刷新成功的账户实时送入该 SyncWriter。
+    """
+    logging.info(f"⏰ 到期账户 {len(emails)} 个，开始刷新...")
+    if writer is not None:
+        import token_refresher
+        ok, refresh_data = run_job("token_refresher (pipeline)", token_refresher.refresh_all_tokens,
+                                   only=emails, on_success=writer.submit)
+        if not ok:
+            refresh_data = {"error": "token_refresher 执行失败"}
+    else:
+        refresh_data = run_refresh(emails)
+    if refresh_data.get("error"):
+        # 整个任务失败时，本批次账户全部按失败处理 (稍后重试)
+        refresh_data.setdefault("failed", [{"email": e, "reason": "Job Failed"} for e in emails])
+    return refresh_data
+
+def reschedule_slice(queue, emails, refresh_data):
+    """按刷新结果把本批次账户放回到期队列: 成功的排到下一个刷新窗口，失败的推迟重试 (隔离的排到重新检查时间)"""
+    failed = refresh_data.get("failed", [])
+    if refresh_data.get("error") or any(item.get("email") == "SYSTEM" for item in failed):
+        # 读取存储失败等整体错误: 本批次全部稍后重试，并在下一轮完整重建队列
+        queue.defer(emails, FAILED_RETRY_SECONDS)
+        return
+    failed_keys = set()
+    for item in failed:
+        email = item.get("email")
+        failed_keys.add(email.lower())
+        queue.defer_until(email, item.get("retry_at") or time.time() + FAILED_RETRY_SECONDS)
+    queue.reschedule([e for e in emails if e.lower() not in failed_keys], time.time() + REFRESH_WINDOW_SECONDS)
+    queue.adopt_signature()
+
+def finish_cycle_sync(writer):
+    """同步本周期刷新的账户: 流水线模式关闭 SyncWriter (写完队列并做一次增量补齐)，否则执行一次增量同步"""
+    if writer is None:
+        return run_sync()
+    ok, sync_data = run_job("sync_db (pipeline)", writer.close)
+    return sync_data if ok else {"error": "sync_db 执行失败"}
+
+def run_queue_loop():
+    """到期队列调度: 只在下一个账户到期时醒来，每次刷新一小批"""
+    queue = DueQueue(REFRESH_WINDOW_SECONDS)
+    summary = new_summary()
+    slices_run = 0
+    last_notify = time.time()
+    # 本周期的数据库同步: 流水线模式下整个周期共用一个 SyncWriter；sync_pending_since 为第一次刷新成功的时间
+    writer = None
+    sync_pending_since = None
+
+    while not shutdown_event.is_set():
+        with tracing.span("due_queue.reload", "scheduler"):
+            queue.reload_if_changed()
+
+        batch = queue.pop_due(time.time(), REFRESH_SLICE_SIZE, SLICE_GRACE_SECONDS)
+        if batch:
+            if writer is None and pipeline_enabled():
+                import sync_db
+                writer = sync_db.SyncWriter().start()
+            with tracing.span("scheduler.cycle", "scheduler", mode="queue", accounts=len(batch)):
+                refresh_data = run_slice(batch, writer)
+            merge_reports(summary, refresh_data, None)
+            slices_run += 1
+            reschedule_slice(queue, batch, refresh_data)
+            if sync_pending_since is None and (refresh_data.get("success", 0) > 0 or writer is not None):
+                sync_pending_since = time.time()
+
+        # 本轮到期账户处理完 (或积压超过 CYCLE_SYNC_SECONDS) 后同步一次数据库，而不是每个小批次全量扫描一次
+        if sync_pending_since is not None and not shutdown_event.is_set() and \
+                (not batch or time.time() - sync_pending_since >= CYCLE_SYNC_SECONDS):
+            merge_reports(summary, {}, finish_cycle_sync(writer))
+            writer = None
+            sync_pending_since = None
+
+        if slices_run and time.time() - last_notify >= NOTIFY_INTERVAL_SECONDS and not shutdown_event.is_set():
+            collect_and_notify(summary["refresh"], summary["sync"])
+            summary = new_summary()
+            slices_run = 0
+            last_notify = time.time()
+
+        if batch:
+            # 可能还有更多已到期账户，立即进入下一轮
+            continue
+
+        tracing.flush()
+        next_due = queue.next_due()
+        sleep_seconds = QUEUE_POLL_SECONDS
+        if next_due is not None:
+            sleep_seconds = min(QUEUE_POLL_SECONDS, max(1, next_due - time.time()))
+        if shutdown_event.wait(timeout=sleep_seconds):
+            logging.info("⚡ 休眠被中断，准备退出。")
+            break
+
+    if writer is not None:
+        # 退出前把已提交的账户写完 (其余变化由下次启动后的增量同步补上)
+        writer.close(catch_up=False)
+
+def run_lease_loop():
+    """租约模式: 与其它实例一起从 PostgreSQL 认领到期账户，刷新结果直接写回 account_backups"""
+    import refresh_worker
+
+    worker = refresh_worker.LeaseWorker()
+    try:
+        worker.ensure_schema()
+    except refresh_worker.MigrationRequired as e:
+        logging.error(f"❌ {e}")
+        return
+    except Exception as e:
+        # 数据库暂时不可用时继续进入循环，由 run_batch 重试
+        logging.error(f"❌ 检查租约表失败: {e}")
+    logging.info(f"🔗 租约模式 worker: {worker.worker_id}")
+    summary = new_summary()
+    batches_run = 0
+    last_notify = time.time()
+
+    try:
+        while not shutdown_event.is_set():
+            ok, refresh_data = run_job("refresh_worker", worker.run_batch)
+            if ok and refresh_data["total"]:
+                merge_reports(summary, refresh_data, None)
+                batches_run += 1
+
+            if batches_run and time.time() - last_notify >= NOTIFY_INTERVAL_SECONDS and not shutdown_event.is_set():
+                # 租约模式下刷新结果已直接写入数据库，没有单独的同步报告
+                collect_and_notify(summary["refresh"], {"stats": {}})
+                summary = new_summary()
+                batches_run = 0
+                last_notify = time.time()
+
+            if ok and refresh_data["total"]:
+                continue
+            tracing.flush()
+            if shutdown_event.wait(timeout=refresh_worker.WORKER_IDLE_SECONDS):
+                logging.info("⚡ 休眠被中断，准备退出。")
+                break
+    finally:
+        try:
+            worker.release_all()
+        except Exception as e:
+            logging.error(f"❌ 释放租约失败: {e}")
+
+def main():
+    # 注册信号处理
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    logging.info("🤖 自动刷新调度器已启动 (PID: {}, 模式: {}, 执行方式: {})".format(os.getpid(), SCHEDULER_MODE, SCHEDULER_RUNNER))
+    # 设置 METRICS_PORT 后暴露 /metrics (subprocess 执行方式下刷新/同步指标记录在子进程中，只能看到调度器自身的指标)
+    metrics_server = metrics.start_http_server()
+
+    # 租约模式直接以数据库为准，不需要本地账户
+    if SCHEDULER_MODE != "lease":
+        hydrate_if_empty()
+
+    if SCHEDULER_MODE == "sweep":
+        run_sweep_loop()
+    elif SCHEDULER_MODE == "lease":
+        run_lease_loop()
+    else:
+        run_queue_loop()
+
+    # 通知由后台线程异步投递，退出前尽量把发件箱中的消息发出去 (未发出的保留在 spool 中，下次启动继续投递)
+    notify.flush()
+    if metrics_server:
+        metrics_server.shutdown()
     logging.info("👋 调度器已安全退出。Bye!")
 
 if __name__ == "__main__":
@@ -1,10 +1,22 @@
 import json
 import os
+import time
+import queue
+import atexit
+import hashlib
+import itertools
+import argparse
 import psycopg2
+import psycopg2.extras
+import psycopg2.pool
+import threading
 import sys
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import account_store
+import metrics
+import tracing
 
 # Load environment variables
 load_dotenv()
@@ -14,145 +26,644 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 # Configuration
-ACCOUNTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "accounts.json")
 REPORT_FILE = os.path.join("logs", "sync_report.json")
 DB_URL = os.environ.get("DB_URL")
+# 每次 multi-row VALUES 发送的行数
+SYNC_BATCH_SIZE = max(1, int(os.environ.get("SYNC_BATCH_SIZE", "1000")))
+
+# 连接池大小上限 (scheduler 以进程内模式运行时跨轮次复用连接)
+SYNC_POOL_MAX = max(1, int(os.environ.get("SYNC_POOL_MAX", "4")))
+
+# 流水线模式 (刷新与同步重叠): 微批次大小、最长攒批时间、队列容量
+SYNC_MICRO_BATCH = max(1, int(os.environ.get("SYNC_MICRO_BATCH", "100")))
+SYNC_FLUSH_SECONDS = float(os.environ.get("SYNC_FLUSH_SECONDS", "2"))
+SYNC_QUEUE_SIZE = max(1, int(os.environ.get("SYNC_QUEUE_SIZE", "1000")))
+
+# 事件驱动同步: main.py 登录保存成功后立即把该账户交给后台线程写入 account_backups，不必等下一轮定时同步
+# SYNC_ON_LOGIN: 默认开启 (需配置 DB_URL)
+# SYNC_EVENT_FLUSH_SECONDS: 收到第一个事件后最多等待多久再写入，期间的多次登录合并为一个事务
+SYNC_ON_LOGIN = os.environ.get("SYNC_ON_LOGIN", "True").lower() == "true"
+SYNC_EVENT_FLUSH_SECONDS = float(os.environ.get("SYNC_EVENT_FLUSH_SECONDS", "1"))
+
+# 反向拉取 (python sync_db.py --pull): 用服务端游标分批读取 account_backups 写入本地存储，
+# 用于新节点或数据卷丢失后的恢复。SYNC_PULL_BATCH 为每次从游标取回的行数
+SYNC_PULL_BATCH = max(1, int(os.environ.get("SYNC_PULL_BATCH", "5000")))
+
+# 增量同步状态: 上次同步的水位线 + 每个账户 refresh_token/client_id 的内容哈希
+# + 每个账户上次写入 (或确认一致) 时数据库中的 last_modified_at (版本，用于检测其它写入者的修改)
+# 状态文件丢失时会自动退化为全量同步，未知版本的账户以本地为准 (与没有冲突检测时相同)
+SYNC_STATE_FILE = os.environ.get("SYNC_STATE_FILE", os.path.join(account_store.BASE_DIR, "data", "sync_state.json"))
+# 每隔多少小时强制做一次全量对账 (<=0 表示每次都全量)
+SYNC_FULL_RECONCILE_HOURS = float(os.environ.get("SYNC_FULL_RECONCILE_HOURS", "168"))
 
 if not DB_URL:
     logger.error("❌ Error: DB_URL not found in environment variables.")
     # 我们不直接退出了，而是生成一个错误报告，让 scheduler 知道
     # sys.exit(1) 
 
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """返回进程内共享的 PostgreSQL 连接池 (惰性创建)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(1, SYNC_POOL_MAX, DB_URL)
+        return _pool
+
+def get_connection():
+    conn = get_pool().getconn()
+    if conn.closed:
+        get_pool().putconn(conn, close=True)
+        conn = get_pool().getconn()
+    return conn
+
+def release_connection(conn, broken=False):
+    """归还连接；出错的连接直接关闭，避免把中断的事务放回池中"""
+    get_pool().putconn(conn, close=broken or bool(conn.closed))
+
 def ensure_logs_dir():
     if not os.path.exists("logs"):
         os.makedirs("logs")
 
-def load_local_accounts():
-    """读取本地 accounts.json"""
-    if not os.path.exists(ACCOUNTS_FILE):
-        logger.error(f"❌ 本地文件不存在: {ACCOUNTS_FILE}")
-        return {}
+def load_sync_state():
+    """读取增量同步状态，不存在或损坏时返回 None (触发全量同步)"""
+    if not os.path.exists(SYNC_STATE_FILE):
+        return None
     try:
-        with open(ACCOUNTS_FILE, "r", encoding="utf-8") as f:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
             return json.load(f)
     except Exception as e:
-        logger.error(f"❌ 读取本地文件失败: {e}")
-        return {}
+        logger.warning(f"⚠️ 读取同步状态失败，将执行全量同步: {e}")
+        return None
 
-def save_report(stats, error=None):
+def save_sync_state(state):
+    state_dir = os.path.dirname(SYNC_STATE_FILE)
+    if state_dir and not os.path.exists(state_dir):
+        os.makedirs(state_dir)
+    tmp_path = SYNC_STATE_FILE + ".tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, SYNC_STATE_FILE)
+    except Exception as e:
+        logger.error(f"❌ 写入同步状态失败: {e}")
+
+def account_hash(refresh_token, client_id):
+    return hashlib.sha256(f"{refresh_token}\0{client_id}".encode("utf-8")).hexdigest()[:32]
+
+def needs_full_sync(state, force=False):
+    if force or not state or SYNC_FULL_RECONCILE_HOURS <= 0:
+        return True
+    last_full = account_store.parse_timestamp(state.get("last_full_sync"))
+    return time.time() - last_full >= SYNC_FULL_RECONCILE_HOURS * 3600
+
+def is_unchanged(record, digest, hashes, watermark):
+    """
+    增量模式下判断账户自上次同步后是否未变化:
+    内容哈希一致，且 last_refreshed_at/last_modified_at 不晚于水位线 (watermark 为 None 时只比较哈希)。
+    """
+    if hashes.get(record.email.lower()) != digest:
+        return False
+    return watermark is None or account_store.last_touched(record) <= watermark
+
+def base_version(versions, email):
+    """本地副本所基于的数据库版本 (上次同步时数据库的 last_modified_at)，未知时返回 None"""
+    value = versions.get(email.lower())
+    return datetime.fromisoformat(value) if value else None
+
+def save_report(stats, error=None, mode=None):
+    """写出同步报告并返回报告内容"""
     report = {
         "timestamp": datetime.now().isoformat(),
         "stats": stats,
         "error": str(error) if error else None
     }
+    if mode:
+        report["mode"] = mode
     try:
         with open(REPORT_FILE, "w", encoding="utf-8") as f:
             json.dump(report, f, indent=2, ensure_ascii=False)
         logger.info(f"📝 同步报告已写入: {REPORT_FILE}")
     except Exception as e:
         logger.error(f"❌ 写入报告失败: {e}")
+    return report
 
-def sync_to_db():
-    ensure_logs_dir()
-    
+# 把 account_backups.data 解析为 jsonb: 不是 JSON 对象或 JSON 格式错误的行按空对象处理 (与旧版逐行
+# json.loads 失败时的行为一致)，不会让整个合并事务报错。会话级临时函数，不需要建函数的权限
+SAFE_JSONB_SQL = r"""
+    CREATE OR REPLACE FUNCTION pg_temp.safe_jsonb(value text) RETURNS jsonb AS $$
+    BEGIN
+        IF value IS NULL OR value !~ '^\s*\{' THEN
+            RETURN '{}'::jsonb;
+        END IF;
+        RETURN value::jsonb;
+    EXCEPTION WHEN invalid_text_representation THEN
+        RETURN '{}'::jsonb;
+    END
+    $$ LANGUAGE plpgsql IMMUTABLE;
+"""
+
+_data_type = None
+
+def data_column_type(cur):
+    """account_backups.data 的列类型 (text / json / jsonb ...)，写入时转换为该类型；每个进程只查询一次"""
+    global _data_type
+    if _data_type is None:
+        cur.execute("""
+            SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+            WHERE attrelid = 'account_backups'::regclass AND attname = 'data'
+        """)
+        row = cur.fetchone()
+        _data_type = row[0] if row else "text"
+    return _data_type
+
+# 本地账户先批量写入临时表，再用一条语句完成比较与合并 (忽略邮箱大小写)
+CREATE_STAGING_SQL = SAFE_JSONB_SQL + """
+    CREATE TEMP TABLE IF NOT EXISTS sync_incoming (
+        seq INTEGER,
+        email TEXT,
+        refresh_token TEXT,
+        client_id TEXT,
+        base_modified_at TIMESTAMPTZ
+    ) ON COMMIT DELETE ROWS
+"""
+
+# {data_type} 为 data 列的实际类型 (见 data_column_type)
+# 返回每个匹配或新增的账户 (email, 数据库中的 last_modified_at, 结果)，结果为 inserted / updated / unchanged / conflict
+MERGE_SQL = r"""
+    WITH src AS (
+        -- 同一邮箱 (忽略大小写) 出现多次时，以最后一条为准
+        SELECT DISTINCT ON (LOWER(email)) email, refresh_token, client_id, base_modified_at
+        FROM sync_incoming
+        ORDER BY LOWER(email), seq DESC
+    ),
+    matched AS (
+        SELECT s.refresh_token, s.client_id, s.base_modified_at, b.email AS db_email, b.last_modified_at AS db_modified_at,
+               pg_temp.safe_jsonb(b.data::text) AS db_json
+        FROM src s
+        JOIN account_backups b ON LOWER(b.email) = LOWER(s.email)
+    ),
+    upd AS (
+        UPDATE account_backups b
+        SET data = (m.db_json || jsonb_build_object('refresh_token', m.refresh_token, 'client_id', m.client_id))::{data_type},
+            last_modified_at = NOW()
+        FROM matched m
+        WHERE b.email = m.db_email
+          AND (m.db_json->>'refresh_token' IS DISTINCT FROM m.refresh_token
+               OR m.db_json->>'client_id' IS DISTINCT FROM m.client_id)
+          -- 只在数据库中的记录仍是本地上次同步时的版本时回写 (两个时间都来自数据库的时钟)；
+          -- 之后被其它写入者修改过 (如租约模式的 worker 已轮换 Token) 的记录不覆盖。版本未知时以本地为准
+          AND (m.base_modified_at IS NULL OR m.db_modified_at IS NULL OR m.db_modified_at <= m.base_modified_at)
+        RETURNING b.email, b.last_modified_at
+    ),
+    ins AS (
+        INSERT INTO account_backups (email, data, last_modified_at)
+        SELECT s.email, jsonb_build_object('refresh_token', s.refresh_token, 'client_id', s.client_id)::{data_type}, NOW()
+        FROM src s
+        WHERE NOT EXISTS (SELECT 1 FROM account_backups b WHERE LOWER(b.email) = LOWER(s.email))
+        RETURNING email, last_modified_at
+    )
+    SELECT email, last_modified_at, 'inserted' FROM ins
+    UNION ALL
+    SELECT email, last_modified_at, 'updated' FROM upd
+    UNION ALL
+    SELECT m.db_email, m.db_modified_at,
+           CASE WHEN m.db_json->>'refresh_token' IS NOT DISTINCT FROM m.refresh_token
+                 AND m.db_json->>'client_id' IS NOT DISTINCT FROM m.client_id
+                THEN 'unchanged' ELSE 'conflict' END
+    FROM matched m
+    WHERE NOT EXISTS (SELECT 1 FROM upd u WHERE u.email = m.db_email)
+"""
+
+def upsert_accounts(cur, rows):
+    """
+    在当前事务中批量合并账户到 account_backups，返回 (stats, synced)。
+    stats 为 {"inserted", "updated", "skipped"}；synced 为 {LOWER(email): 数据库中的 last_modified_at}，
+    只包含已写入或与数据库一致的账户，因冲突未写入的账户不在其中 (下次同步重试)。
+    与数据库的往返次数为 O(行数 / SYNC_BATCH_SIZE)，而不是每个账户两次。
+    rows 为 (seq, email, refresh_token, client_id, base_modified_at)，可以是生成器，按批次流式写入临时表。
+    """
+    stats = {"inserted": 0, "updated": 0, "skipped": 0}
+
+    # stage 包含流式读取本地账户的时间，merge 是一次纯数据库往返
+    with metrics.SYNC_QUERY_SECONDS.time(stage="stage"), tracing.span("sync_db.stage", "db"):
+        cur.execute(CREATE_STAGING_SQL)
+        cur.execute("TRUNCATE sync_incoming")
+        psycopg2.extras.execute_values(
+            cur,
+            "INSERT INTO sync_incoming (seq, email, refresh_token, client_id, base_modified_at) VALUES %s",
+            rows,
+            page_size=SYNC_BATCH_SIZE,
+        )
+    with metrics.SYNC_QUERY_SECONDS.time(stage="merge"), tracing.span("sync_db.merge", "db"):
+        cur.execute(MERGE_SQL.format(data_type=data_column_type(cur)))
+        results = cur.fetchall()
+
+    synced = {}
+    for email, modified_at, outcome in results:
+        if outcome == "conflict":
+            logger.warning(f"⚠️ [冲突] {email}: 数据库中的记录已被其它写入者更新，未回写本地 Token")
+            stats["skipped"] += 1
+            continue
+        if outcome == "inserted":
+            logger.info(f"🆕 [新增] {email}")
+        elif outcome == "updated":
+            logger.info(f"✅ [更新] {email}")
+        stats["skipped" if outcome == "unchanged" else outcome] += 1
+        synced[email.lower()] = modified_at
+    return stats, synced
+
+def push_rows(rows, mode="sync"):
+    """
+    在一个事务中把 rows (列表或生成器) 合并到 account_backups，返回 (stats, synced) (见 upsert_accounts)，
+    失败时抛出异常。mode 仅用作指标标签 (full / incremental / pipeline)。
+    """
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return {"inserted": 0, "updated": 0, "skipped": 0}, {}
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in itertools.chain([first], rows):
+            count += 1
+            yield row
+
+    started = time.perf_counter()
+    with tracing.span("sync_db.push_rows", "db", mode=mode) as span:
+        conn = get_connection()
+        broken = False
+        try:
+            cur = conn.cursor()
+            stats, synced = upsert_accounts(cur, counted())
+            with metrics.SYNC_QUERY_SECONDS.time(stage="commit"), tracing.span("sync_db.commit", "db"):
+                conn.commit()
+            cur.close()
+        except Exception:
+            broken = True
+            metrics.SYNC_ERRORS.inc(mode=mode)
+            raise
+        finally:
+            release_connection(conn, broken)
+        span.set(rows=count)
+    metrics.SYNC_BATCH_SECONDS.observe(time.perf_counter() - started, mode=mode)
+    metrics.SYNC_BATCH_ROWS.observe(count, mode=mode)
+    metrics.SYNC_ACCOUNTS.inc(stats["inserted"], result="inserted")
+    metrics.SYNC_ACCOUNTS.inc(stats["updated"], result="updated")
+    metrics.SYNC_ACCOUNTS.inc(stats["skipped"], result="skipped")
+    return stats, synced
+
+def run_sync(full=False, use_watermark=True, extra_hashes=None, extra_versions=None):
+    """
+    执行一次同步并推进增量状态，返回 (stats, mode, error)，不写报告。
+    extra_hashes / extra_versions: 本轮之前已经写入数据库的账户哈希与版本 (流水线模式)，视为已同步。
+    """
     stats = {
         "inserted": 0,
         "updated": 0,
         "skipped": 0
     }
 
-    if not DB_URL:
-        save_report(stats, "DB_URL not configured")
-        return
-
-    local_data = load_local_accounts()
-    if not local_data:
+    store = account_store.get_store()
+    if not store.exists():
+        logger.error(f"❌ 本地存储不存在: {store.location}")
         logger.warning("⚠ 没有本地数据，结束同步。")
-        save_report(stats, "No local data found")
-        return
+        return stats, None, "No local data found"
 
-    logger.info(f"🔄 开始同步 {len(local_data)} 个本地账户到数据库...")
+    state = load_sync_state()
+    full = needs_full_sync(state, full)
+    mode = "full" if full else "incremental"
+    # 水位线取同步开始的时间，同步期间发生的修改会在下一轮被捕获
+    sync_started = datetime.now(timezone.utc).isoformat()
 
-    conn = None
-    try:
-        conn = psycopg2.connect(DB_URL)
-        cur = conn.cursor()
-        
-        for email, info in local_data.items():
-            local_refresh_token = info.get("refresh_token")
-            local_client_id = info.get("client_id")
-            
-            if not local_refresh_token or not local_client_id:
-                logger.warning(f"⚠️ 跳过不完整数据: {email}")
+    known = {} if full else dict(state.get("hashes", {}), **(extra_hashes or {}))
+    # 版本在全量同步时也保留: 因冲突未写入的账户仍需与之前的版本比较
+    versions = dict((state or {}).get("versions", {}), **(extra_versions or {}))
+    watermark = None
+    if not full and use_watermark:
+        watermark = account_store.parse_timestamp(state.get("watermark"))
+
+    logger.info(f"🔄 开始{'全量' if full else '增量'}同步: 流式读取 {store.location} ...")
+
+    total = 0
+    unchanged = 0
+    pushed = {}
+
+    def pending_rows():
+        # 逐个读取本地账户，只把需要推送的账户以 (seq, email, refresh_token, client_id, base_modified_at) 交给数据库
+        nonlocal total, unchanged
+        for record in store.iter_records():
+            total += 1
+            if not record.refresh_token or not record.client_id:
+                logger.warning(f"⚠️ 跳过不完整数据: {record.email}")
                 continue
+            digest = account_hash(record.refresh_token, record.client_id)
+            if not full and is_unchanged(record, digest, known, watermark):
+                unchanged += 1
+                continue
+            pushed[record.email.lower()] = digest
+            yield (total, record.email, record.refresh_token, record.client_id, base_version(versions, record.email))
 
-            # 1. 查询数据库是否存在 (忽略大小写)
-            cur.execute("SELECT data, email FROM account_backups WHERE LOWER(email) = LOWER(%s)", (email,))
-            row = cur.fetchone()
-
-            if row:
-                # --- 情况 B: 数据库已存在 (增量融合) ---
-                db_data_str = row[0]
-                db_actual_email = row[1]
-
-                try:
-                    db_json = json.loads(db_data_str)
-                except:
-                    db_json = {} 
-
-                # 检查是否需要更新
-                needs_update = False
-                
-                if db_json.get("refresh_token") != local_refresh_token:
-                    db_json["refresh_token"] = local_refresh_token
-                    needs_update = True
-                
-                if db_json.get("client_id") != local_client_id:
-                    db_json["client_id"] = local_client_id
-                    needs_update = True
-                
-                if needs_update:
-                    new_data_str = json.dumps(db_json, ensure_ascii=False)
-                    cur.execute("""
-                        UPDATE account_backups 
-                        SET data = %s, last_modified_at = NOW() 
-                        WHERE email = %s
-                    """, (new_data_str, db_actual_email))
-                    logger.info(f"✅ [更新] {db_actual_email}")
-                    stats["updated"] += 1
-                else:
-                    stats["skipped"] += 1
-
-            else:
-                # --- 情况 A: 数据库不存在 (新增) ---
-                new_json = {
-                    "refresh_token": local_refresh_token,
-                    "client_id": local_client_id
-                }
-                new_data_str = json.dumps(new_json, ensure_ascii=False)
-                
-                cur.execute("""
-                    INSERT INTO account_backups (email, data, last_modified_at)
-                    VALUES (%s, %s, NOW())
-                """, (email, new_data_str))
-                logger.info(f"🆕 [新增] {email}")
-                stats["inserted"] += 1
-
-        conn.commit()
-        cur.close()
-        
+    try:
+        stats, synced = push_rows(pending_rows(), mode=mode)
+        stats["skipped"] += unchanged
+    except Exception as e:
+        logger.error(f"❌ 数据库操作失败: {e}")
+        return stats, mode, str(e)
+
+    if total == 0:
+        logger.warning("⚠ 没有本地数据，结束同步。")
+        return stats, None, "No local data found"
+    logger.info(f"📤 已推送 {len(pushed)}/{total} 个账户 (已同步 {len(synced)}，未变化 {unchanged})")
+
+    # 只有提交成功后才推进水位线；只记录数据库确认已写入或一致的账户，因冲突未写入的账户下次重试
+    hashes = known
+    for email, modified_at in synced.items():
+        if email in pushed:
+            hashes[email] = pushed[email]
+        if modified_at:
+            versions[email] = modified_at.isoformat()
+    new_state = {
+        "watermark": sync_started,
+        "last_full_sync": sync_started if full else state.get("last_full_sync"),
+        "hashes": hashes,
+        "versions": versions,
+    }
+    save_sync_state(new_state)
+    return stats, mode, None
+
+def sync_to_db(full=False):
+    """
+    把本地账户同步到 account_backups。
+    默认增量同步 (只推送变化的账户)，距上次全量对账超过 SYNC_FULL_RECONCILE_HOURS 或 full=True 时全量同步。
+    返回与 logs/sync_report.json 内容相同的报告。
+    """
+    ensure_logs_dir()
+
+    if not DB_URL:
+        return save_report({"inserted": 0, "updated": 0, "skipped": 0}, "DB_URL not configured")
+
+    stats, mode, error = run_sync(full)
+    if not error:
         logger.info("-" * 50)
-        logger.info(f"🎉 同步完成! 新增: {stats['inserted']}, 更新: {stats['updated']}, 跳过: {stats['skipped']}")
+        logger.info(f"🎉 同步完成 ({mode})! 新增: {stats['inserted']}, 更新: {stats['updated']}, 跳过: {stats['skipped']}")
         logger.info("-" * 50)
-        
-        save_report(stats)
+    return save_report(stats, error, mode=mode)
 
-    except Exception as e:
-        logger.error(f"❌ 数据库操作失败: {e}")
-        save_report(stats, str(e))
+PULL_SQL = """
+    SELECT email, data, last_modified_at FROM account_backups
+"""
+
+def parse_account_data(data):
+    """
+    解析 account_backups.data: text 列为 JSON 字符串，json / jsonb 列由 psycopg2 直接返回 dict。
+    不是 JSON 对象时返回 None。
+    """
+    try:
+        account = json.loads(data) if isinstance(data, str) else data
+    except ValueError:
+        return None
+    return account if isinstance(account, dict) else None
+
+def iter_db_accounts(batch_size=SYNC_PULL_BATCH):
+    """
+    用服务端 (命名) 游标流式读取 account_backups，逐个返回 (email, data, last_modified_at)。
+    每次只从服务器取回 batch_size 行，客户端内存与表大小无关。data 不是 JSON 对象的行会被跳过。
+    """
+    conn = get_connection()
+    broken = False
+    try:
+        with conn.cursor(name="account_backups_pull") as cur:
+            cur.itersize = batch_size
+            with metrics.SYNC_QUERY_SECONDS.time(stage="pull"), tracing.span("sync_db.pull_query", "db"):
+                cur.execute(PULL_SQL)
+            for email, data, modified_at in cur:
+                account = parse_account_data(data)
+                if not email or account is None:
+                    logger.warning(f"⚠️ 跳过无效的数据库记录: {email}")
+                    continue
+                yield email, account, modified_at
+    except Exception:
+        broken = True
+        raise
     finally:
-        if conn:
-            conn.close()
+        if not broken and not conn.closed:
+            # 只读事务: 结束事务 (同时释放服务端游标) 后再归还连接
+            conn.rollback()
+        release_connection(conn, broken)
+
+def pull_from_db():
+    """
+    把 account_backups 合并到本地账户存储 (与 push 方向相反)，返回 {"inserted", "updated", "skipped"}。
+    - 按邮箱 (忽略大小写) 匹配，本地不存在的账户连同数据库中的其它字段一起新建
+    - 已存在的账户只在数据库的 last_modified_at 晚于本地最后一次刷新/登录时才覆盖 refresh_token / client_id，
+      tags / status 等本地字段保持不变；只有 Token 被替换的隔离账户会解除隔离 (与重新登录相同)
+    - 按存储的 write_batch_size 分批提交，JSON 后端整批只重写一次文件
+    """
+    stats = {"inserted": 0, "updated": 0, "skipped": 0}
+    store = account_store.get_store()
+
+    # 本地账户的紧凑索引: LOWER(email) -> (最后刷新/登录时间, refresh_token, client_id, status)
+    local = {}
+    if store.exists():
+        for record in store.iter_records():
+            local[record.email.lower()] = (account_store.last_touched(record), record.refresh_token,
+                                           record.client_id, record.get("status"))
+    logger.info(f"📥 开始从数据库拉取账户 (本地已有 {len(local)} 个) -> {store.location}")
+
+    mutations = []
+
+    def flush():
+        if mutations:
+            with tracing.span("account_store.apply_batch", "store", accounts=len(mutations)):
+                store.apply_batch(mutations)
+            mutations.clear()
+
+    for email, account, modified_at in iter_db_accounts():
+        refresh_token = account.get("refresh_token")
+        client_id = account.get("client_id")
+        if not refresh_token or not client_id:
+            stats["skipped"] += 1
+            continue
+        fields = {"refresh_token": refresh_token, "client_id": client_id}
+        if modified_at:
+            fields["last_modified_at"] = modified_at.isoformat()
+        existing = local.get(email.lower())
+        if existing is None:
+            # 数据库中的其它字段 (如 tags) 只在新建时写入
+            defaults = dict(account_store.NEW_ACCOUNT_DEFAULTS, **account)
+            mutations.append({"op": "upsert", "email": email, "fields": fields, "defaults": defaults})
+            local[email.lower()] = (0.0, refresh_token, client_id, None)
+            stats["inserted"] += 1
+        else:
+            touched, local_token, local_client_id, status = existing
+            db_touched = modified_at.timestamp() if modified_at else 0.0
+            if (refresh_token, client_id) == (local_token, local_client_id) or db_touched <= touched:
+                stats["skipped"] += 1
+                continue
+            mutation = {"op": "update", "email": email, "fields": fields}
+            if status == account_store.STATUS_QUARANTINED:
+                fields["status"] = account_store.STATUS_ACTIVE
+                mutation["remove"] = list(account_store.STALE_STATUS_FIELDS)
+            mutations.append(mutation)
+            stats["updated"] += 1
+        if store.write_batch_size and len(mutations) >= store.write_batch_size:
+            flush()
+    flush()
+    return stats
+
+def hydrate():
+    """命令行入口: 拉取数据库中的账户到本地存储并输出统计"""
+    if not DB_URL:
+        logger.error("❌ 未配置 DB_URL，无法拉取")
+        return None
+    started = time.perf_counter()
+    stats = pull_from_db()
+    logger.info("-" * 50)
+    logger.info(f"🎉 拉取完成 ({time.perf_counter() - started:.2f}s)! 新增: {stats['inserted']}, 更新: {stats['updated']}, 跳过: {stats['skipped']}")
+    logger.info("-" * 50)
+    return stats
+
+_STOP = object()
+
+class SyncWriter:
+    """
+    流水线模式的数据库写入器。
+    刷新成功的账户通过有界队列送到后台线程，攒够 SYNC_MICRO_BATCH 条或等待 SYNC_FLUSH_SECONDS 秒后
+    作为一个微批次写入数据库，使刷新与同步重叠进行。队列满时 submit 会阻塞，形成背压。
+    check_versions=False 时不做冲突检测，总是以提交的 Token 为准 (登录得到的新 Token)。
+    """
+
+    def __init__(self, batch_size=SYNC_MICRO_BATCH, flush_seconds=SYNC_FLUSH_SECONDS, max_pending=SYNC_QUEUE_SIZE,
+                 mode="pipeline", check_versions=True):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.mode = mode
+        self.stats = {"inserted": 0, "updated": 0, "skipped": 0}
+        self.error = None if DB_URL else "DB_URL not configured"
+        self.batches = 0
+        self._pushed = {}  # email.lower() -> 已写入数据库的内容哈希
+        # email.lower() -> 数据库版本: 启动时取自同步状态，每次写入后更新
+        self._versions = dict((load_sync_state() or {}).get("versions", {})) if check_versions and DB_URL else {}
+        self._written_versions = {}
+        self.check_versions = check_versions
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="sync-writer", daemon=True)
+
+    def start(self):
+        if DB_URL:
+            self._thread.start()
+        return self
+
+    def submit(self, email, refresh_token, client_id, block=True):
+        """
+        提交一个刷新成功的账户 (在刷新主线程中调用)，返回是否已入队。
+        block=False 时队列满直接返回 False，不阻塞调用方。
+        """
+        if not DB_URL:
+            return False
+        try:
+            base = base_version(self._versions, email) if self.check_versions else None
+            self._queue.put((email, refresh_token, client_id, base), block=block)
+        except queue.Full:
+            return False
+        return True
+
+    def _run(self):
+        rows = []
+        deadline = None
+        while True:
+            timeout = max(0, deadline - time.monotonic()) if rows else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                break
+            if item is not None:
+                if not rows:
+                    deadline = time.monotonic() + self.flush_seconds
+                rows.append((len(rows),) + item)
+                if len(rows) < self.batch_size:
+                    continue
+            self._flush(rows)
+            rows = []
+        if rows:
+            self._flush(rows)
+
+    def _flush(self, rows):
+        try:
+            stats, synced = push_rows(rows, mode=self.mode)
+        except Exception as e:
+            # 失败的账户没有记录哈希，之后的增量同步会重新推送
+            self.error = str(e)
+            logger.error(f"❌ 微批次写入失败 ({len(rows)} 个账户): {e}")
+            return
+        for key, value in stats.items():
+            self.stats[key] += value
+        for _, email, refresh_token, client_id, _ in rows:
+            key = email.lower()
+            if key not in synced:
+                continue
+            self._pushed[key] = account_hash(refresh_token, client_id)
+            if synced[key]:
+                self._written_versions[key] = self._versions[key] = synced[key].isoformat()
+        self.batches += 1
+        logger.info(f"💾 微批次已写入: {len(rows)} 个账户 (新增 {stats['inserted']}, 更新 {stats['updated']})")
+
+    def stop(self, timeout=None):
+        """写完队列中剩余的账户后停止后台线程"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def close(self, catch_up=True):
+        """
+        等待队列写完并返回同步报告。
+        catch_up=True 时再做一次只比较哈希的增量同步，补上不是由本轮刷新产生的变化 (如期间的新登录)。
+        """
+        ensure_logs_dir()
+        self.stop()
+
+        mode = "pipeline"
+        if catch_up and DB_URL:
+            stats, _, error = run_sync(use_watermark=False, extra_hashes=self._pushed,
+                                       extra_versions=self._written_versions)
+            for key, value in stats.items():
+                self.stats[key] += value
+            self.error = self.error or error
+
+        logger.info(f"🎉 流水线同步完成! 微批次 {self.batches} 个，新增: {self.stats['inserted']}, 更新: {self.stats['updated']}, 跳过: {self.stats['skipped']}")
+        return save_report(self.stats, self.error, mode=mode)
+
+_event_writer = None
+_event_lock = threading.Lock()
+
+def publish_change(email, refresh_token, client_id):
+    """
+    事件驱动同步: 账户保存成功后调用 (如 main.py 的登录回调)，只把这一个账户交给后台线程，
+    SYNC_EVENT_FLUSH_SECONDS 内的多个事件合并为一个事务写入 account_backups。
+    返回是否已入队；未配置数据库、已关闭或队列已满时返回 False，该账户由下一次定时同步补上。
+    """
+    global _event_writer
+    if not (SYNC_ON_LOGIN and DB_URL):
+        return False
+    with _event_lock:
+        if _event_writer is None:
+            # 登录得到的是用户刚授权的新 Token，总是覆盖数据库中的旧值
+            _event_writer = SyncWriter(flush_seconds=SYNC_EVENT_FLUSH_SECONDS, mode="event", check_versions=False).start()
+            # 进程退出前把已入队的账户写完 (最多等待几秒)
+            atexit.register(_event_writer.stop, 5)
+    return _event_writer.submit(email, refresh_token, client_id, block=False)
 
 if __name__ == "__main__":
-    sync_to_db()
+    parser = argparse.ArgumentParser(description="同步本地账户到 PostgreSQL")
+    parser.add_argument("--full", action="store_true", help="强制全量对账，忽略增量同步状态")
+    parser.add_argument("--pull", action="store_true", help="反向拉取: 把 account_backups 中的账户合并到本地存储")
+    args = parser.parse_args()
+    if args.pull:
+        sys.exit(0 if hydrate() is not None else 1)
+    sync_to_db(full=args.full)
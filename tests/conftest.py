@@ -0,0 +1,59 @@
+import os
+import sys
+import uuid
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 集成测试使用的 PostgreSQL (可随意读写的测试库)，未设置时相关测试跳过
+TEST_DB_URL = os.environ.get("TEST_DB_URL")
+
+
+@pytest.fixture(params=["text", "jsonb"])
+def db(request, monkeypatch):
+    """
+    在独立的临时 schema 中创建 account_backups (data 列分别为 text / jsonb)，让 sync_db 连接到该 schema。
+    返回 (sync_db, admin_conn, schema)，结束后删除 schema。
+    """
+    if not TEST_DB_URL:
+        pytest.skip("未设置 TEST_DB_URL")
+    psycopg2 = pytest.importorskip("psycopg2")
+    import psycopg2.extensions
+    import sync_db
+
+    schema = f"test_sync_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(TEST_DB_URL)
+    admin.autocommit = True
+    with admin.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA {schema}")
+        cur.execute(f"""
+            CREATE TABLE {schema}.account_backups (
+                email TEXT PRIMARY KEY,
+                data {request.param},
+                last_modified_at TIMESTAMPTZ
+            )
+        """)
+
+    monkeypatch.setattr(sync_db, "DB_URL", psycopg2.extensions.make_dsn(TEST_DB_URL, options=f"-c search_path={schema}"))
+    monkeypatch.setattr(sync_db, "_pool", None)
+    monkeypatch.setattr(sync_db, "_data_type", None)
+    try:
+        yield sync_db, admin, schema
+    finally:
+        if sync_db._pool is not None:
+            sync_db._pool.closeall()
+        with admin.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {schema} CASCADE")
+        admin.close()
+
+
+@pytest.fixture
+def json_store(tmp_path, monkeypatch):
+    """临时目录中的 accounts.json 存储，同时作为 account_store.get_store() 返回的共享实例"""
+    import account_store
+
+    store = account_store.JsonAccountStore(str(tmp_path / "accounts.json"))
+    monkeypatch.setattr(account_store, "_store", store)
+    return store
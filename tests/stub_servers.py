@@ -0,0 +1,200 @@
+"""测试用的本地 stub 服务 (只监听 127.0.0.1，不访问外部网络)"""
+import base64
+import json
+import os
+import secrets
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+
+def make_self_signed_cert(directory):
+    """用 openssl 生成 localhost 的自签名证书，返回 (cert_path, key_path)；没有 openssl 时跳过测试"""
+    openssl = shutil.which("openssl")
+    if not openssl:
+        pytest.skip("未找到 openssl，无法生成 stub authority 的证书")
+    cert_path = os.path.join(directory, "stub-cert.pem")
+    key_path = os.path.join(directory, "stub-key.pem")
+    subprocess.run(
+        [openssl, "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-keyout", key_path, "-out", cert_path, "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost,IP:127.0.0.1"],
+        check=True, capture_output=True,
+    )
+    return cert_path, key_path
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+
+
+class StubAuthority(ThreadingHTTPServer):
+    """
+    模拟 Entra ID 授权服务器 (HTTPS)：OpenID 配置、/authorize 与授权码换取 Token。
+    requests 记录每个 (方法, 路径) 的请求次数，用于断言元数据是否重新获取。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, cert_path, key_path, tenant="stub-tenant", client_id="stub-client"):
+        super().__init__(("127.0.0.1", 0), _AuthorityHandler)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+        self.tenant = tenant
+        self.client_id = client_id
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.codes = {}
+
+    @property
+    def authority(self):
+        return f"https://localhost:{self.server_address[1]}/{self.tenant}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-authority", daemon=True).start()
+        return self
+
+    def count(self, method, path):
+        with self.lock:
+            return self.requests.get((method, path), 0)
+
+    def openid_configuration(self):
+        return {
+            "issuer": f"{self.authority}/v2.0",
+            "authorization_endpoint": f"{self.authority}/oauth2/v2.0/authorize",
+            "token_endpoint": f"{self.authority}/oauth2/v2.0/token",
+        }
+
+    def issue_code(self, nonce):
+        code = secrets.token_urlsafe(16)
+        with self.lock:
+            self.codes[code] = nonce
+        return code
+
+    def redeem_code(self, code):
+        with self.lock:
+            nonce = self.codes.pop(code, None)
+        if nonce is None:
+            return 400, {"error": "invalid_grant", "error_description": "unknown code"}
+        now = int(time.time())
+        claims = {
+            "iss": f"{self.authority}/v2.0", "aud": self.client_id, "sub": "stub-user",
+            "iat": now, "nbf": now, "exp": now + 3600, "nonce": nonce,
+            "preferred_username": "stub.user@example.com",
+        }
+        return 200, {
+            "token_type": "Bearer",
+            "scope": "openid profile offline_access",
+            "expires_in": 3600,
+            "access_token": f"stub.access.{secrets.token_hex(8)}",
+            "refresh_token": f"stub.refresh.{secrets.token_hex(8)}",
+            "id_token": f"{_b64({'alg': 'none', 'typ': 'JWT'})}.{_b64(claims)}.",
+        }
+
+
+class _AuthorityHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _record(self, method):
+        path = urlparse(self.path).path
+        with self.server.lock:
+            key = (method, path)
+            self.server.requests[key] = self.server.requests.get(key, 0) + 1
+        return path
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self._record("GET")
+        prefix = f"/{self.server.tenant}"
+        if path == f"{prefix}/v2.0/.well-known/openid-configuration":
+            self._send_json(200, self.server.openid_configuration())
+        elif path == f"{prefix}/oauth2/v2.0/authorize":
+            # 直接签发授权码 (不模拟登录页)，用 JSON 返回而不是重定向
+            params = parse_qs(urlparse(self.path).query)
+            code = self.server.issue_code(params.get("nonce", [""])[0])
+            self._send_json(200, {"code": code, "state": params.get("state", [""])[0]})
+        else:
+            self._send_json(404, {"error": "not_found"})
+
+    def do_POST(self):
+        path = self._record("POST")
+        form = parse_qs(self.rfile.read(int(self.headers.get("Content-Length") or 0)).decode())
+        if path == f"/{self.server.tenant}/oauth2/v2.0/token" and form.get("grant_type") == ["authorization_code"]:
+            self._send_json(*self.server.redeem_code(form.get("code", [""])[0]))
+        else:
+            self._send_json(400, {"error": "unsupported_grant_type"})
+
+
+class StubNotifyHub(ThreadingHTTPServer):
+    """模拟 Notify Hub 的 POST 接口 (HTTP)，记录收到的消息；status 可修改以模拟故障"""
+
+    daemon_threads = True
+
+    def __init__(self, key="stub-key"):
+        super().__init__(("127.0.0.1", 0), _HubHandler)
+        self.key = key
+        self.status = 200
+        self.lock = threading.Lock()
+        self.received = []
+        self.arrived = threading.Event()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/notify"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="stub-notify-hub", daemon=True).start()
+        return self
+
+    def wait_for(self, count, timeout):
+        """等待累计收到 count 条请求，返回是否在 timeout 秒内收到"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.lock:
+                if len(self.received) >= count:
+                    return True
+            self.arrived.wait(timeout=0.05)
+            self.arrived.clear()
+        with self.lock:
+            return len(self.received) >= count
+
+
+class _HubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        if self.headers.get("X-Project-Key") != self.server.key:
+            status = 403
+        else:
+            status = self.server.status
+        if status == 200:
+            with self.server.lock:
+                self.server.received.append(body)
+            self.server.arrived.set()
+        data = json.dumps({"ok": status == 200}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
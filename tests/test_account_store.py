@@ -0,0 +1,59 @@
+import io
+import json
+
+import pytest
+
+import account_store
+
+DATA = {
+    "a@example.com": {"refresh_token": "rt-a", "client_id": "c", "tags": ["x", "中文"], "token_failures": 12345},
+    "B@Example.com": {"refresh_token": "rt-\"quoted\"", "client_id": "c", "nested": {"k": [1, 2.5, None, True]}},
+    "c@example.com": {},
+}
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_iter_json_accounts_matches_json_load(tmp_path, chunk_size):
+    # 小缓冲区迫使 token、数字与字符串跨越读取边界
+    path = write(tmp_path / "accounts.json", json.dumps(DATA, indent=2, ensure_ascii=False))
+    assert dict(account_store.iter_json_accounts(path, chunk_size=chunk_size)) == DATA
+
+
+@pytest.mark.parametrize("text", ["", "  \n", "{}", " { } "])
+def test_iter_json_accounts_empty(tmp_path, text):
+    assert list(account_store.iter_json_accounts(write(tmp_path / "accounts.json", text))) == []
+
+
+@pytest.mark.parametrize("text", ["[]", '{"a@example.com": {}', '{"a@example.com" {}}', '{"a@example.com": {}} trailing'])
+def test_iter_json_accounts_rejects_malformed(tmp_path, text):
+    path = write(tmp_path / "accounts.json", text)
+    with pytest.raises(ValueError):
+        list(account_store.iter_json_accounts(path, chunk_size=4))
+
+
+def test_iter_json_accounts_is_incremental(tmp_path):
+    path = write(tmp_path / "accounts.json", json.dumps(DATA) + "garbage")
+    items = account_store.iter_json_accounts(path, chunk_size=8)
+    # 前面的账户在读到末尾的错误之前就已返回
+    assert next(items)[0] == "a@example.com"
+    with pytest.raises(ValueError):
+        list(items)
+
+
+@pytest.mark.parametrize("data", [DATA, {}])
+def test_write_json_accounts_matches_json_dump(data):
+    out = io.StringIO()
+    account_store.write_json_accounts(out, iter(data.items()))
+    assert out.getvalue() == json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def test_json_store_streams_records(json_store):
+    json_store.upsert("a@example.com", {"refresh_token": "rt", "client_id": "c", "tags": ["x"]})
+    [record] = list(json_store.iter_records())
+    assert (record.email, record.refresh_token, record.client_id, record.get("tags")) == ("a@example.com", "rt", "c", ["x"])
+    assert record.to_dict() == {"refresh_token": "rt", "client_id": "c", "tags": ["x"]}
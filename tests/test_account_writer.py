@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+import account_store
+import account_writer
+
+
+def upsert(email, token):
+    return {"op": "upsert", "email": email, "fields": {"refresh_token": token, "client_id": "c"}}
+
+
+def test_concurrent_requests_share_one_commit(json_store):
+    writer = account_writer.AccountWriter(json_store, max_batch=10, linger_ms=50)
+    # 启动前入队的请求在第一次提交中一起写入
+    futures = [writer.submit([upsert(f"u{i}@example.com", f"rt{i}")]) for i in range(5)]
+    writer.start()
+    results = [f.result(timeout=5) for f in futures]
+
+    assert writer.commits == 1
+    assert results == [[{"key": f"u{i}@example.com", "created": True}] for i in range(5)]
+    assert json_store.count() == 5
+
+
+def test_batch_respects_max_batch(json_store):
+    writer = account_writer.AccountWriter(json_store, max_batch=2, linger_ms=50)
+    futures = [writer.submit([upsert(f"u{i}@example.com", "rt")]) for i in range(5)]
+    writer.start()
+    for f in futures:
+        f.result(timeout=5)
+    assert writer.commits == 3
+
+
+def test_results_are_split_per_request(json_store):
+    json_store.upsert("Existing@example.com", {"refresh_token": "old", "client_id": "c"})
+    writer = account_writer.AccountWriter(json_store, linger_ms=50)
+    first = writer.submit([upsert("a@example.com", "rt-a"),
+                           {"op": "update", "email": "existing@example.com", "fields": {"refresh_token": "new"}}])
+    second = writer.submit([{"op": "update", "email": "missing@example.com", "fields": {"refresh_token": "x"}}])
+    writer.start()
+
+    assert first.result(timeout=5) == [{"key": "a@example.com", "created": True}, {"key": "Existing@example.com"}]
+    assert second.result(timeout=5) == [{"key": None}]
+    assert json_store.get("existing@example.com")[1]["refresh_token"] == "new"
+
+
+class FailingStore(account_store.JsonAccountStore):
+    def apply_batch(self, mutations):
+        raise OSError("disk full")
+
+
+def test_failed_commit_fails_every_request_in_batch(tmp_path):
+    writer = account_writer.AccountWriter(FailingStore(str(tmp_path / "accounts.json")), linger_ms=50)
+    futures = [writer.submit([upsert(f"u{i}@example.com", "rt")]) for i in range(3)]
+    writer.start()
+    for f in futures:
+        with pytest.raises(OSError, match="disk full"):
+            f.result(timeout=5)
+    assert writer.commits == 0
+
+
+def test_client_round_trip_over_unix_socket(json_store, tmp_path):
+    socket_path = str(tmp_path / "writer.sock")
+    server = account_writer._Server(socket_path, account_writer._Handler)
+    server.writer = account_writer.AccountWriter(json_store).start()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        client = account_writer.AccountWriterClient(socket_path, timeout=5, connect_wait=1)
+        assert client.submit([upsert("a@example.com", "rt")]) == [{"key": "a@example.com", "created": True}]
+        with pytest.raises(RuntimeError):
+            client.submit([{"op": "upsert", "email": "b@example.com"}])
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert json_store.get("A@example.com")[1]["refresh_token"] == "rt"
+
+
+def test_client_gives_up_when_writer_is_not_running(tmp_path):
+    client = account_writer.AccountWriterClient(str(tmp_path / "missing.sock"), timeout=1, connect_wait=0)
+    with pytest.raises(account_writer.WriterUnavailable):
+        client.submit([upsert("a@example.com", "rt")])
@@ -0,0 +1,58 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+import bulk_io
+
+
+def test_spool_upload_copies_body():
+    path = bulk_io.spool_upload(io.BytesIO(b"a" * 10), "csv", max_bytes=10, chunk_size=3)
+    try:
+        assert path.endswith(".csv")
+        with open(path, "rb") as f:
+            assert f.read() == b"a" * 10
+    finally:
+        os.remove(path)
+
+
+def test_spool_upload_rejects_oversized_body_and_removes_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    with pytest.raises(bulk_io.UploadTooLarge):
+        bulk_io.spool_upload(io.BytesIO(b"a" * 11), "ndjson", max_bytes=10, chunk_size=4)
+    assert os.listdir(tmp_path) == []
+
+
+def test_detect_format():
+    assert bulk_io.detect_format(content_type="text/csv; charset=utf-8") == "csv"
+    assert bulk_io.detect_format(name="ACCOUNTS.CSV") == "csv"
+    assert bulk_io.detect_format(name="accounts.jsonl") == "ndjson"
+    assert bulk_io.detect_format() == "ndjson"
+
+
+def test_parse_csv_normalizes_headers_and_values():
+    stream = io.StringIO(" Email ,REFRESH_TOKEN,client_id,\na@example.com , rt-a ,c,extra\nb@example.com,,c\n")
+    assert list(bulk_io.parse_records(stream, "csv")) == [
+        {"email": "a@example.com", "refresh_token": "rt-a", "client_id": "c"},
+        {"email": "b@example.com", "refresh_token": "", "client_id": "c"},
+    ]
+
+
+def test_parse_ndjson_reports_bad_lines_and_skips_blank_lines():
+    stream = io.StringIO('{"email": "a@example.com", "refresh_token": "rt", "client_id": "c"}\n'
+                         '\n'
+                         '{broken\n'
+                         '["not", "an", "object"]\n')
+    records = list(bulk_io.parse_records(stream, "ndjson"))
+    assert records[0] == {"email": "a@example.com", "refresh_token": "rt", "client_id": "c"}
+    assert records[1]["_error"].startswith("第 3 行不是有效的 JSON")
+    assert records[2] == {"_error": "第 4 行不是 JSON 对象"}
+    assert len(records) == 3
+
+
+def test_parse_records_is_lazy():
+    def lines():
+        yield '{"email": "a@example.com"}\n'
+        raise AssertionError("只应读取需要的行")
+    assert next(bulk_io.parse_records(lines(), "ndjson")) == {"email": "a@example.com"}
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+import flow_store
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(ttl=600, max_entries=100):
+        if request.param == "memory":
+            return flow_store.MemoryFlowStore(ttl=ttl, max_entries=max_entries)
+        return flow_store.SqliteFlowStore(str(tmp_path / "flows.db"), ttl=ttl, max_entries=max_entries)
+    return make
+
+
+def test_pop_returns_flow_once(make_store):
+    store = make_store()
+    store.put("s1", {"state": "s1", "code_verifier": "v"})
+    assert store.pop("s1") == {"state": "s1", "code_verifier": "v"}
+    assert store.pop("s1") is None
+    assert store.pop("unknown") is None
+
+
+def test_expired_flow_is_rejected(make_store, monkeypatch):
+    store = make_store(ttl=10)
+    store.put("s1", {"state": "s1"})
+    now = time.time()
+    monkeypatch.setattr(flow_store.time, "time", lambda: now + 11)
+    assert store.pop("s1") is None
+
+
+def test_expired_flows_are_purged_on_put(make_store, monkeypatch):
+    store = make_store(ttl=10, max_entries=2)
+    store.put("old", {"state": "old"})
+    now = time.time()
+    monkeypatch.setattr(flow_store.time, "time", lambda: now + 11)
+    store.put("a", {"state": "a"})
+    store.put("b", {"state": "b"})
+    # 过期的流程先被清理，不占用容量，新流程都保留
+    assert store.pop("a") == {"state": "a"}
+    assert store.pop("b") == {"state": "b"}
+
+
+def test_oldest_flow_evicted_beyond_max_entries(make_store, monkeypatch):
+    store = make_store(max_entries=2)
+    now = time.time()
+    for i, state in enumerate(["s1", "s2", "s3"]):
+        monkeypatch.setattr(flow_store.time, "time", lambda i=i: now + i)
+        store.put(state, {"state": state})
+    assert store.pop("s1") is None
+    assert store.pop("s2") == {"state": "s2"}
+    assert store.pop("s3") == {"state": "s3"}
+
+
+def test_sqlite_store_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "flows.db")
+    flow_store.SqliteFlowStore(path).put("s1", {"state": "s1"})
+    assert flow_store.SqliteFlowStore(path).pop("s1") == {"state": "s1"}
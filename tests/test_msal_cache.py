@@ -0,0 +1,87 @@
+import json
+import os
+
+import msal
+import pytest
+import requests
+
+import msal_cache
+from stub_servers import StubAuthority, make_self_signed_cert
+
+
+@pytest.fixture
+def authority(tmp_path, monkeypatch):
+    cert_path, key_path = make_self_signed_cert(str(tmp_path))
+    # msal 内部使用 requests，信任 stub 的自签名证书
+    monkeypatch.setenv("REQUESTS_CA_BUNDLE", cert_path)
+    server = StubAuthority(cert_path, key_path).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def build_app(authority, http_cache):
+    # 与 main.py 相同的参数 (Public Client)
+    return msal.PublicClientApplication(
+        authority.client_id, authority=authority.authority,
+        token_cache=msal_cache.DiscardingTokenCache(), http_cache=http_cache,
+        instance_discovery=False,
+    )
+
+
+def discovery_count(authority):
+    return authority.count("GET", f"/{authority.tenant}/v2.0/.well-known/openid-configuration")
+
+
+def test_metadata_persisted_as_json_and_reused(authority, tmp_path):
+    cache_dir = str(tmp_path / "msal")
+    http_cache = msal_cache.load_http_cache(cache_dir)
+    build_app(authority, http_cache)
+    msal_cache.save_http_cache(http_cache)
+    assert discovery_count(authority) == 1
+
+    with open(os.path.join(cache_dir, msal_cache.HTTP_CACHE_FILENAME), encoding="utf-8") as f:
+        payload = json.load(f)
+    (key, entry), = payload["entries"].items()
+    assert key.startswith("GET ") and "openid-configuration" in key
+    assert json.loads(entry["text"]) == authority.openid_configuration()
+
+    # 模拟重启: 新进程从文件加载，不再请求 OpenID 配置
+    reloaded = msal_cache.load_http_cache(cache_dir)
+    app = build_app(authority, reloaded)
+    assert discovery_count(authority) == 1
+    assert app.authority.token_endpoint == authority.openid_configuration()["token_endpoint"]
+
+
+def test_corrupt_cache_file_is_refetched(authority, tmp_path):
+    cache_dir = tmp_path / "msal"
+    cache_dir.mkdir()
+    (cache_dir / msal_cache.HTTP_CACHE_FILENAME).write_text("not json")
+    http_cache = msal_cache.load_http_cache(str(cache_dir))
+    assert dict(http_cache) == {}
+    build_app(authority, http_cache)
+    assert discovery_count(authority) == 1
+
+
+def test_login_does_not_persist_or_keep_tokens(authority, tmp_path):
+    cache_dir = tmp_path / "msal"
+    cache_dir.mkdir()
+    legacy = cache_dir / "msal_token_cache.json"
+    legacy.write_text('{"RefreshToken": {"x": {"secret": "old"}}}')
+
+    http_cache = msal_cache.load_http_cache(str(cache_dir))
+    assert not legacy.exists()
+    app = build_app(authority, http_cache)
+
+    flow = app.initiate_auth_code_flow(["User.Read"], redirect_uri="https://localhost/callback")
+    grant = requests.get(flow["auth_uri"], timeout=5).json()
+    result = app.acquire_token_by_auth_code_flow(flow, grant)
+    msal_cache.save_http_cache(http_cache)
+
+    assert result["refresh_token"].startswith("stub.refresh.")
+    assert result["id_token_claims"]["preferred_username"] == "stub.user@example.com"
+    # MSAL 的 Token 缓存中没有任何条目，磁盘上也只有元数据文件
+    assert app.get_accounts() == []
+    assert list(app.token_cache.search(msal.TokenCache.CredentialType.REFRESH_TOKEN)) == []
+    assert sorted(os.listdir(cache_dir)) == [msal_cache.HTTP_CACHE_FILENAME]
+    assert result["refresh_token"] not in (cache_dir / msal_cache.HTTP_CACHE_FILENAME).read_text()
@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import notify
+from stub_servers import StubNotifyHub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def hub(monkeypatch):
+    server = StubNotifyHub().start()
+    monkeypatch.setenv("NOTIFY_API_URL", server.url)
+    monkeypatch.setenv("NOTIFY_KEY", server.key)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def message(title, level="info", ts=None):
+    return {"id": title, "ts": ts or time.time(), "title": title, "content": f"{title} body", "level": level}
+
+
+def append_from_other_process(path, title):
+    code = (
+        "import sys, time, notify\n"
+        "notify.Outbox(sys.argv[1]).append("
+        "{'id': sys.argv[2], 'ts': time.time(), 'title': sys.argv[2], 'content': 'x', 'level': 'info'})\n"
+    )
+    subprocess.run([sys.executable, "-c", code, path, title], cwd=ROOT, check=True, timeout=30)
+
+
+def test_sender_picks_up_messages_appended_by_another_process(hub, tmp_path):
+    path = str(tmp_path / "outbox.jsonl")
+    outbox = notify.Outbox(path, window=0, poll_interval=0.1)
+    outbox.start()
+    # 投递线程空闲时 (没有待发消息) 默认等待一小时，只能靠轮询 spool 文件发现其它进程的追加
+    deadline = time.monotonic() + 5
+    while outbox._sender_lock_file is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert outbox._sender_lock_file is not None
+
+    append_from_other_process(path, "from-child")
+    assert hub.wait_for(1, timeout=5)
+    assert hub.received[0]["title"] == "from-child"
+    assert hub.wait_for(1, timeout=0) and not outbox.pending()
+
+
+def test_digest_merges_same_level(hub, tmp_path):
+    outbox = notify.Outbox(str(tmp_path / "outbox.jsonl"), window=0)
+    for title in ("a", "b"):
+        outbox.append(message(title, level="error"))
+    outbox.append(message("c", level="info"))
+
+    assert outbox.deliver_once(force=True) == 0.0
+    titles = sorted(body["title"] for body in hub.received)
+    assert titles == ["c", "📦 2 条错误通知汇总"]
+    assert outbox.pending() == []
+
+
+def test_transient_failure_keeps_messages_and_backs_off(hub, tmp_path):
+    outbox = notify.Outbox(str(tmp_path / "outbox.jsonl"), window=0)
+    outbox.append(message("a"))
+    hub.status = 503
+
+    assert outbox.deliver_once() >= 0.0
+    assert outbox._failures == 1
+    assert [m["id"] for m in outbox.pending()] == ["a"]
+
+    hub.status = 200
+    assert outbox.flush(timeout=5)
+    assert [body["title"] for body in hub.received] == ["a"]
+
+
+def test_rejected_key_drops_messages(hub, tmp_path, monkeypatch):
+    monkeypatch.setenv("NOTIFY_KEY", "wrong")
+    outbox = notify.Outbox(str(tmp_path / "outbox.jsonl"), window=0)
+    outbox.append(message("a"))
+
+    outbox.deliver_once(force=True)
+    assert outbox.pending() == []
+    assert hub.received == []
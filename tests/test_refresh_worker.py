@@ -0,0 +1,64 @@
+"""refresh_worker 租约模式: 认领结果的解析 (离线) 与 jsonb 列上的认领 / 写回 (需要 TEST_DB_URL)"""
+import json
+
+import pytest
+
+import refresh_worker
+import sync_db
+
+
+def make_worker(monkeypatch, rows):
+    worker = refresh_worker.LeaseWorker(worker_id="test-worker")
+    worker._ready = True
+    monkeypatch.setattr(worker, "_execute", lambda func: rows)
+    return worker
+
+
+@pytest.mark.parametrize("raw", [
+    json.dumps({"refresh_token": "rt", "client_id": "cid"}),  # text 列
+    {"refresh_token": "rt", "client_id": "cid"},  # json / jsonb 列: psycopg2 返回 dict
+])
+def test_claim_parses_text_and_jsonb_data(monkeypatch, raw):
+    worker = make_worker(monkeypatch, [("a@example.com", raw)])
+    assert worker.claim() == [("a@example.com", {"refresh_token": "rt", "client_id": "cid"})]
+
+
+@pytest.mark.parametrize("raw", [None, "{not json", "[1, 2]", ["list"]])
+def test_claim_treats_invalid_data_as_empty(monkeypatch, raw):
+    worker = make_worker(monkeypatch, [("a@example.com", raw)])
+    assert worker.claim() == [("a@example.com", {})]
+
+
+def test_ensure_schema_requires_explicit_migration(monkeypatch):
+    worker = refresh_worker.LeaseWorker(worker_id="test-worker")
+    monkeypatch.setattr(worker, "_execute", lambda func: None)
+    with pytest.raises(refresh_worker.MigrationRequired):
+        worker.ensure_schema()
+    assert not worker._ready
+
+
+def test_claim_and_write_back_on_database(db, monkeypatch):
+    _, admin, schema = db
+    with admin.cursor() as cur:
+        cur.execute(f"INSERT INTO {schema}.account_backups (email, data, last_modified_at) "
+                    f"VALUES (%s, %s, NOW() - interval '30 days')",
+                    ("a@example.com", json.dumps({"refresh_token": "old", "client_id": "cid", "note": "keep"})))
+
+    worker = refresh_worker.LeaseWorker(worker_id="test-worker")
+    with pytest.raises(refresh_worker.MigrationRequired):
+        worker.ensure_schema()
+    worker._execute(refresh_worker.migrate)
+
+    claimed = worker.claim()
+    assert claimed == [("a@example.com", {"refresh_token": "old", "client_id": "cid", "note": "keep"})]
+    # 已被认领的账户不会再次被认领
+    assert worker.claim() == []
+
+    written = worker.complete([{"email": "a@example.com", "ok": True, "refresh_token": "new"}])
+    assert written == 1
+    with admin.cursor() as cur:
+        cur.execute(f"SELECT data::text, next_due_at > NOW() + interval '1 day' FROM {schema}.account_backups")
+        data, rescheduled = cur.fetchone()
+    assert json.loads(data)["refresh_token"] == "new"
+    assert json.loads(data)["note"] == "keep"
+    assert rescheduled
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import account_store
+import scheduler
+
+WINDOW = 86400
+
+
+def iso(seconds_ago):
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)).isoformat()
+
+
+def add(store, email, **fields):
+    store.upsert(email, dict({"refresh_token": f"rt-{email}", "client_id": "c"}, **fields))
+
+
+@pytest.fixture
+def queue(json_store):
+    add(json_store, "old@example.com", last_refreshed_at=iso(2 * WINDOW))
+    add(json_store, "recent@example.com", last_refreshed_at=iso(WINDOW / 2))
+    # 刚登录的账户按 last_modified_at 计算到期时间，不会被立即刷新
+    add(json_store, "login@example.com", last_refreshed_at=iso(2 * WINDOW), last_modified_at=iso(60))
+    json_store.upsert("incomplete@example.com", {"client_id": "c"})
+    q = scheduler.DueQueue(WINDOW)
+    assert q.reload_if_changed()
+    return q
+
+
+def test_orders_by_last_touched_and_skips_incomplete(queue):
+    now = datetime.now(timezone.utc).timestamp()
+    assert len(queue) == 3
+    assert queue.pop_due(now, limit=10) == ["old@example.com"]
+    assert queue.pop_due(now, limit=10, grace=WINDOW) == ["recent@example.com", "login@example.com"]
+    assert queue.next_due() is None
+
+
+def test_pop_due_respects_limit(json_store):
+    for i in range(5):
+        add(json_store, f"u{i}@example.com", last_refreshed_at=iso(2 * WINDOW + i))
+    q = scheduler.DueQueue(WINDOW)
+    q.reload_if_changed()
+    now = datetime.now(timezone.utc).timestamp()
+    assert q.pop_due(now, limit=2) == ["u4@example.com", "u3@example.com"]
+    assert len(q) == 3
+
+
+def test_reload_only_when_store_changes(queue, json_store):
+    assert not queue.reload_if_changed()
+    add(json_store, "new@example.com")
+    assert queue.reload_if_changed()
+    assert len(queue) == 4
+
+
+def test_adopt_signature_keeps_incremental_updates(queue, json_store):
+    now = datetime.now(timezone.utc).timestamp()
+    [email] = queue.pop_due(now, limit=10)
+    json_store.update_many({email: {"last_refreshed_at": iso(0)}})
+    queue.reschedule([email], now + WINDOW)
+    queue.adopt_signature()
+    assert not queue.reload_if_changed()
+    assert len(queue) == 3
+
+
+def test_deferred_accounts_survive_reload(queue, json_store):
+    now = datetime.now(timezone.utc).timestamp()
+    [email] = queue.pop_due(now, limit=10)
+    queue.defer([email], 3600)
+    assert queue.pop_due(now, limit=10) == []
+    # 重建后仍按重试时间排队，不会立即再次到期
+    add(json_store, "new@example.com", last_refreshed_at=iso(0))
+    assert queue.reload_if_changed()
+    assert queue.pop_due(now, limit=10) == []
+    assert email in queue.pop_due(now + 3600, limit=10, grace=5)
+
+
+def test_quarantined_account_waits_for_recheck(json_store):
+    add(json_store, "dead@example.com", last_refreshed_at=iso(2 * WINDOW), **account_store.quarantine_fields(1, "Invalid Grant"))
+    q = scheduler.DueQueue(WINDOW)
+    q.reload_if_changed()
+    now = datetime.now(timezone.utc).timestamp()
+    assert q.pop_due(now, limit=10) == []
+    assert q.next_due() == pytest.approx(now + account_store.quarantine_interval(1), abs=5)
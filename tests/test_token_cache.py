@@ -0,0 +1,144 @@
+"""token_cache: AccessTokenCache 的 TTL / LRU / single-flight，以及 TokenIssuer 的按账户串行兑换与错误处理"""
+import threading
+import time
+
+import pytest
+
+import account_store
+import token_cache
+import token_refresher
+
+
+def test_cache_hit_until_ttl_expires():
+    cache = token_cache.AccessTokenCache()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return len(calls), 0.05
+
+    assert cache.get("k", loader) == (1, False)
+    assert cache.get("k", loader) == (1, True)
+    time.sleep(0.06)
+    assert cache.get("k", loader) == (2, False)
+
+
+def test_cache_does_not_store_non_positive_ttl():
+    cache = token_cache.AccessTokenCache()
+    assert cache.get("k", lambda: ("a", 0)) == ("a", False)
+    assert cache.get("k", lambda: ("b", 0)) == ("b", False)
+    assert len(cache) == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = token_cache.AccessTokenCache(max_entries=2)
+    cache.get("a", lambda: ("a", 60))
+    cache.get("b", lambda: ("b", 60))
+    cache.get("a", lambda: ("unused", 60))  # a 变为最近使用
+    cache.get("c", lambda: ("c", 60))
+    assert cache.get("a", lambda: ("reloaded", 60)) == ("a", True)
+    assert cache.get("b", lambda: ("reloaded", 60)) == ("reloaded", False)
+
+
+def test_cache_single_flight_shares_result_and_errors():
+    cache = token_cache.AccessTokenCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    errors = []
+
+    def worker():
+        try:
+            cache.get("k", loader)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker) for _ in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert len(calls) == 1
+    assert errors == ["boom"] * 5
+
+
+class RotatingEndpoint:
+    """模拟会轮换 refresh_token 的 Token 端点，记录同一账户的最大并发兑换数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.redeemed = []
+
+    def __call__(self, email, account, limiter, scope=None):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.05)
+        token = account["refresh_token"]
+        with self.lock:
+            self.active -= 1
+            self.redeemed.append(token)
+        return {"email": email, "ok": True, "refresh_token": token + "+", "client_id": account["client_id"],
+                "access_token": f"at-{scope}", "expires_in": 3600}
+
+
+@pytest.fixture
+def issuer(json_store, monkeypatch):
+    endpoint = RotatingEndpoint()
+    monkeypatch.setattr(token_refresher, "refresh_account", endpoint)
+    json_store.upsert("a@example.com", {"refresh_token": "rt", "client_id": "c"})
+    return token_cache.TokenIssuer(store=json_store), endpoint, json_store
+
+
+def test_different_scopes_redeem_the_refresh_token_one_at_a_time(issuer):
+    issuer, endpoint, store = issuer
+    scopes = ["s1", "s2", "s3"]
+    results = {}
+    threads = [threading.Thread(target=lambda s=s: results.update({s: issuer.issue("A@example.com", s)}))
+               for s in scopes]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert endpoint.max_active == 1
+    # 每次兑换都使用上一次轮换保存后的 Token
+    assert sorted(endpoint.redeemed) == ["rt", "rt+", "rt++"]
+    assert store.get("a@example.com")[1]["refresh_token"] == "rt+++"
+    assert {s: r["access_token"] for s, r in results.items()} == {s: f"at-{s}" for s in scopes}
+    assert not issuer._account_locks
+
+
+def test_quarantined_account_is_rejected_without_redeeming(issuer):
+    issuer, endpoint, store = issuer
+    store.upsert("a@example.com", account_store.quarantine_fields(1, "AADSTS70008: expired"))
+    with pytest.raises(token_cache.TokenIssueError) as e:
+        issuer.issue("a@example.com")
+    assert e.value.status == 409
+    assert endpoint.redeemed == []
+
+
+def test_failed_save_does_not_issue_the_access_token(issuer, monkeypatch):
+    issuer, endpoint, store = issuer
+
+    def fail(updates):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "update_many", fail)
+    with pytest.raises(token_cache.TokenIssueError) as e:
+        issuer.issue("a@example.com")
+    assert e.value.status == 503
+    assert len(issuer.cache) == 0
@@ -0,0 +1,74 @@
+import time
+
+import pytest
+
+import token_refresher
+from token_refresher import ERROR_PERMANENT, ERROR_TRANSIENT
+
+
+def test_aimd_increases_additively_up_to_max():
+    limiter = token_refresher.AdaptiveRateLimiter(2, min_rate=0.5, max_rate=3, increase_step=0.5)
+    limiter.on_success()
+    assert limiter.rate == pytest.approx(2.25)
+    for _ in range(100):
+        limiter.on_success()
+    assert limiter.rate == 3
+
+
+def test_aimd_halves_on_throttle_down_to_min():
+    limiter = token_refresher.AdaptiveRateLimiter(4, min_rate=0.5, max_rate=8)
+    limiter.on_throttle()
+    assert limiter.rate == 2
+    for _ in range(10):
+        limiter.on_throttle()
+    assert limiter.rate == 0.5
+
+
+def test_unlimited_rate_stays_unlimited():
+    limiter = token_refresher.AdaptiveRateLimiter(0, min_rate=0.5, max_rate=8)
+    limiter.on_success()
+    limiter.on_throttle()
+    assert limiter.rate == 0
+
+
+def test_retry_after_pauses_all_acquires():
+    limiter = token_refresher.AdaptiveRateLimiter(0, min_rate=0.5, max_rate=8)
+    limiter.on_throttle(retry_after=0.2)
+    started = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - started >= 0.18
+
+
+def test_token_bucket_spaces_requests():
+    limiter = token_refresher.RateLimiter(20, burst=1)
+    started = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    # 第一个请求用掉初始令牌，其余 3 个各等待约 1/20 秒
+    assert time.monotonic() - started >= 0.13
+
+
+@pytest.mark.parametrize("status, body, expected", [
+    (400, '{"error": "invalid_grant", "error_description": "AADSTS70008: expired"}', (ERROR_PERMANENT, "Token Expired")),
+    (400, '{"error": "invalid_grant", "error_description": "AADSTS700082: inactive"}', (ERROR_PERMANENT, "Token Expired (Inactive)")),
+    (400, '{"error": "invalid_grant"}', (ERROR_PERMANENT, "Invalid Grant")),
+    (429, '{"error": "too_many_requests"}', (ERROR_TRANSIENT, "Throttled (HTTP 429)")),
+    (503, "", (ERROR_TRANSIENT, "Throttled (HTTP 503)")),
+    (502, "", (ERROR_TRANSIENT, "HTTP 502")),
+    (400, '{"error": "temporarily_unavailable"}', (ERROR_TRANSIENT, "HTTP 400")),
+    (401, '{"error": "unauthorized_client"}', (ERROR_PERMANENT, "HTTP 401")),
+])
+def test_classify_error(status, body, expected):
+    assert token_refresher.classify_error(status, body) == expected
+
+
+def test_permanent_code_wins_over_throttle_status():
+    assert token_refresher.classify_error(503, "AADSTS50173 grant revoked")[0] == ERROR_PERMANENT
+
+
+def test_parse_retry_after():
+    assert token_refresher.parse_retry_after("7") == 7.0
+    assert token_refresher.parse_retry_after("-3") == 0.0
+    assert token_refresher.parse_retry_after(None) is None
+    assert token_refresher.parse_retry_after("soon") is None
+    assert token_refresher.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,65 @@
+"""verify_token.batch_check: 只把结果写回 refresh_token 与存储中一致的账户"""
+import io
+import json
+
+import pytest
+
+import token_refresher
+import verify_token
+
+
+@pytest.fixture
+def fake_refresh(monkeypatch):
+    """refresh_token 以 "dead" 开头的返回永久性失败，其余返回轮换后的 Token"""
+    def refresh_account(email, account, limiter, scope=None):
+        token = account.get("refresh_token")
+        if token.startswith("dead"):
+            return {"email": email, "ok": False, "reason": "Token Expired", "error_code": "AADSTS70008",
+                    "error_class": token_refresher.ERROR_PERMANENT, "client_id": account.get("client_id")}
+        return {"email": email, "ok": True, "refresh_token": token + "-rotated", "client_id": account.get("client_id")}
+
+    monkeypatch.setattr(token_refresher, "refresh_account", refresh_account)
+
+
+def run(accounts, tmp_path):
+    return verify_token.batch_check(iter(accounts), 2, output=str(tmp_path / "health.json"))
+
+
+def test_all_writes_back_rotation_and_quarantine(json_store, fake_refresh, tmp_path):
+    json_store.upsert("ok@example.com", {"refresh_token": "good", "client_id": "c"})
+    json_store.upsert("bad@example.com", {"refresh_token": "dead", "client_id": "c"})
+
+    report = run(verify_token.iter_store_accounts(), tmp_path)
+
+    assert (report["healthy"], report["dead"]) == (1, 1)
+    assert json_store.get("ok@example.com")[1]["refresh_token"] == "good-rotated"
+    bad = json_store.get("bad@example.com")[1]
+    assert bad["status"] == "quarantined"
+    assert bad["token_failures"] == 1
+
+
+def test_stdin_tokens_that_differ_from_the_store_are_report_only(json_store, fake_refresh, tmp_path):
+    json_store.upsert("a@example.com", {"refresh_token": "stored", "client_id": "c"})
+    json_store.upsert("b@example.com", {"refresh_token": "stored-b", "client_id": "c"})
+    accounts = [
+        ("a@example.com", {"refresh_token": "outside", "client_id": "c"}),
+        ("b@example.com", {"refresh_token": "dead-outside", "client_id": "c"}),
+        ("ghost@example.com", {"refresh_token": "x", "client_id": "c"}),
+    ]
+
+    report = run(accounts, tmp_path)
+
+    assert report["total"] == 3
+    assert json_store.get("a@example.com")[1] == {"refresh_token": "stored", "client_id": "c"}
+    assert json_store.get("b@example.com")[1] == {"refresh_token": "stored-b", "client_id": "c"}
+    assert json_store.get("ghost@example.com") == (None, None)
+
+
+def test_stdin_skips_lines_that_are_not_json_objects(monkeypatch, capsys):
+    lines = ['{"email": "a@example.com", "refresh_token": "r"}', "[1, 2]", '"text"', "{broken", ""]
+    monkeypatch.setattr("sys.stdin", io.StringIO("\n".join(lines)))
+
+    accounts = list(verify_token.iter_stdin_accounts())
+
+    assert [email for email, _ in accounts] == ["a@example.com"]
+    assert capsys.readouterr().err.count("跳过无效行") == 3
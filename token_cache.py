@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import account_store
+import token_refresher
+
+logger = logging.getLogger(__name__)
+
+# Access Token 缓存配置
+# TOKEN_CACHE_SIZE: 最多缓存的 (账户, scope) 数量，超出后淘汰最久未使用的条目
+# TOKEN_CACHE_SKEW_SECONDS: 在 expires_in 到期前提前多少秒视为过期，保证下发的 Token 仍有足够的剩余有效期
+TOKEN_CACHE_SIZE = max(1, int(os.environ.get("TOKEN_CACHE_SIZE", "10000")))
+TOKEN_CACHE_SKEW_SECONDS = int(os.environ.get("TOKEN_CACHE_SKEW_SECONDS", "300"))
+
+
+class TokenIssueError(Exception):
+    """无法为账户签发 Access Token，status 为建议返回的 HTTP 状态码"""
+
+    def __init__(self, message, status=502):
+        super().__init__(message)
+        self.status = status
+
+
+class AccessTokenCache:
+    """
+    带 TTL 的 LRU 缓存，并对同一个 key 的并发加载做 single-flight 合并:
+    缓存未命中时只有第一个请求执行 loader，其余请求等待同一个结果。
+    loader() 返回 (value, ttl_seconds)，ttl <= 0 的结果不缓存；loader 抛出的异常会传递给所有等待者。
+    """
+
+    def __init__(self, max_entries=TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Future
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """返回 (value, cached)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[1], True
+                del self._entries[key]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = Future()
+
+        if not leader:
+            return flight.result(), True
+
+        try:
+            value, ttl = loader()
+        except BaseException as e:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.set_exception(e)
+            raise
+
+        with self._lock:
+            self._inflight.pop(key, None)
+            if ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        flight.set_result(value)
+        return value, False
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenIssuer:
+    """
+    为账户签发 Access Token: 优先返回缓存，未命中时用账户的 refresh_token 换取新 Token，
+    并把轮换后的 refresh_token 写回账户存储。
+
+    Access Token 按 (账户, scope) 缓存，但兑换 refresh_token 按账户串行: refresh_token 每次兑换都会轮换，
+    同一账户不同 scope 的并发请求若同时兑换，后保存的结果会覆盖先保存的，必须等上一次轮换保存后再用新 Token 兑换。
+    """
+
+    def __init__(self, store=None, cache=None, skew_seconds=TOKEN_CACHE_SKEW_SECONDS):
+        self.store = store or account_store.get_store()
+        self.cache = cache or AccessTokenCache()
+        self.skew_seconds = skew_seconds
+        self.limiter = token_refresher.shared_limiter()
+        self._account_locks = {}  # LOWER(email) -> [Lock, 使用者数]，无人使用时删除
+        self._account_locks_lock = threading.Lock()
+
+    @contextmanager
+    def _account_lock(self, email):
+        """同一账户的 refresh_token 兑换与保存串行执行"""
+        name = email.lower()
+        with self._account_locks_lock:
+            entry = self._account_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._account_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._account_locks[name]
+
+    def issue(self, email, scope=None):
+        """
+        返回 {"email", "access_token", "expires_in", "expires_at", "cached"}，
+        expires_in 为剩余有效秒数。失败时抛出 TokenIssueError。
+        """
+        key = (email.lower(), scope or "")
+        value, cached = self.cache.get(key, lambda: self._load(email, scope))
+        remaining = max(0, int(value["expires_at"] - time.time()))
+        return {
+            "email": value["email"],
+            "access_token": value["access_token"],
+            "expires_in": remaining,
+            "expires_at": datetime.fromtimestamp(value["expires_at"], timezone.utc).isoformat(),
+            "cached": cached,
+        }
+
+    def _load(self, email, scope):
+        with self._account_lock(email):
+            # 在锁内读取账户，拿到的是上一次轮换保存后的 refresh_token
+            account_key, account = self.store.get(email)
+            if account_key is None:
+                raise TokenIssueError(f"账户不存在: {email}", status=404)
+            if account.get("status") == account_store.STATUS_QUARANTINED:
+                raise TokenIssueError(f"账户的 refresh_token 已失效 (已隔离，需要重新登录): {account_key}", status=409)
+            if not account.get("refresh_token") or not account.get("client_id"):
+                raise TokenIssueError(f"账户缺少 refresh_token 或 client_id: {account_key}", status=409)
+
+            result = token_refresher.refresh_account(account_key, account, self.limiter, scope=scope)
+            if not result["ok"] or not result.get("access_token"):
+                raise TokenIssueError(f"刷新失败: {result.get('reason', 'no access_token returned')}")
+
+            self._persist(account_key, result["refresh_token"])
+
+        expires_in = int(result.get("expires_in") or 0)
+        value = {
+            "email": account_key,
+            "access_token": result["access_token"],
+            "expires_at": time.time() + expires_in,
+        }
+        logger.info(f"🔑 已为 {account_key} 签发 Access Token (有效期 {expires_in}s)")
+        return value, expires_in - self.skew_seconds
+
+    def _persist(self, account_key, refresh_token):
+        """
+        保存轮换后的 refresh_token。保存失败时抛出 TokenIssueError 而不签发 Access Token:
+        否则下一次刷新会使用已被替换的旧 Token，调用方也无从得知账户已处于不一致状态。
+        """
+        fields = {
+            "refresh_token": refresh_token,
+            "last_refreshed_at": datetime.now(timezone.utc).isoformat(),
+        }
+        try:
+            # 只更新已存在的账户: 刷新期间账户被删除时不能因为写回 Token 而重新创建
+            updated = self.store.update_many({account_key: fields})
+        except Exception as e:
+            logger.error(f"❌ 保存 {account_key} 的新 refresh_token 失败: {e}")
+            raise TokenIssueError(f"新的 refresh_token 保存失败: {e}", status=503) from e
+        if not updated:
+            logger.warning(f"⚠️ {account_key} 已不在账户存储中，不保存新的 refresh_token")
+            raise TokenIssueError(f"账户不存在: {account_key}", status=404)
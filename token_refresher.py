@@ -1,11 +1,20 @@
-import requests
 import os
+import re
+import argparse
 import sys
 import json
 import time
-from datetime import datetime
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 import logging
 from dotenv import load_dotenv
+import account_store
+import http_client
+import metrics
+import tracing
 
 # 加载环境变量
 load_dotenv()
@@ -14,115 +23,431 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-ACCOUNTS_FILE = "accounts.json"
 REPORT_FILE = os.path.join("logs", "refresh_report.json")
+# 可指向其它 Token 端点 (如 benchmark.py 的本地 mock 端点)
+TOKEN_URL = os.environ.get("TOKEN_URL", "https://login.microsoftonline.com/common/oauth2/v2.0/token")
+
+# 并发刷新配置
+# REFRESH_CONCURRENCY: 同时进行的刷新请求数 (线程池大小)
+# REFRESH_RPS: 全局每秒请求预算的起始值，替代原来固定的 time.sleep(1)
+# REFRESH_MIN_RPS / REFRESH_MAX_RPS: 自适应限速的上下限
+REFRESH_CONCURRENCY = max(1, int(os.environ.get("REFRESH_CONCURRENCY", "8")))
+REFRESH_RPS = float(os.environ.get("REFRESH_RPS", "5"))
+REFRESH_MIN_RPS = float(os.environ.get("REFRESH_MIN_RPS", "0.5"))
+REFRESH_MAX_RPS = float(os.environ.get("REFRESH_MAX_RPS", str(max(REFRESH_RPS, 1) * 4)))
+
+# 重试配置 (仅针对临时性错误: 429/5xx/网络异常)
+REFRESH_MAX_RETRIES = int(os.environ.get("REFRESH_MAX_RETRIES", "3"))
+REFRESH_BACKOFF_BASE = float(os.environ.get("REFRESH_BACKOFF_BASE", "1"))
+REFRESH_BACKOFF_MAX = float(os.environ.get("REFRESH_BACKOFF_MAX", "60"))
+
+# 错误分类
+ERROR_PERMANENT = "permanent"
+ERROR_TRANSIENT = "transient"
+
+# 出现在响应体中即视为永久错误的 AADSTS 代码 (重试无意义)
+PERMANENT_ERROR_CODES = {
+    "AADSTS70000": "Token Invalid/Expired",
+    "AADSTS70002": "Client Secret Required",
+    "AADSTS70008": "Token Expired",
+    "AADSTS700082": "Token Expired (Inactive)",
+    "AADSTS50173": "Grant Revoked",
+    "AADSTS65001": "Consent Required",
+    "AADSTS700016": "Application Not Found",
+}
+THROTTLE_STATUS = {429, 503}
+AADSTS_PATTERN = re.compile(r"AADSTS\d+")
+
+
+class RefreshError(Exception):
+    """刷新任务无法执行 (如账户存储不存在或无法读取)"""
+
 
 def ensure_logs_dir():
     if not os.path.exists("logs"):
         os.makedirs("logs")
 
-def refresh_all_tokens():
+class RateLimiter:
     """
-    读取 accounts.json，遍历所有账户，刷新并更新 refresh_token。
+    简单的令牌桶限速器，多个线程共享同一个每秒请求预算。
+    rate <= 0 表示不限速。
     """
-    ensure_logs_dir()
-    
-    if not os.path.exists(ACCOUNTS_FILE):
-        logger.error(f"❌ 错误: 未找到 {ACCOUNTS_FILE}")
-        sys.exit(1)
 
-    logger.info(f"📂 读取账户文件: {ACCOUNTS_FILE}...")
-    
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                    self._last = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """暂停所有线程的请求发放 (用于 Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0
+            self._last = max(self._last, self._blocked_until)
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    AIMD 自适应限速:
+    - 连续健康响应时线性提高速率 (每次成功 + increase_step / rate)
+    - 出现 429/503 等限流信号时速率减半，并按 Retry-After 全局暂停
+    速率始终限制在 [min_rate, max_rate] 之间。
+    """
+
+    def __init__(self, rate, min_rate, max_rate, burst=1, increase_step=0.5):
+        super().__init__(rate, burst)
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.increase_step = increase_step
+
+    def on_success(self):
+        with self._lock:
+            if self.rate > 0:
+                # 每完成约 rate 个成功请求 (≈1 秒) 提高 increase_step
+                self.rate = min(self.max_rate, self.rate + self.increase_step / self.rate)
+                metrics.REFRESH_RATE.set(self.rate)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            if self.rate > 0:
+                self.rate = max(self.min_rate, self.rate / 2)
+            current = self.rate
+        metrics.REFRESH_THROTTLED.inc()
+        metrics.REFRESH_RATE.set(current)
+        if retry_after:
+            self.pause(retry_after)
+        logger.warning(f"   🐢 触发限流，速率降至 {current:.2f}/s" + (f"，暂停 {retry_after:.1f}s" if retry_after else ""))
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def shared_limiter():
+    """进程内共享的自适应限速器: 同一进程中的 Token 签发接口与批量导入共用一份请求预算和限流状态"""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter(REFRESH_RPS, REFRESH_MIN_RPS, REFRESH_MAX_RPS, burst=REFRESH_CONCURRENCY)
+        return _shared_limiter
+
+
+def parse_retry_after(value):
+    """解析 Retry-After 头 (秒数或 HTTP 日期)，返回秒数或 None"""
+    if not value:
+        return None
     try:
-        with open(ACCOUNTS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-    except Exception as e:
-        logger.error(f"❌ 读取文件失败: {e}")
-        # 这种严重错误不用跑了，直接写失败报告
-        save_report(0, 0, [f"Fatal: {str(e)}"])
-        sys.exit(1)
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
 
-    has_updates = False
-    total_accounts = len(data)
-    success_count = 0
-    failed_details = [] 
-    
-    logger.info(f"🔍 发现 {total_accounts} 个账户，开始轮询刷新...\n")
-
-    for email, account in data.items():
-        logger.info(f"👉 正在处理: {email}")
-        
-        old_refresh_token = account.get("refresh_token")
-        client_id = account.get("client_id")
-
-        if not old_refresh_token:
-            logger.warning(f"   ⚠️ 跳过: 缺少 refresh_token")
-            continue
-        
-        if not client_id:
-            logger.warning(f"   ⚠️ 跳过: 缺少 client_id")
-            continue
-
-        url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
-        payload = {
-            "client_id": client_id,
-            "grant_type": "refresh_token",
-            "refresh_token": old_refresh_token,
-        }
 
+def classify_error(status_code, error_msg):
+    """
+    根据 HTTP 状态码和响应体判断错误类型，返回 (error_class, simple_error)。
+    永久错误 (Token 失效、需要 Secret 等) 不会重试。
+    """
+    # 按完整代码匹配: AADSTS700082 不能被当作 AADSTS70008
+    codes = set(AADSTS_PATTERN.findall(error_msg))
+    for code, label in PERMANENT_ERROR_CODES.items():
+        if code in codes:
+            return ERROR_PERMANENT, label
+    if status_code in THROTTLE_STATUS:
+        return ERROR_TRANSIENT, f"Throttled (HTTP {status_code})"
+    if status_code >= 500 or "temporarily_unavailable" in error_msg:
+        return ERROR_TRANSIENT, f"HTTP {status_code}"
+    if "invalid_grant" in error_msg:
+        return ERROR_PERMANENT, "Invalid Grant"
+    return ERROR_PERMANENT, f"HTTP {status_code}"
+
+
+def request_outcome(status_code):
+    """单次请求的指标标签: success / throttled / client_error / server_error"""
+    if status_code == 200:
+        return "success"
+    if status_code in THROTTLE_STATUS:
+        return "throttled"
+    return "server_error" if status_code >= 500 else "client_error"
+
+
+def backoff_delay(attempt):
+    """带 full jitter 的指数退避"""
+    return random.uniform(0, min(REFRESH_BACKOFF_MAX, REFRESH_BACKOFF_BASE * (2 ** attempt)))
+
+
+def refresh_account(email, account, limiter, scope=None):
+    """
+    刷新单个账户，返回结果字典 (在线程池中执行，不修改 account 本身):
+    {"email", "ok", "refresh_token", "client_id", "access_token", "expires_in", "reason", "error_class", "error_code"}
+    account 可以是普通字典或 AccountRecord；scope 为空时沿用授权时的权限范围。
+    临时性错误按指数退避重试，永久性错误立即返回。
+    """
+    with tracing.span("refresh_account", "refresh", email=email) as span:
+        result = _refresh_account(email, account, limiter, scope)
+        span.set(ok=result["ok"], error_code=result.get("error_code"))
+        return result
+
+
+def _refresh_account(email, account, limiter, scope):
+    old_refresh_token = account.get("refresh_token")
+    client_id = account.get("client_id")
+
+    payload = {
+        "client_id": client_id,
+        "grant_type": "refresh_token",
+        "refresh_token": old_refresh_token,
+    }
+    if scope:
+        payload["scope"] = scope
+
+    attempt = 0
+    while True:
+        with tracing.span("rate_limit.wait", "refresh"):
+            limiter.acquire()
+        retry_after = None
+        response = None
+        started = time.perf_counter()
         try:
-            response = requests.post(url, data=payload)
-            
+            with tracing.span("token_request", "http", attempt=attempt) as span:
+                response = http_client.post(TOKEN_URL, data=payload)
+                span.set(status=response.status_code)
+            metrics.REFRESH_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome=request_outcome(response.status_code))
+
             if response.status_code == 200:
+                limiter.on_success()
                 json_resp = response.json()
                 new_refresh_token = json_resp.get("refresh_token")
 
                 if new_refresh_token:
-                    account["refresh_token"] = new_refresh_token
-                    account["last_refreshed_at"] = datetime.now().isoformat()
-                    has_updates = True
-                    success_count += 1
-                    logger.info(f"   ✅ 刷新成功！")
-                else:
-                    msg = "刷新成功 but no refresh_token return"
-                    logger.warning(f"   ⚠️ {msg}")
-                    failed_details.append({"email": email, "reason": msg})
-            else:
-                simple_error = f"HTTP {response.status_code}"
-                error_msg = response.text
-                if "AADSTS70002" in error_msg:
-                    simple_error = "Client Secret Required"
-                elif "AADSTS70000" in error_msg:
-                    simple_error = "Token Invalid/Expired"
-                
-                logger.error(f"   ❌ 失败: {simple_error}")
-                failed_details.append({"email": email, "reason": f"{simple_error} - {error_msg[:50]}..."})
+                    logger.info(f"   ✅ {email} 刷新成功！")
+                    metrics.REFRESH_RESULTS.inc(result="success", error_class="")
+                    return {"email": email, "ok": True, "refresh_token": new_refresh_token, "client_id": client_id,
+                            "access_token": json_resp.get("access_token"), "expires_in": json_resp.get("expires_in")}
+
+                msg = "刷新成功 but no refresh_token return"
+                logger.warning(f"   ⚠️ {email}: {msg}")
+                metrics.REFRESH_RESULTS.inc(result="failure", error_class=ERROR_PERMANENT)
+                return {"email": email, "ok": False, "reason": msg, "error_class": ERROR_PERMANENT}
+
+            error_msg = response.text
+            error_class, simple_error = classify_error(response.status_code, error_msg)
+            reason = f"{simple_error} - {error_msg[:50]}..."
+            match = AADSTS_PATTERN.search(error_msg)
+            error_code = match.group(0) if match else None
+
+            if response.status_code in THROTTLE_STATUS:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                limiter.on_throttle(retry_after)
 
         except Exception as e:
-            logger.error(f"   ❌ 请求异常: {e}")
-            failed_details.append({"email": email, "reason": str(e)})
-        
-        time.sleep(1)
+            if response is None:
+                metrics.REFRESH_REQUEST_SECONDS.observe(time.perf_counter() - started, outcome="exception")
+            error_class, simple_error = ERROR_TRANSIENT, "Request Error"
+            reason = str(e)
+            error_code = None
 
-    if has_updates:
-        logger.info("\n💾 正在保存更新到 accounts.json ...")
+        if error_class == ERROR_PERMANENT or attempt >= REFRESH_MAX_RETRIES:
+            logger.error(f"   ❌ {email} 失败: {simple_error}" + (f" (已重试 {attempt} 次)" if attempt else ""))
+            metrics.REFRESH_RESULTS.inc(result="failure", error_class=error_class)
+            return {"email": email, "ok": False, "reason": reason, "error_class": error_class, "error_code": error_code}
+
+        delay = max(retry_after or 0, backoff_delay(attempt))
+        attempt += 1
+        metrics.REFRESH_RETRIES.inc()
+        logger.warning(f"   🔁 {email} {simple_error}，{delay:.1f}s 后第 {attempt} 次重试")
+        with tracing.span("retry.backoff", "refresh", seconds=round(delay, 3)):
+            time.sleep(delay)
+
+
+def refresh_all_tokens(only=None, on_success=None):
+    """
+    流式读取账户存储，并发刷新所有账户并更新 refresh_token。
+    并发数由 REFRESH_CONCURRENCY 控制，全局请求速率从 REFRESH_RPS 起步并自适应调整。
+
+    永久性失败的账户会被隔离 (status=quarantined)，按指数间隔重新检查，未到重新检查时间的账户直接跳过；
+    隔离账户再次刷新成功时恢复为 active。
+
+    Args:
+        only (iterable[str] | None): 仅刷新这些邮箱 (忽略大小写)，None 表示全部。
+            scheduler 的到期队列用它来按小批次刷新 (队列已按隔离的重新检查时间排序，因此不再跳过隔离账户)。
+        on_success (callable | None): 每个账户刷新成功后立即以 (email, refresh_token, client_id) 调用，
+            流水线模式用它把新 Token 实时送入数据库写入队列。
+
+    Returns:
+        dict: 与 logs/refresh_report.json 内容相同的执行报告
+
+    Raises:
+        RefreshError: 账户存储不存在或无法读取
+    """
+    ensure_logs_dir()
+    
+    store = account_store.get_store()
+    if not store.exists():
+        logger.error(f"❌ 错误: 未找到 {store.location}")
+        raise RefreshError(f"未找到 {store.location}")
+
+    logger.info(f"📂 流式读取账户存储: {store.location}...")
+
+    wanted = {e.lower() for e in only} if only is not None else None
+    # email -> 写操作 ({"op": "update", "email", "fields", "remove"})，每批一次 apply_batch
+    updates = {}
+    # 在途任务 -> 账户之前的连续失败次数 (只保存在途账户，内存占用有上限)
+    prior_failures = {}
+    total_accounts = 0
+    success_count = 0
+    quarantined_skipped = 0
+    newly_quarantined = 0
+    failed_details = [] 
+    fatal_error = None
+    now = time.time()
+    
+    logger.info(f"🔍 开始并发刷新 (并发 {REFRESH_CONCURRENCY}, 初始限速 {REFRESH_RPS}/s)...\n")
+
+    limiter = AdaptiveRateLimiter(REFRESH_RPS, REFRESH_MIN_RPS, REFRESH_MAX_RPS, burst=REFRESH_CONCURRENCY)
+    started = time.time()
+
+    def flush_updates():
+        if not updates:
+            return
+        logger.info(f"💾 正在保存 {len(updates)} 个更新到 {store.location} ...")
         try:
-            with open(ACCOUNTS_FILE, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            # 只写回刷新结果相关的字段，存储层会重新读取最新数据再合并，不会覆盖期间新登录的账户
+            with tracing.span("account_store.apply_batch", "store", accounts=len(updates)):
+                store.apply_batch(list(updates.values()))
             logger.info("To 成功！")
         except Exception as e:
             logger.error(f"❌ 保存文件失败: {e}")
             failed_details.append({"email": "SYSTEM", "reason": f"Save Error: {str(e)}"})
+        updates.clear()
+
+    def handle(done):
+        # 结果只在主线程中处理，避免多线程同时修改 updates
+        nonlocal success_count, newly_quarantined
+        for future in done:
+            result = future.result()
+            email = result["email"]
+            failures = prior_failures.pop(future, 0)
+            if result["ok"]:
+                updates[email] = {"op": "update", "email": email, "fields": {
+                    "refresh_token": result["refresh_token"],
+                    "last_refreshed_at": datetime.now(timezone.utc).isoformat(),
+                }}
+                if failures:
+                    # 隔离账户重新检查成功 (如 Token 在其它地方被更新)，解除隔离
+                    updates[email]["fields"]["status"] = account_store.STATUS_ACTIVE
+                    updates[email]["remove"] = list(account_store.STALE_STATUS_FIELDS)
+                    logger.info(f"   🔓 {email} 已解除隔离")
+                success_count += 1
+                if on_success:
+                    try:
+                        on_success(email, result["refresh_token"], result["client_id"])
+                    except Exception as e:
+                        logger.error(f"   ❌ {email} 推送到同步队列失败: {e}")
+            else:
+                failed_details.append({"email": email, "reason": result["reason"], "error_class": result["error_class"]})
+                if result["error_class"] == ERROR_PERMANENT:
+                    reason = f"{result.get('error_code') or 'permanent'}: {result['reason']}"[:200]
+                    updates[email] = {"op": "update", "email": email,
+                                      "fields": account_store.quarantine_fields(failures + 1, reason)}
+                    newly_quarantined += 1
+                    interval = account_store.quarantine_interval(failures + 1)
+                    # 供 scheduler 的到期队列直接排到重新检查时间
+                    failed_details[-1]["retry_at"] = time.time() + interval
+                    logger.warning(f"   🚫 {email} 已隔离 (第 {failures + 1} 次永久性失败)，{interval / 3600:.0f} 小时后重新检查")
+
+        if store.write_batch_size and len(updates) >= store.write_batch_size:
+            flush_updates()
+
+    # 逐个读取账户并限制在途任务数，内存占用与账户总数无关
+    max_in_flight = REFRESH_CONCURRENCY * 4
+    with ThreadPoolExecutor(max_workers=REFRESH_CONCURRENCY) as executor:
+        in_flight = set()
+        try:
+            # 小批次按邮箱直接取出账户，不必流式读取整个存储
+            records = store.iter_records() if wanted is None else store.iter_records_for(wanted)
+            for record in records:
+                email = record.email
+                if wanted is not None and email.lower() not in wanted:
+                    continue
+                failures = 0
+                if record.get("status") == account_store.STATUS_QUARANTINED:
+                    if wanted is None and account_store.quarantine_recheck_at(record) > now:
+                        quarantined_skipped += 1
+                        continue
+                    failures = int(record.get("token_failures") or 1)
+                total_accounts += 1
+                if not record.refresh_token:
+                    logger.warning(f"   ⚠️ 跳过 {email}: 缺少 refresh_token")
+                    continue
+                if not record.client_id:
+                    logger.warning(f"   ⚠️ 跳过 {email}: 缺少 client_id")
+                    continue
+                future = executor.submit(refresh_account, email, record, limiter)
+                prior_failures[future] = failures
+                in_flight.add(future)
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    handle(done)
+        except Exception as e:
+            # 读取中途失败: 不再提交新账户，但已经轮换的 Token 必须保存下来
+            fatal_error = e
+            logger.error(f"❌ 读取文件失败: {e}")
+            failed_details.append({"email": "SYSTEM", "reason": f"Fatal: {str(e)}"})
+
+        done, _ = wait(in_flight)
+        handle(done)
+
+    duration = time.time() - started
+    logger.info(f"⏱️ 本轮刷新 {total_accounts} 个账户，耗时 {duration:.2f}s，最终速率 {limiter.rate:.2f}/s")
+    if quarantined_skipped or newly_quarantined:
+        logger.info(f"🚫 跳过 {quarantined_skipped} 个隔离中的账户，新隔离 {newly_quarantined} 个")
+    record_sweep(total_accounts, duration)
+
+    flush_updates()
 
     # 保存执行报告供 scheduler 读取
-    save_report(total_accounts, success_count, failed_details)
+    report = save_report(total_accounts, success_count, failed_details, quarantined_skipped)
+    if fatal_error is not None:
+        raise RefreshError(str(fatal_error)) from fatal_error
+    return report
+
+def record_sweep(total, duration):
+    """记录一轮刷新的耗时与吞吐量 (refresh_worker 的每个租约批次同样记录)"""
+    metrics.SWEEP_SECONDS.observe(duration)
+    metrics.SWEEP_ACCOUNTS.set(total)
+    metrics.SWEEP_THROUGHPUT.set(total / duration if duration > 0 else 0)
 
-def save_report(total, success, failed_list):
+def save_report(total, success, failed_list, quarantined=0):
     report = {
         "timestamp": datetime.now().isoformat(),
         "total": total,
         "success": success,
-        "failed": failed_list
+        "failed": failed_list,
+        "quarantined": quarantined,
     }
     try:
         with open(REPORT_FILE, "w", encoding="utf-8") as f:
@@ -130,6 +455,13 @@ def save_report(total, success, failed_list):
         logger.info(f"📝 报告已写入: {REPORT_FILE}")
     except Exception as e:
         logger.error(f"❌ 写入报告失败: {e}")
+    return report
 
 if __name__ == "__main__":
-    refresh_all_tokens()
+    parser = argparse.ArgumentParser(description="批量刷新 accounts.json 中的 refresh_token")
+    parser.add_argument("--only", nargs="+", metavar="EMAIL", help="仅刷新指定邮箱 (忽略大小写)")
+    args = parser.parse_args()
+    try:
+        refresh_all_tokens(only=args.only)
+    except RefreshError:
+        sys.exit(1)
@@ -0,0 +1,214 @@
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+# 分阶段耗时追踪 (Chrome trace event 格式)
+# 用 chrome://tracing 或 https://ui.perfetto.dev 打开生成的文件即可查看嵌套的 span:
+# 调度周期 -> 各阶段 -> 每个账户的刷新 -> 每次 Token 请求 (含新建连接的 DNS/TCP/TLS) / 每批数据库语句 / 账户文件重写
+# TRACE_ENABLED: 默认关闭，关闭时 span() 返回共享的空对象，几乎没有开销
+# TRACE_DIR: 输出目录，每个进程写自己的文件 (<进程名>-<pid>.trace.json)，避免多个进程交错写入
+# TRACE_MAX_MB / TRACE_BACKUPS: 单个文件超过该大小后轮换 (.1 .2 ...)，最多保留 TRACE_BACKUPS 个旧文件
+# TRACE_FLUSH_SECONDS: 缓冲的事件最长多久写入一次文件
+TRACE_ENABLED = os.environ.get("TRACE_ENABLED", "False").lower() == "true"
+TRACE_DIR = os.environ.get("TRACE_DIR", os.path.join("logs", "traces"))
+TRACE_MAX_MB = float(os.environ.get("TRACE_MAX_MB", "20"))
+TRACE_BACKUPS = max(0, int(os.environ.get("TRACE_BACKUPS", "5")))
+TRACE_FLUSH_SECONDS = float(os.environ.get("TRACE_FLUSH_SECONDS", "1"))
+TRACE_BUFFER_EVENTS = 512
+
+
+class _NoopSpan:
+    """追踪关闭时使用的空 span"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+class TraceWriter:
+    """
+    以 JSON 数组格式追加写出 trace 事件。
+    文件以 "[" 开头、每个事件后跟 ",\n"，不写结尾的 "]" (Chrome / Perfetto 都能读取未闭合的数组)，
+    因此进程被强制结束时已写出的事件仍然可用。
+    """
+
+    def __init__(self, directory=TRACE_DIR, max_bytes=int(TRACE_MAX_MB * 1024 * 1024), backups=TRACE_BACKUPS):
+        name = os.path.splitext(os.path.basename(sys.argv[0] if sys.argv else ""))[0].strip("-") or "python"
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f"{name}-{self.pid}.trace.json")
+        self.process_name = name
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._file = None
+        self._size = 0
+        self._thread_names = {}
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+        # 每个文件都带上进程名与已知线程名，轮换后的文件也能单独查看
+        header = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": self.process_name}}]
+        header += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                   for tid, name in self._thread_names.items()]
+        self._write("[\n" + "".join(json.dumps(e, ensure_ascii=False) + ",\n" for e in header))
+
+    def _write(self, text):
+        self._file.write(text)
+        self._size += len(text.encode("utf-8"))
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def add(self, event, tid):
+        with self._lock:
+            if tid not in self._thread_names:
+                self._thread_names[tid] = threading.current_thread().name
+                # 文件尚未创建时，线程名会随文件头一起写出
+                if self._file is not None:
+                    self._buffer.append({"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid,
+                                         "args": {"name": self._thread_names[tid]}})
+            self._buffer.append(event)
+            if len(self._buffer) < TRACE_BUFFER_EVENTS and time.monotonic() - self._last_flush < TRACE_FLUSH_SECONDS:
+                return
+            self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        events, self._buffer = self._buffer, []
+        try:
+            if self._file is None:
+                self._open()
+            self._write("".join(json.dumps(e, ensure_ascii=False, default=str) + ",\n" for e in events))
+            self._file.flush()
+            if self._size >= self.max_bytes:
+                self._rotate()
+        except OSError as e:
+            # 追踪只是诊断手段，写入失败不能影响业务
+            sys.stderr.write(f"⚠️ 写入 trace 文件失败: {e}\n")
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+
+class Span:
+    """一个完整事件 (ph="X")，在 with 块结束时记录开始时间与耗时"""
+
+    __slots__ = ("name", "cat", "args", "_start")
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def set(self, **args):
+        """补充只有在执行过程中才知道的参数 (如状态码、行数)"""
+        self.args.update(args)
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        tid = threading.get_ident()
+        event = {
+            "name": self.name, "cat": self.cat, "ph": "X",
+            "ts": round((self._start - _epoch) * 1e6, 1), "dur": round((end - self._start) * 1e6, 1),
+            "pid": _writer.pid, "tid": tid,
+        }
+        if self.args:
+            event["args"] = self.args
+        _writer.add(event, tid)
+        return False
+
+
+_writer = None
+# perf_counter 与墙上时间的差值，使不同进程的 trace 文件可以按时间对齐
+_epoch = time.perf_counter() - time.time()
+
+
+def span(name, cat="app", **args):
+    """
+    返回记录代码块耗时的上下文管理器:
+        with tracing.span("sync_db.merge", "db", rows=n):
+            ...
+    追踪关闭时返回共享的空对象。
+    """
+    if _writer is None:
+        return _NOOP
+    return Span(name, cat, args)
+
+
+def flush():
+    if _writer is not None:
+        _writer.flush()
+
+
+def _instrument_connections():
+    """记录 urllib3 新建连接的耗时 (DNS 解析 + TCP 握手 + TLS 握手)，复用的 keep-alive 连接不会出现该 span"""
+    try:
+        import urllib3.connection
+    except ImportError:
+        return
+    for cls in (urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection):
+        original = cls.connect
+        if getattr(original, "_traced", False):
+            continue
+
+        def connect(self, _original=original):
+            with span("http.connect", "http", host=self.host, port=self.port):
+                return _original(self)
+
+        connect._traced = True
+        cls.connect = connect
+
+
+def enable(directory=TRACE_DIR):
+    """开启追踪 (TRACE_ENABLED=True 时在导入时自动调用)"""
+    global _writer
+    if _writer is None:
+        _writer = TraceWriter(directory)
+        _instrument_connections()
+        atexit.register(flush)
+    return _writer
+
+
+if TRACE_ENABLED:
+    enable()
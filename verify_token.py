@@ -1,64 +1,262 @@
-import requests
 import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
 from dotenv import load_dotenv
+import http_client
 
 # 加载环境配置
 load_dotenv()
 
 CLIENT_ID = os.environ.get("CLIENT_ID")
-if not CLIENT_ID:
-    print("❌ 错误: 未在 .env 中找到 CLIENT_ID")
-    exit(1)
-
-print("--- Microsoft Graph Refresh Token 验证工具 ---")
-print(f"正在使用 Client ID: {CLIENT_ID}")
-print("此工具将尝试使用 Refresh Token 获取新的 Access Token。")
-print("如果成功，说明 Token 有效且适合 Public Client 模式。")
-print("------------------------------------------------")
-
-# 获取用户输入
-refresh_token = input("请粘贴你的 Refresh Token (按回车确认): ").strip()
-
-if not refresh_token:
-    print("❌ 未输入 Token，程序退出。")
-    exit(1)
-
-# 构造请求
-url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
-data = {
-    "client_id": CLIENT_ID,
-    "grant_type": "refresh_token",
-    "refresh_token": refresh_token,
-    # 注意：Public Client 刷新时通常不需要 scope，或者使用默认 scope
-    # 但为了保险，我们可以不传，或者传原本的
+HEALTH_REPORT_FILE = os.path.join("logs", "health_report.json")
+
+# 常见错误代码的分析提示 (交互模式与批量健康报告共用)
+ERROR_HINTS = {
+    "AADSTS70002": "只要没带 Secret 就报错？这通常意味着 Azure 里注册的还是 Web 应用，而不是 Mobile/Desktop。",
+    "AADSTS70000": "请求参数错误，可能是 Token 格式不对或者已过期。",
+    "AADSTS70008": "Token 已过期，需要重新登录。",
+    "AADSTS700082": "Token 因长期未使用已过期，需要重新登录。",
+    "AADSTS50173": "授权已被撤销 (如用户修改了密码)，需要重新登录。",
+    "AADSTS65001": "用户或管理员未同意所需权限。",
+    "AADSTS700016": "Client ID 对应的应用不存在，请检查账户的 client_id。",
 }
 
-print("\n🚀 正在向微软发送请求...")
-
-try:
-    response = requests.post(url, data=data)
-    
-    print(f"HTTP 状态码: {response.status_code}")
-    
-    if response.status_code == 200:
-        json_resp = response.json()
-        print("\n✅ 验证成功！Token 有效！")
-        print(f"Access Token (前30字符): {json_resp.get('access_token', '')[:30]}...")
-        print(f"新的 Refresh Token (前30字符): {json_resp.get('refresh_token', '')[:30]}...")
-        print("\n结论: 你的 Token 没有任何问题。")
-        print("如果 outlook_manager 仍然报错，请检查代码是否错误地添加了 client_secret 参数，")
-        print("或者 outlook_manager 是否使用了不同的 Client ID。")
-    else:
-        print("\n❌ 验证失败！")
-        print("微软返回的完整错误信息：")
-        print(response.text)
-        print("\n分析提示：")
-        if "AADSTS70002" in response.text:
-            print("- AADSTS70002: 只要没带 Secret 就报错？这通常意味着 Azure 里注册的还是 Web 应用，而不是 Mobile/Desktop。")
-        elif "AADSTS70000" in response.text:
-            print("- AADSTS70000: 请求参数错误，可能是 Token 格式不对或者已过期。")
-
-except Exception as e:
-    print(f"\n❌ 发生异常: {e}")
-
-input("\n按回车键退出...")
+# 健康状态
+STATUS_HEALTHY = "healthy"
+STATUS_DEAD = "dead"
+STATUS_TRANSIENT = "transient"
+
+
+def interactive():
+    """交互模式: 粘贴单个 Refresh Token，使用 .env 中的 CLIENT_ID 验证"""
+    if not CLIENT_ID:
+        print("❌ 错误: 未在 .env 中找到 CLIENT_ID")
+        exit(1)
+
+    print("--- Microsoft Graph Refresh Token 验证工具 ---")
+    print(f"正在使用 Client ID: {CLIENT_ID}")
+    print("此工具将尝试使用 Refresh Token 获取新的 Access Token。")
+    print("如果成功，说明 Token 有效且适合 Public Client 模式。")
+    print("------------------------------------------------")
+
+    # 获取用户输入
+    refresh_token = input("请粘贴你的 Refresh Token (按回车确认): ").strip()
+
+    if not refresh_token:
+        print("❌ 未输入 Token，程序退出。")
+        exit(1)
+
+    # 构造请求
+    url = "https://login.microsoftonline.com/common/oauth2/v2.0/token"
+    data = {
+        "client_id": CLIENT_ID,
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        # 注意：Public Client 刷新时通常不需要 scope，或者使用默认 scope
+        # 但为了保险，我们可以不传，或者传原本的
+    }
+
+    print("\n🚀 正在向微软发送请求...")
+
+    try:
+        response = http_client.post(url, data=data)
+
+        print(f"HTTP 状态码: {response.status_code}")
+
+        if response.status_code == 200:
+            json_resp = response.json()
+            print("\n✅ 验证成功！Token 有效！")
+            print(f"Access Token (前30字符): {json_resp.get('access_token', '')[:30]}...")
+            print(f"新的 Refresh Token (前30字符): {json_resp.get('refresh_token', '')[:30]}...")
+            print("\n结论: 你的 Token 没有任何问题。")
+            print("如果 outlook_manager 仍然报错，请检查代码是否错误地添加了 client_secret 参数，")
+            print("或者 outlook_manager 是否使用了不同的 Client ID。")
+        else:
+            print("\n❌ 验证失败！")
+            print("微软返回的完整错误信息：")
+            print(response.text)
+            print("\n分析提示：")
+            if "AADSTS70002" in response.text:
+                print(f"- AADSTS70002: {ERROR_HINTS['AADSTS70002']}")
+            elif "AADSTS70000" in response.text:
+                print(f"- AADSTS70000: {ERROR_HINTS['AADSTS70000']}")
+
+    except Exception as e:
+        print(f"\n❌ 发生异常: {e}")
+
+    input("\n按回车键退出...")
+
+
+def iter_store_accounts():
+    import account_store
+    for record in account_store.get_store().iter_records():
+        yield record.email, record
+
+
+def iter_stdin_accounts():
+    """从标准输入读取 NDJSON ({"email", "refresh_token", "client_id"}，与 bulk_io.py export 的输出兼容)"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        # 合法 JSON 但不是对象 (数组、字符串、数字等) 同样跳过
+        if not isinstance(record, dict):
+            print(f"⚠️ 跳过无效行: {line[:50]}", file=sys.stderr)
+            continue
+        yield record.get("email"), record
+
+
+def check_result(email, account, result):
+    """把刷新结果转换为健康报告中的一条记录"""
+    entry = {"email": email, "client_id": account.get("client_id")}
+    if result["ok"]:
+        entry["status"] = STATUS_HEALTHY
+        return entry
+    import token_refresher
+    code = result.get("error_code")
+    entry["status"] = STATUS_DEAD if result["error_class"] == token_refresher.ERROR_PERMANENT else STATUS_TRANSIENT
+    entry["error_code"] = code
+    entry["reason"] = result["reason"]
+    if code in ERROR_HINTS:
+        entry["hint"] = ERROR_HINTS[code]
+    return entry
+
+
+def batch_check(accounts, concurrency, output=HEALTH_REPORT_FILE):
+    """
+    并发检查 accounts ((email, account) 迭代器) 中的每个 Token，使用账户自己的 client_id，
+    写出健康报告并返回报告内容。
+
+    验证会兑换 refresh_token，旧 Token 可能随之失效，因此结果写回账户存储 (与 token_refresher 相同):
+    轮换后的 refresh_token 写回并解除隔离，永久性失败的账户写入隔离字段。
+    只写回存储中存在、且 refresh_token 与被验证的 Token 相同的账户；--stdin 中的其它账户只出现在健康报告中。
+    """
+    # 延迟导入: 交互模式不需要账户存储与线程池
+    import token_refresher
+    import account_store
+
+    limiter = token_refresher.AdaptiveRateLimiter(
+        token_refresher.REFRESH_RPS, token_refresher.REFRESH_MIN_RPS, token_refresher.REFRESH_MAX_RPS,
+        burst=concurrency,
+    )
+    store = account_store.get_store()
+    entries = []
+    # email -> 写操作 ({"op": "update", ...}，账户不存在时忽略，不会重新创建已删除的账户)
+    updates = {}
+    not_saved = 0
+    started = time.time()
+
+    def flush_updates():
+        if updates:
+            store.apply_batch(list(updates.values()))
+            updates.clear()
+
+    def handle(done):
+        nonlocal not_saved
+        for future in done:
+            email, account, result = future.result()
+            entries.append(check_result(email, account, result))
+            if not result["ok"] and result["error_class"] != token_refresher.ERROR_PERMANENT:
+                continue
+            # 只有验证的正是存储中当前的 refresh_token 时才写回: --stdin 输入的外部 Token 不能覆盖或隔离存储中的账户
+            key, current = store.get(email)
+            if key is None or current.get("refresh_token") != account.get("refresh_token"):
+                not_saved += 1
+                continue
+            if result["ok"]:
+                updates[email] = {"op": "update", "email": email, "fields": {
+                    "refresh_token": result["refresh_token"],
+                    "last_refreshed_at": datetime.now(timezone.utc).isoformat(),
+                    "status": account_store.STATUS_ACTIVE,
+                }, "remove": list(account_store.STALE_STATUS_FIELDS)}
+            else:
+                # 连续失败次数以存储中的记录为准 (--stdin 的输入可能不含隔离字段)
+                failures = 0
+                if current.get("status") == account_store.STATUS_QUARANTINED:
+                    failures = int(current.get("token_failures") or 1)
+                reason = f"{result.get('error_code') or 'permanent'}: {result['reason']}"[:200]
+                updates[email] = {"op": "update", "email": email,
+                                  "fields": account_store.quarantine_fields(failures + 1, reason)}
+        if store.write_batch_size and len(updates) >= store.write_batch_size:
+            flush_updates()
+
+    def check(email, account):
+        return email, account, token_refresher.refresh_account(email, account, limiter)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        for email, account in accounts:
+            if not email or not account.get("refresh_token") or not account.get("client_id"):
+                entries.append({"email": email, "client_id": account.get("client_id"), "status": STATUS_DEAD,
+                                "error_code": None, "reason": "缺少 refresh_token 或 client_id"})
+                continue
+            in_flight.add(executor.submit(check, email, account))
+            if len(in_flight) >= concurrency * 4:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                handle(done)
+        done, _ = wait(in_flight)
+        handle(done)
+
+    flush_updates()
+
+    counts = {STATUS_HEALTHY: 0, STATUS_DEAD: 0, STATUS_TRANSIENT: 0}
+    by_code = {}
+    for entry in entries:
+        counts[entry["status"]] += 1
+        if entry.get("error_code"):
+            by_code[entry["error_code"]] = by_code.get(entry["error_code"], 0) + 1
+
+    report = {
+        "timestamp": datetime.now().isoformat(),
+        "duration_seconds": round(time.time() - started, 2),
+        "total": len(entries),
+        "healthy": counts[STATUS_HEALTHY],
+        "dead": counts[STATUS_DEAD],
+        "transient": counts[STATUS_TRANSIENT],
+        "error_codes": by_code,
+        # 有问题的账户排在前面
+        "accounts": sorted(entries, key=lambda e: (e["status"] == STATUS_HEALTHY, e["email"] or "")),
+    }
+
+    output_dir = os.path.dirname(output)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"📋 共检查 {report['total']} 个账户 (耗时 {report['duration_seconds']}s): "
+          f"正常 {report['healthy']}，失效 {report['dead']}，暂时失败 {report['transient']}")
+    for code, count in sorted(by_code.items(), key=lambda item: -item[1]):
+        print(f"   - {code}: {count} 个" + (f" ({ERROR_HINTS[code]})" if code in ERROR_HINTS else ""))
+    if not_saved:
+        print(f"ℹ️ {not_saved} 个账户不在存储中或 refresh_token 与存储中的不同，结果未写回")
+    print(f"📝 健康报告已写入: {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="验证 Refresh Token (默认交互模式)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--all", action="store_true", help="批量检查账户存储中的所有账户")
+    source.add_argument("--stdin", action="store_true", help="批量检查标准输入中的 NDJSON 账户")
+    parser.add_argument("--concurrency", type=int, help="并发数 (默认 REFRESH_CONCURRENCY)")
+    parser.add_argument("--output", default=HEALTH_REPORT_FILE, help=f"健康报告路径 (默认 {HEALTH_REPORT_FILE})")
+    args = parser.parse_args()
+
+    if not args.all and not args.stdin:
+        interactive()
+        sys.exit(0)
+
+    import token_refresher
+    concurrency = max(1, args.concurrency or token_refresher.REFRESH_CONCURRENCY)
+    accounts = iter_store_accounts() if args.all else iter_stdin_accounts()
+    result = batch_check(accounts, concurrency, args.output)
+    sys.exit(1 if result["dead"] else 0)